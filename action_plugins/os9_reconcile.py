@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import sys
+import time
+
+from ansible.errors import AnsibleActionFail
+from ansible.module_utils.common.text.converters import to_text
+from ansible.module_utils.connection import Connection, ConnectionError
+from ansible.plugins.action import ActionBase
+from ansible.plugins.loader import filter_loader
+
+DOCUMENTATION = """
+    module: os9_reconcile
+    short_description: Plans and pushes the whole manifest of an OS9 switch in one task
+    description:
+      - Loads the running config (from O(config), a fresh snapshot or the switch), plans it with the OS9 filters
+        and sends every block over the persistent connection, in the same order as the separate tasks did:
+        global lines, fanout, predicted (or gathered) config after the fanout, manifest, deleted interfaces.
+      - Each block is sent as its own configure session, and the first block that fails stops the push.
+      - In check mode nothing is sent and every block is reported as planned.
+    requirements:
+      - network_cli connection (dellemc.os9.os9 cliconf)
+    options:
+      interfaces:
+        description: Interface manifest
+        type: dict
+        required: true
+      vlans:
+        description: VLAN manifest
+        type: dict
+        required: true
+      global_lines:
+        description: Top level lines the config must have, sent first if any is missing (default the SSH rate limit
+          and the hostname, see os9_global_lines in the OS9 filters)
+        type: list
+        elements: str
+      config:
+        description: Running config to plan from, as returned by os9_facts (gathered when not given)
+        type: raw
+      snapshot_ttl:
+        description: Seconds a running config snapshot can be reused instead of gathering it (0 disables snapshots)
+        type: float
+        default: 0
+"""
+
+RETURN = """
+    plan:
+      description: Commands of each stage (global, fanout, config, clean)
+      type: dict
+    blocks:
+      description: One entry per block sent, with its stage, lines, status (ok, failed, skipped or planned),
+        seconds and the error message of a failed block
+      type: list
+    config_source:
+      description: Where the running config came from (given, snapshot or gathered)
+      type: str
+    predicted:
+      description: True if the config after the fanout change was predicted instead of gathered
+      type: bool
+"""
+
+ARGUMENT_SPEC = {
+    "interfaces": {"type": "dict", "required": True},
+    "vlans": {"type": "dict", "required": True},
+    "global_lines": {"type": "list", "elements": "str"},
+    "config": {"type": "raw"},
+    "snapshot_ttl": {"type": "float", "default": 0},
+}
+
+
+def load_planner():
+    """
+    Returns the module of the OS9 filters (filter_plugins/dell_os9.py) as the filter loader loaded it, so this
+    action and the filters share one module, with one parsed config cache and one set of interface intern tables
+    """
+
+    os9_filter = filter_loader.get("OS9_GETCONFIG")
+    if os9_filter is None:
+        raise AnsibleActionFail("os9_reconcile needs the OS9 filter plugin (filter_plugins/dell_os9.py)")
+
+    return sys.modules[os9_filter.j2_function.__module__]
+
+
+class ActionModule(ActionBase):
+    _supports_check_mode = True
+
+    def run(self, tmp=None, task_vars=None):
+        result = super().run(tmp, task_vars)
+        del tmp
+
+        _, args = self.validate_argument_spec(argument_spec=ARGUMENT_SPEC)
+
+        socket_path = getattr(self._connection, "socket_path", None)
+        if socket_path is None:
+            raise AnsibleActionFail("os9_reconcile needs a persistent (network_cli) connection")
+
+        self._conn = Connection(socket_path)
+        self._os9 = load_planner()
+        self._hostname = task_vars["inventory_hostname"]
+        self._snapshot_ttl = args["snapshot_ttl"]
+        self._snapshots = self._os9.OS9SnapshotStore()
+        self._blocks = []
+        self._error = None
+        self._pushed = False
+
+        interfaces = args["interfaces"]
+        vlans = args["vlans"]
+        global_lines = args["global_lines"]
+        if global_lines is None:
+            global_lines = [line.format(hostname=self._hostname) for line in self._os9.os9_global_lines]
+
+        sw_config, config_source = self._load_config(args["config"])
+
+        # same plan as helpers/os9_plan.py, except an unpredictable fanout change is gathered again after its push
+        plan, after_fanout = self._os9.os9_planfanout(sw_config, interfaces, global_lines)
+
+        if plan["global"]:
+            self._push("global", [plan["global"]])
+        self._push("fanout", [[line] for line in plan["fanout"]])
+
+        predicted = bool(plan["fanout"]) and after_fanout is not None
+        if after_fanout is not None:
+            sw_config = after_fanout
+        elif self._error is None and not self._task.check_mode:
+            # not saved as a snapshot, the config and clean stages are pushed on top of it
+            sw_config = self._gather(snapshot=False)
+        # in check mode an unpredictable change is planned against the config before it
+
+        self._os9.os9_planmanifest(plan, sw_config, interfaces, vlans)
+
+        self._push("config", plan["config"])
+        self._push("clean", [[line] for line in plan["clean"]])
+
+        result.update({
+            "changed": any(block["status"] in ("ok", "failed", "planned") for block in self._blocks),
+            "plan": plan,
+            "blocks": self._blocks,
+            "config_source": config_source,
+            "predicted": predicted,
+        })
+
+        if self._error is not None:
+            result["failed"] = True
+            result["msg"] = self._error
+
+        return result
+
+    def _load_config(self, config):
+        """
+        Returns the running config to plan from and where it came from
+        """
+
+        if config:
+            return config, "given"
+
+        config_text = self._snapshots.get(self._hostname, self._snapshot_ttl)
+        if config_text is not None:
+            return self._facts(config_text), "snapshot"
+
+        return self._gather(), "gathered"
+
+    def _gather(self, snapshot=True):
+        """
+        Reads the running config from the switch, in the same format as os9_facts, and saves a snapshot of it
+        unless snapshot is false
+        """
+
+        try:
+            config_text = self._conn.get(command="show running-config")
+        except ConnectionError as e:
+            raise AnsibleActionFail(f"Failed to gather the running config: {to_text(e)}")
+
+        if snapshot and self._snapshot_ttl > 0:
+            self._snapshots.put(self._hostname, config_text)
+
+        return self._facts(config_text)
+
+    def _facts(self, config_text):
+        # same format as os9_facts
+        return {"ansible_facts": {"ansible_net_config": config_text, "ansible_net_hostname": self._hostname}}
+
+    def _push(self, stage, blocks):
+        """
+        Sends blocks of commands, each in its own configure session, until one fails
+        """
+
+        for block in blocks:
+            entry = {"stage": stage, "lines": block, "status": "skipped", "seconds": 0.0}
+            self._blocks.append(entry)
+
+            if self._task.check_mode:
+                entry["status"] = "planned"
+                continue
+
+            if self._error is not None:
+                # the rest of the plan depends on the failed block
+                continue
+
+            if not self._pushed:
+                # the snapshot is stale as soon as anything is pushed
+                self._snapshots.drop(self._hostname)
+                self._pushed = True
+
+            start = time.monotonic()
+            try:
+                self._conn.edit_config(block)
+                entry["status"] = "ok"
+            except ConnectionError as e:
+                entry["status"] = "failed"
+                entry["msg"] = to_text(e)
+                self._error = f"{stage} block {block[0]!r} failed: {entry['msg']}"
+                self._leave_config()
+            entry["seconds"] = time.monotonic() - start
+
+    def _leave_config(self):
+        # a failed command leaves the session in config mode
+        try:
+            self._conn.get(command="end")
+        except ConnectionError:
+            pass
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: os9_push_stats
+    type: aggregate
+    short_description: Per host push latency and command volume for OS9 switches
+    description:
+      - Counts the blocks and config lines os9_reconcile sent to each host, and how long each block took.
+      - Prints a summary table at the end of the run, and optionally writes it as JSON.
+    requirements:
+      - enable in ansible.cfg (callbacks_enabled = os9_push_stats)
+    options:
+      json_path:
+        description: File to write the stats to as JSON (not written if unset)
+        default: null
+        env:
+          - name: OS9_PUSH_STATS_JSON
+        ini:
+          - section: callback_os9_push_stats
+            key: json_path
+      tasks:
+        description: Names of the tasks to report on (other tasks count one item per loop item)
+        type: list
+        elements: str
+        default:
+          - Reconcile Switch Configuration
+        ini:
+          - section: callback_os9_push_stats
+            key: tasks
+"""
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers
+    """
+
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    rank = max(1, -(-len(values) * pct // 100))  # ceil
+
+    return values[int(rank) - 1]
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "os9_push_stats"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super().__init__()
+
+        self.tasks = []
+        self.json_path = None
+        self.stats = {}  # host -> task name -> {"items", "failed", "lines", "latencies"}
+        self.last_done = {}  # (host, task uuid) -> time the task started or its last item finished
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super().set_options(task_keys=task_keys, var_options=var_options, direct=direct)
+
+        self.tasks = self.get_option("tasks")
+        self.json_path = self.get_option("json_path")
+
+    def _tracked(self, task):
+        return task.name in self.tasks
+
+    def _add(self, host, task_name, latency, line_count, failed):
+        stats = self.stats.setdefault(host, {}).setdefault(task_name, {"items": 0, "failed": 0, "lines": 0,
+                                                                        "latencies": []})
+        stats["items"] += 1
+        stats["failed"] += int(failed)
+        stats["lines"] += line_count
+        stats["latencies"].append(latency)
+
+    def _record(self, result, failed=False):
+        task = result._task
+        host = result._host.get_name()
+        now = time.monotonic()
+
+        if "blocks" in result._result:
+            # os9_reconcile times each block it sends
+            for block in result._result["blocks"]:
+                if block["status"] in ("ok", "failed"):
+                    self._add(host, task.name, block["seconds"], len(block["lines"]), block["status"] == "failed")
+            return
+
+        started = self.last_done.get((host, task._uuid), now)
+        self.last_done[(host, task._uuid)] = now
+
+        # the lines os9_config sent, or the lines of the item when the module doesn't report them
+        lines = result._result.get("updates")
+        if lines is None:
+            lines = result._result.get("item", [])
+
+        self._add(host, task.name, now - started, len(lines) if isinstance(lines, list) else 1, failed)
+
+    def v2_runner_on_start(self, host, task):
+        if self._tracked(task):
+            self.last_done[(host.get_name(), task._uuid)] = time.monotonic()
+
+    def v2_runner_item_on_ok(self, result):
+        if self._tracked(result._task):
+            self._record(result)
+
+    def v2_runner_item_on_failed(self, result):
+        if self._tracked(result._task):
+            self._record(result, failed=True)
+
+    def v2_runner_on_ok(self, result):
+        # loops are counted per item, this is only the summary of the loop
+        if self._tracked(result._task) and "results" not in result._result:
+            self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        if self._tracked(result._task) and "results" not in result._result:
+            self._record(result, failed=True)
+
+    def _summary(self):
+        out = {}
+
+        for host, host_stats in self.stats.items():
+            out[host] = {}
+            for task_name in self.tasks:
+                if task_name not in host_stats:
+                    continue
+
+                stats = host_stats[task_name]
+                out[host][task_name] = {
+                    "items": stats["items"],
+                    "failed": stats["failed"],
+                    "lines": stats["lines"],
+                    "seconds": sum(stats["latencies"]),
+                    "p50": percentile(stats["latencies"], 50),
+                    "p95": percentile(stats["latencies"], 95),
+                    "max": max(stats["latencies"], default=0.0)
+                }
+
+        return out
+
+    def v2_playbook_on_stats(self, stats):
+        summary = self._summary()
+        if not summary:
+            return
+
+        self._display.banner("OS9 PUSH STATS")
+        self._display.display(f"{'HOST':<24} {'TASK':<30} {'ITEMS':>6} {'LINES':>7} {'P50':>8} {'P95':>8} "
+                              f"{'MAX':>8} {'TOTAL':>9}")
+
+        # slowest hosts first
+        for host in sorted(summary, key=lambda h: -sum(t["seconds"] for t in summary[h].values())):
+            for task_name, task_stats in summary[host].items():
+                failed = f" ({task_stats['failed']} failed)" if task_stats["failed"] else ""
+                self._display.display(f"{host:<24} {task_name:<30} {task_stats['items']:>6} {task_stats['lines']:>7} "
+                                      f"{task_stats['p50']:>7.2f}s {task_stats['p95']:>7.2f}s "
+                                      f"{task_stats['max']:>7.2f}s {task_stats['seconds']:>8.2f}s{failed}")
+
+        if self.json_path:
+            with open(self.json_path, "w") as f:
+                json.dump(summary, f, indent=2)
+            self._display.display(f"OS9 push stats written to {self.json_path}")
@@ -1,957 +1,1881 @@
+import enum
+import functools
+import hashlib
+import json
+import os
 import re
+import tempfile
+import time
+import types
+from collections import OrderedDict, namedtuple
 
-physical_interface_types = [
-    "gigabitethernet",
-    "tengigabitethernet",
-    "twentyfivegige",
-    "fortygige",
-    "hundredgige"
-]
+try:
+    import jsonschema
+    HAS_JSONSCHEMA = True
+except ImportError:
+    HAS_JSONSCHEMA = False
 
-vlan_interface_types = [
-    "vlan"
-]
+# Parsed configs, keyed by a hash of the config text, so each filter doesn't have to parse it again
+os9_config_cache = OrderedDict()
+os9_config_cache_size = 16
 
-lag_interface_types = [
-    "port-channel"
-]
+# Profile of the filter call being profiled, None when profiling is off (see os9_profiledfilter)
+os9_profile = None
 
-def OS9_PARSEINTFRANGE(s, sw_config):
-    output = []  # output list will store all interfaces in the range
+class OS9Profile(object):
+    """
+    Wall time and call counts of every OS9_* phase and os9_* helper during a filter call, plus the number of
+    config lines each one scanned. Times are inclusive (a phase includes the helpers it calls).
+    Functions are only wrapped while a profile is running, so profiling costs nothing when it is off.
+    """
 
-    s_parts = s.split(" ")  # Split input string into type and range parts
-    s_type = s_parts[0]
-    s_range_str = s_parts[1]
+    def __init__(self):
+        self.phases = {}  # OS9_* function -> {"calls", "seconds"}
+        self.helpers = {}  # os9_* function -> {"calls", "seconds"}
+        self.lines = {}  # function -> number of config lines scanned
+        self.patched = {}  # global name -> original function
 
-    s_rangelist = s_range_str.split(",")  # split by commas
+    def wrap(self, func):
+        """
+        Returns func wrapped to count its calls and time
+        """
 
-    for range in s_rangelist:
-        range_parts = range.split("-")  # split by dashes
-        if len(range_parts) == 1:
-            output.append(f"{s_type} {range}")  # no range here
-        else:
-            # this is a range (-)
-            range_0 = range_parts[0]
-            range_1 = range_parts[1]
+        stats_dict = self.phases if func.__name__.startswith("OS9_") else self.helpers
+        stats = stats_dict.setdefault(func.__name__, {"calls": 0, "seconds": 0.0})
 
-            storing = False
-            for line in sw_config:
-                if line.startswith(f"interface {s_type} {range_0}"):
-                    # found range_0
-                    storing = True
+        def profiled(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats["calls"] += 1
+                stats["seconds"] += time.perf_counter() - start
 
-                if storing and line.startswith("interface"):
-                    line_parts = line.split(" ")
-                    intf_label = " ".join(line_parts[1:])
-                    output.append(intf_label)
+        profiled.__name__ = func.__name__
+        return profiled
 
-                if line.startswith(f"interface {s_type} {range_1}"):
-                    # found range_1
-                    break
+    def start(self):
+        """
+        Wraps every os9_* and OS9_* function of the module, and the generators of os9_attribute_rules
+        """
 
-    return output
+        module_globals = globals()
+        for name, value in list(module_globals.items()):
+            if isinstance(value, types.FunctionType) and name.lower().startswith("os9_") \
+                    and not name.startswith(("os9_profile", "OS9_PROFILE")):
+                self.patched[name] = value
+                module_globals[name] = self.wrap(value)
 
-def OS9_GETEXTENDEDCFG(sw_config):
-    output = []
+        for rule in os9_attribute_rules:
+            if "generate" in rule:
+                rule["generate"] = module_globals[rule["generate"].__name__]
 
-    for line in sw_config:
-        if line.startswith("!"):
-            continue
+    def stop(self):
+        """
+        Puts the original functions back
+        """
 
-        line_parts = line.split(" ")
-        num_spaces = line_parts.count("")
-        line_header = line_parts[num_spaces]
-
-        if line_header == "untagged" or line_header == "tagged" or line_header == "channel-member":  #! any others?
-            range_str = " ".join(line_parts[num_spaces + 1:])
-            intf_list = OS9_PARSEINTFRANGE(range_str, sw_config)
-            cfg_list = [f'{" " * num_spaces}{line_header} {i}' for i in intf_list]
-            output += cfg_list
-        else:
-            output.append(line)
+        globals().update(self.patched)
 
-    return output
+        for rule in os9_attribute_rules:
+            if "generate" in rule:
+                rule["generate"] = self.patched[rule["generate"].__name__]
 
-def OS9_GETINTFCONFIG(intf, sw_config):
-    output = []
+    def scanned(self, name, line_count):
+        self.lines[name] = self.lines.get(name, 0) + line_count
 
-    search_label = f"interface {intf}"
-    recording = False
-    for line in sw_config:
-        if line == search_label:
-            recording = True
-            continue
+def os9_profilelines(name, line_count):
+    """
+    Records that a function scanned line_count config lines, if a profile is running
+    """
+
+    if os9_profile is not None:
+        os9_profile.scanned(name, line_count)
 
-        if recording and not line.startswith(" "):
-            break
+def os9_profilehostname(sw_config):
+    """
+    Returns the hostname of a switch, for the name of its profile
+    """
 
-        if recording:
-            output.append(line.strip())
+    if isinstance(sw_config, dict) and sw_config["ansible_facts"].get("ansible_net_hostname"):
+        return sw_config["ansible_facts"]["ansible_net_hostname"]
 
-    return output
+    for line in OS9_LOADCONFIG(sw_config).get_global("hostname "):
+        return line.split(" ")[1]
 
-def OS9_GENERATEINTFCONFIG(intf_label, intf_fields, sw_config, managed_vlan_list, default_list):
-    """
-    This will generate a sequence of OS9 commands for a single interface based on existing and manifest config.
+    return "switch"
 
-    :param intf_label: Name of interface
-    :type intf_label: str
-    :param intf_fields: Fields from manifest of interface
-    :type intf_fields: str
-    :param sw_config: Switch configuration lines
-    :type sw_config: list
-    :return list of os9 commands:
-    :rtype: list
+def os9_profilewrite(profile_dir, hostname, filter_name, seconds, profile):
+    """
+    Adds the profile of a filter call to the JSON profile of the host (PROFILE_DIR/HOSTNAME.json)
     """
-    def os9_searchconfig(sw_config, search_keys, line_keys, intf_search):
-        """
-        Searches through config lines for specific subitem "line keys" from parent "search keys"
-        This is useful for finding existing VLAN/LACP mappins since OS9 does it backwards
-
-        :param sw_config: Switch configuration lines
-        :type sw_config: list
-        :param search_keys: List of parent keys to find in the config
-        :type search_keys: list
-        :param line_keys: List of subitem items to find below the parent (no leading spaces)
-        :type line_keys: list
-        :param intf_search: name of interface to match
-        :type intf_search: str
-        :return: List of parents found that match a all keys
-        :rtype: list
-        """
-        out = []
 
-        search_keys = ["interface " + i for i in search_keys]
+    path = os.path.join(profile_dir, hostname.replace(os.sep, "_") + ".json")
 
-        cur_line = ""
-        for line in sw_config:
-            line_str = line.strip()
-            if line_str.lower().startswith(tuple(search_keys)):
-                cur_line = line
-            elif line_str.startswith("interface") and cur_line != "":
-                cur_line = ""
+    try:
+        with open(path) as f:
+            out = json.load(f)
+    except (OSError, ValueError):
+        out = {"hostname": hostname, "filters": [], "phases": {}, "helpers": {}, "lines_scanned": {}}
 
-            if line_str.startswith(tuple(line_keys)) and cur_line != "":
-                line_parts = line_str.split(" ")
+    out["filters"].append({"filter": filter_name, "timestamp": time.time(), "seconds": seconds})
 
-                if line_parts[0].lower() == "port-channel":
-                    # port channel is part of the name so that has to stay
-                    line_intf_label = " ".join(line_parts[:2])
-                else:
-                    line_intf_label = " ".join(line_parts[1:])
+    for key, stats_dict in (("phases", profile.phases), ("helpers", profile.helpers)):
+        for name, stats in stats_dict.items():
+            if stats["calls"] == 0:
+                continue
 
-                parent_label = " ".join(cur_line.split(" ")[1:3])
+            total = out[key].setdefault(name, {"calls": 0, "seconds": 0.0})
+            total["calls"] += stats["calls"]
+            total["seconds"] += stats["seconds"]
 
-                if line_intf_label.lower() == intf_search.lower():
-                    # found interface
-                    out.append(parent_label)
+    for name, line_count in profile.lines.items():
+        out["lines_scanned"][name] = out["lines_scanned"].get(name, 0) + line_count
 
-        return out
+    os.makedirs(profile_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=profile_dir, prefix=".profile-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(out, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
-    def os9_name(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "name" attribute (only for VLAN interfaces)
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set name
-        :rtype: list
-        """
+def os9_profiledfilter(func):
+    """
+    Lets a filter be profiled, with a profile="DIR" argument or the OS9_PROFILE_DIR environment variable.
+    The profile of each call is added to DIR/HOSTNAME.json.
+    """
 
-        out = []
+    @functools.wraps(func)
+    def filter_func(sw_config, *args, profile=None, **kwargs):
+        global os9_profile
 
-        if "name" in man_fields:
-            # Name attribute exists in the manifest
-            conf_line = f"name {man_fields['name']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+        profile_dir = profile or os.environ.get("OS9_PROFILE_DIR")
+        if not profile_dir or os9_profile is not None:
+            # off, or already profiled by the filter that called this one
+            return func(sw_config, *args, **kwargs)
+
+        os9_profile = OS9Profile()
+        os9_profile.start()
+        start = time.perf_counter()
+        try:
+            out = func(sw_config, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            cur_profile = os9_profile
+            cur_profile.stop()
+            os9_profile = None
 
-        elif any(item.startswith("name") for item in running_fields) and not default_port:
-            # Name attribute exists on the switch, but shouldn't
-            out.append("no name")
+        os9_profilewrite(profile_dir, os9_profilehostname(sw_config), func.__name__, seconds, cur_profile)
 
         return out
 
-    def os9_description(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "description" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set description
-        :rtype: list
-        """
+    return filter_func
 
-        out = []
+# Lines of a config (without the line breaks), so the text isn't split into a list first
+os9_line_re = re.compile(r"[^\r\n]+")
 
-        if "description" in man_fields:
-            # Description attribute exists in the manifest
-            conf_line = f"description {man_fields['description']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+# Config lines that list interfaces as ranges (ex. "tagged TenGigabitEthernet 1/1-1/4,1/6")
+os9_member_keys = ("untagged", "tagged", "channel-member")
 
-        elif any(item.startswith("description") for item in running_fields) and not default_port:
-            # Description attribute exists on the switch, but shouldn't
-            out.append("no description")
+class OS9Record(namedtuple("OS9Record", ["kind", "indent", "text", "label", "spans"])):
+    """
+    A line of the running config, as produced by os9_tokenize. kind is one of:
 
-        return out
+    - "global": top level line (ex. "hostname sw1", "stack-unit 1 port 49 portmode quad")
+    - "interface": interface header, label is the interface label (ex. "TenGigabitEthernet 1/1")
+    - "line": indented line, text is stripped and indent is the number of leading spaces
+    - "member": indented line listing interfaces (see os9_member_keys), label is the interface type and
+      spans the ranges as (first port, last port) tuples, not expanded
+    """
 
-    def os9_state(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "state" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set state
-        :rtype: list
-        """
+    __slots__ = ()
 
-        out = []
+    @property
+    def mode(self):
+        # "untagged", "tagged" or "channel-member"
+        return self.text.split(" ", 1)[0]
 
-        # Create a no prefix based on manifest value
-        if "state" in man_fields and man_fields["state"] == "up":
-            no_str = "no "
-        else:
-            no_str = ""
+    def render(self):
+        return " " * self.indent + self.text
 
-        conf_line = f"{no_str}shutdown"
-        if conf_line not in running_fields or default_port:
-            out.append(conf_line)  # add to out only if not already in switch conf
+def os9_rangespans(range_str):
+    """
+    Parses an OS9 interface range (ex. "TenGigabitEthernet 1/1-1/4,1/6") without expanding it
 
-        return out
+    :param range_str: Interface range string
+    :type range_str: str
+    :return: Tuple of <interface type>,<tuple of (first port, last port)>, or None if it isn't a range
+    :rtype: tuple
+    """
 
-    def os9_mtu(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "mtu" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set mtu
-        :rtype: list
-        """
+    range_parts = range_str.split(" ")
+    if len(range_parts) != 2:
+        return None
 
-        out = []
+    spans = []
+    for range_item in range_parts[1].split(","):
+        span = range_item.split("-")
+        spans.append((span[0], span[-1]))
 
-        if "mtu" in man_fields:
-            # mtu attribute exists in the manifest
-            conf_line = f"mtu {str(intf_fields['mtu'])}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+    return range_parts[0], tuple(spans)
 
-        elif any(item.startswith("mtu") for item in running_fields) and not default_port:
-            # mtu attribute exists on the switch, but shouldn't
-            out.append("no mtu")
+def os9_expandspans(intf_type, spans, port_index=None):
+    """
+    Expands interface ranges into a list of interfaces.
+    Ranges are taken from the port index when both ends exist in the config, otherwise the last
+    number of the port is counted up (this also works for fanout ports like "1/49/1-1/49/4").
+
+    :param intf_type: Interface type of the ranges (ex. "TenGigabitEthernet")
+    :type intf_type: str
+    :param spans: List of (first port, last port) tuples
+    :type spans: list
+    :param port_index: Index of the interfaces in the config (OS9Config.port_index)
+    :type port_index: dict
+    :return: List of interface labels in the ranges
+    :rtype: list
+    """
 
-        return out
+    output = []
 
-    def os9_autoneg(intf_label, man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "autoneg" attribute
-
-        :param intf_label: Name of interface
-        :type intf_label: str
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set autoneg
-        :rtype: list
-        """
+    if port_index is None:
+        port_index = {}
+    intf_labels,intf_positions = port_index.get(intf_type.lower(), ([], {}))
 
-        intf_type = intf_label.split(" ")[0].lower()
+    for range_0,range_1 in spans:
+        if range_0 == range_1:
+            output.append(f"{intf_type} {range_0}")  # no range here
+            continue
 
-        if intf_type == "gigabitethernet" or intf_type == "tengigabitethernet":
-            # support negotiation command
-            conf_line = "negotiation auto"
-        elif intf_type == "twentyfivegige":
-            conf_line = "intf-type cr1 autoneg"
-        elif intf_type == "fiftygige":
-            conf_line = "intf-type cr2 autoneg"
-        elif intf_type == "hundredgige" or intf_type == "fortygige":
-            conf_line = "intf-type cr4 autoneg"
+        if range_0 in intf_positions and range_1 in intf_positions and intf_positions[range_0] <= intf_positions[range_1]:
+            # both ends are in the config, so take everything in between
+            output += intf_labels[intf_positions[range_0]:intf_positions[range_1] + 1]
+            continue
 
-        out = []
+        range_0_parts = range_0.split("/")
+        range_1_parts = range_1.split("/")
 
-        if "autoneg" in man_fields and not man_fields["autoneg"]:
-            conf_line = f"no {conf_line}"
+        if len(range_0_parts) == len(range_1_parts) and range_0_parts[:-1] == range_1_parts[:-1]:
+            # same unit (and parent port), count up the last number (port-channels and VLANs only have one)
+            port_prefix = "".join(f"{part}/" for part in range_0_parts[:-1])
+            for port_num in range(int(range_0_parts[-1]), int(range_1_parts[-1]) + 1):
+                output.append(f"{intf_type} {port_prefix}{port_num}")
+        else:
+            # range spans stack units and isn't in the config, keep the ends
+            output.append(f"{intf_type} {range_0}")
+            output.append(f"{intf_type} {range_1}")
 
-            if conf_line not in running_config or default_port:
-                out.append(conf_line)
+    return output
 
-        elif any("autoneg" in i for i in running_fields) or any("negotiation" in i for i in running_fields):
-            out.append(conf_line)
+def OS9_PARSEINTFRANGE(s, port_index=None):
+    """
+    Expands an OS9 interface range (ex. "TenGigabitEthernet 1/1-1/4,1/6") into a list of interfaces
 
-        return out
+    :param s: Interface range string
+    :type s: str
+    :param port_index: Index of the interfaces in the config (OS9Config.port_index)
+    :type port_index: dict
+    :return: List of interface labels in the range
+    :rtype: list
+    """
 
-    def os9_fec(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "fec" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set fec
-        :rtype: list
-        """
+    return os9_expandspans(*os9_rangespans(s), port_index)
 
-        out = []
+def os9_tokenize(sw_config):
+    """
+    Reads a running config one line at a time and yields a record for each line, without expanding ranges.
+    Strings that repeat (common lines, interface types, identical ranges) are shared within the config, so
+    the records take about as much memory as the config text.
 
-        # Create a no prefix based on manifest value
-        if "fec" in man_fields:
-            if man_fields["fec"]:
-                conf_line = "fec enable"
-            else:
-                conf_line = "no fec enable"
+    :param sw_config: Config text, or an iterable of config lines
+    :type sw_config: str
+    :return: Generator of OS9Record
+    :rtype: generator
+    """
 
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)
-        elif any("fec" in i for i in running_fields):
-            # fec field exists
-            conf_line = "fec default"
-            out.append(conf_line)
+    strings = {}  # config strings are interned per config, not for the whole process
+    spans_cache = {}  # range string -> (interface type, spans)
 
-        return out
+    if isinstance(sw_config, str):
+        config_lines = (match.group() for match in os9_line_re.finditer(sw_config))
+    else:
+        config_lines = sw_config
 
-    def os9_ip4(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "ip4" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set ip4
-        :rtype: list
-        """
+    line_count = 0
+    for line in config_lines:
+        line_count += 1
 
-        out = []
+        if line.startswith("!"):
+            continue
 
-        if "ip4" in man_fields:
-            # ip4 attribute exists in the manifest
-            conf_line = f"ip address {man_fields['ip4']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+        if not line.startswith(" "):
+            if line.startswith("interface "):
+                yield OS9Record("interface", 0, strings.setdefault(line, line),
+                                strings.setdefault(line[len("interface "):], line[len("interface "):]), None)
+            else:
+                yield OS9Record("global", 0, strings.setdefault(line, line), None, None)
+            continue
 
-        elif any(item.startswith("ip address") for item in running_fields) and not default_port:
-            # ip4 attribute exists on the switch, but shouldn't
-            out.append("no ip address")
+        line_str = line.strip()
+        indent = len(line) - len(line.lstrip(" "))
+        line_parts = line_str.split(" ", 1)
 
-        return out
+        if line_parts[0] in os9_member_keys and len(line_parts) > 1:
+            if line_parts[1] not in spans_cache:
+                member_range = os9_rangespans(line_parts[1])
+                if member_range is not None:
+                    # (first port, last port) pairs repeat across ranges, so they are shared too
+                    member_range = (member_range[0], tuple(strings.setdefault(span, span) for span in member_range[1]))
+                spans_cache[line_parts[1]] = member_range
+            member_range = spans_cache[line_parts[1]]
 
-    def os9_ip6(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "ip6" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set ip6
-        :rtype: list
-        """
+            if member_range is not None:
+                yield OS9Record("member", indent, strings.setdefault(line_str, line_str),
+                                strings.setdefault(member_range[0], member_range[0]), member_range[1])
+                continue
 
-        out = []
+        yield OS9Record("line", indent, strings.setdefault(line_str, line_str), None, None)
 
-        if "ip6" in man_fields:
-            # ip6 attribute exists in the manifest
-            conf_line = f"ipv6 address {man_fields['ip6']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+    os9_profilelines("os9_tokenize", line_count)
 
-        elif any(item.startswith("ipv6 address") for item in running_fields) and not default_port:
-            # ip6 attribute exists on the switch, but shouldn't
-            out.append("no ipv6 address")
+class OS9IntfKind(enum.IntEnum):
+    """
+    Interface types, in the order interfaces are sorted
+    """
 
-        return out
+    GIGABITETHERNET = 1
+    TENGIGABITETHERNET = 2
+    TWENTYFIVEGIGE = 3
+    FORTYGIGE = 4
+    HUNDREDGIGE = 5
+    PORTCHANNEL = 6
+    VLAN = 7
+    OTHER = 8
+
+os9_intf_kinds = {
+    "gigabitethernet": OS9IntfKind.GIGABITETHERNET,
+    "tengigabitethernet": OS9IntfKind.TENGIGABITETHERNET,
+    "twentyfivegige": OS9IntfKind.TWENTYFIVEGIGE,
+    "fortygige": OS9IntfKind.FORTYGIGE,
+    "hundredgige": OS9IntfKind.HUNDREDGIGE,
+    "port-channel": OS9IntfKind.PORTCHANNEL,
+    "vlan": OS9IntfKind.VLAN
+}
+
+# Interface IDs by label as written, and by normalized key, so each label is only parsed once
+# and equal interfaces are usually the same object. Both are cleared when they reach os9_intf_cache_size
+# labels, so long running processes (plan workers, the emulator) don't keep every label they ever saw.
+os9_intf_ids = {}
+os9_intf_keys = {}
+os9_intf_cache_size = 65536
+
+@functools.total_ordering
+class OS9IntfId(object):
+    """
+    Normalized interface identifier (ex. "TenGigabitEthernet 1/49/2" is unit 1, port 49, sub-port 2).
+    IDs are interned by os9_intfid, so equal IDs are usually the same object, but they compare and hash by
+    their normalized key, so IDs from before the intern tables were cleared still match. They sort by type
+    and then numerically. Labels that don't parse (unknown types or numbers) are kind OTHER and keep their
+    normalized text, so they still only match themselves.
+    """
 
-    def os9_edgeport(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "edge-port" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set edge-port
-        :rtype: list
-        """
+    __slots__ = ("kind", "type_name", "unit", "port", "subport", "label", "sort_key", "key_hash")
+
+    def __init__(self, kind, type_name, unit, port, subport, label, sort_key):
+        self.kind = kind
+        self.type_name = type_name  # lowercase (ex. "tengigabitethernet")
+        self.unit = unit  # stack unit, 0 for interfaces without one (VLANs, port-channels)
+        self.port = port  # port number, or the VLAN/port-channel ID
+        self.subport = subport  # sub-port of a fanout port, 0 if it isn't one
+        self.label = label  # label as first seen
+        self.sort_key = sort_key
+        self.key_hash = hash(sort_key)
+
+    @classmethod
+    def parse(cls, label):
+        label_parts = label.split()
+        type_name = label_parts[0].lower() if label_parts else ""
+        num_str = " ".join(label_parts[1:])
+
+        kind = os9_intf_kinds.get(type_name, OS9IntfKind.OTHER)
+        nums = [int(num) for num in num_str.split("/")] if num_str.replace("/", "").isdigit() else []
+
+        if kind in (OS9IntfKind.PORTCHANNEL, OS9IntfKind.VLAN) and len(nums) == 1:
+            unit,port,subport = 0, nums[0], 0
+        elif kind != OS9IntfKind.OTHER and len(nums) in (2, 3):
+            unit,port,subport = nums[0], nums[1], nums[2] if len(nums) == 3 else 0
+        else:
+            kind = OS9IntfKind.OTHER
+            unit,port,subport = 0, 0, 0
 
-        out = []
+        # the text only tells OTHER interfaces apart, the numbers do for the rest
+        sort_key = (kind, type_name if kind == OS9IntfKind.OTHER else "", unit, port, subport,
+                    num_str if kind == OS9IntfKind.OTHER else "")
 
-        # Every edge port interface will be defined as an edge port for all 3 protocols
-        os9_stp_types = ["rstp", "pvst", "mstp"]
+        return cls(kind, type_name, unit, port, subport, label, sort_key)
 
-        is_edgeport = "stp-edge" in man_fields and man_fields["stp-edge"]
-        for stp_type in os9_stp_types:
-            # Loop through each stp type available
-            conf_line = f"spanning-tree {stp_type} edge-port"
-            if is_edgeport:
-                if conf_line not in running_fields or default_port:
-                    out.append(conf_line)  # add to out only if not already in switch conf
-            else:
-                if conf_line in running_fields and not default_port:
-                    out.append(f"no {conf_line}")
+    @property
+    def numbers(self):
+        return self.unit, self.port, self.subport
 
-        return out
+    @property
+    def is_physical(self):
+        return self.kind <= OS9IntfKind.HUNDREDGIGE
 
-    def os9_portmode(man_fields, running_fields):
-        """
-        Create OS9 commands for "portmode" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :return: Tuple of <OS9 commands to set portmode>,<defaulted port>
-        :rtype: tuple
-        """
+    @property
+    def is_lag(self):
+        return self.kind == OS9IntfKind.PORTCHANNEL
 
-        out = []
-        def_intf = False  # if true then the interface needs to be defaulted before continuing
+    @property
+    def is_vlan(self):
+        return self.kind == OS9IntfKind.VLAN
 
-        if "portmode" in man_fields:
-            if "port-channel-protocol LACP" in running_fields:
-                # default interface if part of lag
-                def_intf = True
+    @classmethod
+    def intern(cls, label):
+        # stable name for pickle, os9_intfid is replaced by a wrapper while profiling
+        return os9_intfid(label)
 
-            intf_portmode = intf_fields["portmode"]
+    def __eq__(self, other):
+        return self is other or (isinstance(other, OS9IntfId) and self.sort_key == other.sort_key)
 
-            has_switchport = "switchport" in running_fields
-            has_portmode = "portmode hybrid" in running_fields
+    def __hash__(self):
+        return self.key_hash
 
-            if intf_portmode == "hybrid":
-                # for hybrid port, portmode hybrid needs to go first
-                if not has_portmode:
-                    out.append("portmode hybrid")
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
 
-                    if has_switchport:
-                        # You cannot apply portmode hybrid unless switchport doesn't exist
-                        def_intf = True
+    def __reduce__(self):
+        # unpickled IDs are interned again
+        return OS9IntfId.intern, (self.label,)
 
-            if not has_switchport or def_intf:
-                out.append("switchport")  # only apply if not already on switch
+    def __repr__(self):
+        return f"OS9IntfId({self.label!r})"
 
-            if not def_intf:
-                # remove L3 fields since they are mutually exclusive if they exist
-                if any(item.startswith("ip address") for item in running_fields):
-                    out.insert(0, "no ip address")
+    def __str__(self):
+        return self.label
 
-                if any(item.startswith("ipv6 address") for item in running_fields):
-                    out.insert(0, "no ipv6 address")
-        else:
-            if "switchport" in running_fields:
-                def_intf = True
+def os9_intfid(label):
+    """
+    Returns the interned ID of an interface label, so lookups don't depend on case or spacing
 
-            if "portmode hybrid" in running_fields and not def_intf:
-                out.append("no portmode hybrid")
+    :param label: Interface label (ex. "TenGigabitEthernet 1/1"), or an ID
+    :type label: str
+    :return: Interface ID
+    :rtype: OS9IntfId
+    """
 
-        return out,def_intf
+    intf_id = os9_intf_ids.get(label)
+    if intf_id is not None:
+        return intf_id
 
-    def getTaggedVlanList(tagList):
-        """
-        The manifest allows tagged vlans to be specified as a range like 1000:1010
-        This method parses that
+    if isinstance(label, OS9IntfId):
+        return label
 
-        :param tagList: String to be parsed
-        :type tagList: str
-        :return: List of each vlan in the list
-        :rtype: list
-        """
+    if len(os9_intf_ids) >= os9_intf_cache_size:
+        os9_intf_ids.clear()
+        os9_intf_keys.clear()
 
-        out = []
+    intf_id = OS9IntfId.parse(label)
+    intf_id = os9_intf_keys.setdefault(intf_id.sort_key, intf_id)
+    os9_intf_ids[label] = intf_id
 
-        for list_item in tagList:
-            item_parts = str(list_item).split(":")
+    return intf_id
 
-            if len(item_parts) == 1:
-                out += item_parts
-            else:
-                vlan_list = list(range(int(item_parts[0]), int(item_parts[1]) + 1))
-                out += map(str, vlan_list)
+def os9_vlanbits(vlan_list):
+    """
+    The manifest allows tagged vlans to be specified as a range like 1000:1010
+    This method parses that into a bitset (bit N is set if vlan N is in the list)
 
-        return out
+    :param vlan_list: List of vlans or vlan ranges
+    :type vlan_list: list
+    :return: Bitset of vlans
+    :rtype: int
+    """
 
-    def os9_cleanvlans(intf_label, sw_config, man_fields, default_port, managed_vlan_list):
-        """
-        Create OS9 commands for cleaning vlans
-
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param defaulted: If true, this interface is defaulted before executing
-        :type defaulted: boolean
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :param managed_vlan_list: List of VLANs that are managed
-        :type managed_vlan_list: list
-        :return: List of OS9 commands to set clean vlans
-        :rtype: list
-        """
+    out = 0
 
-        out = []
+    for list_item in vlan_list:
+        item_parts = str(list_item).split(":")
 
-        if default_port:
-            return out
+        if len(item_parts) == 1:
+            out |= 1 << int(item_parts[0])
+        else:
+            range_start = int(item_parts[0])
+            range_end = int(item_parts[1])
+            if range_end >= range_start:
+                out |= ((1 << (range_end - range_start + 1)) - 1) << range_start
 
-        for vlan_mode in ["untagged", "tagged"]:
-            existing_vlan_list = os9_searchconfig(sw_config, vlan_interface_types, [vlan_mode], intf_label)
+    return out
 
-            if vlan_mode == "tagged" and "tagged" in man_fields:
-                check_vllist = getTaggedVlanList(man_fields["tagged"])
-            elif vlan_mode == "untagged" and "untagged" in man_fields:
-                check_vllist = [str(man_fields["untagged"])]
-            else:
-                check_vllist = []
+def os9_vlanruns(vlan_bits):
+    """
+    Splits a vlan bitset into runs of contiguous vlans
 
-            for existing_vlan in existing_vlan_list:
-                vlan_id = existing_vlan.split(" ")[-1]
-                if not vlan_id in check_vllist and not vlan_id in managed_vlan_list:
-                    # Don't remove managed vlan
-                    cur_intf_cfg = []
+    :param vlan_bits: Bitset of vlans
+    :type vlan_bits: int
+    :return: List of (first vlan, last vlan) tuples
+    :rtype: list
+    """
 
-                    cur_intf_cfg.append(f"interface {str(existing_vlan)}")
-                    conf_line = f"no {vlan_mode} {intf_label}"
-                    cur_intf_cfg.append(conf_line)
+    out = []
 
-                    out.append(cur_intf_cfg)
+    while vlan_bits:
+        run_start = (vlan_bits & -vlan_bits).bit_length() - 1  # lowest set bit
+        run_bits = vlan_bits >> run_start
+        run_length = ((run_bits ^ (run_bits + 1)).bit_length()) - 1  # number of trailing 1s
 
-        return out
+        out.append((run_start, run_start + run_length - 1))
+        vlan_bits &= ~(((1 << run_length) - 1) << run_start)
 
-    def os9_untagged(intf_label, sw_config, man_fields, default_port):
-        """
-        Create OS9 commands for "untagged" attribute
-
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param defaulted: If true, this interface is defaulted before executing
-        :type defaulted: boolean
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set untagged
-        :rtype: list
-        """
+    return out
 
-        out = []
+class OS9Config(object):
+    """
+    Parsed switch configuration.
 
-        if "untagged" in man_fields:
-            untagged_vlan = str(man_fields["untagged"])
-            vlan_intf_label = f"Vlan {untagged_vlan}"
+    Every interface block is indexed by its normalized label so lookups don't rescan the config.
+    VLAN and port-channel memberships are indexed in reverse (member -> parent) in the same pass,
+    since OS9 lists them under the parent instead of the member.
+    Physical ports are indexed by stack unit and port with their sub-ports and fanout line, for the fanout planner.
+    Ranges are only expanded for the membership indexes, the records keep them as spans.
+    """
 
-            vlan_running_fields = OS9_GETINTFCONFIG(vlan_intf_label, sw_config)
-            conf_line = f"untagged {intf_label}"
+    def __init__(self, records):
+        """
+        :param records: Records of the running config (see os9_tokenize)
+        :type records: iterable
+        """
 
-            if conf_line not in vlan_running_fields or default_port:
-                cur_intf_cfg = []
+        self.records = []
+        self.blocks = {}  # interface ID -> list of sub-lines (stripped)
+        self.port_index = {}  # interface type (lowercase) -> (list of interface labels, dict of port number -> position)
+        self.vlan_members = {"untagged": {}, "tagged": {}}  # vlan mode -> member ID -> list of vlan labels
+        self.lacp_members = {}  # port-channel ID -> list of member labels
+        self.channel_lags = {}  # member ID -> label of the port-channel it is a channel-member of
+        self.ports = {}  # (unit, port) -> {"parent": label, "children": list of sub-port labels, "stackunit": line}
+        self.fanout_ports = []  # (unit, port) of the stack-unit fanout lines, in the order they appear
+
+        # ranges are expanded once every interface is in the port index
+        vlan_records = []  # (vlan label, record)
+        channel_records = []  # (port-channel label, block, position in the block, record)
+
+        cur_block = None
+        cur_label = None
+        cur_id = None
+        for record in records:
+            self.records.append(record)
+
+            if record.kind == "interface":
+                cur_label = record.label
+                label_parts = cur_label.split(" ")
+                cur_id = os9_intfid(cur_label)
+                if cur_id in self.blocks:
+                    # only the first block for a label is used
+                    cur_block = None
+                else:
+                    cur_block = self.blocks[cur_id] = []
+
+                    if cur_id.is_physical:
+                        port = self._port(cur_id.unit, cur_id.port)
+                        if cur_id.subport:
+                            port["children"].append(cur_label)
+                        else:
+                            port["parent"] = cur_label
+
+                if len(label_parts) == 2:
+                    intf_labels,intf_positions = self.port_index.setdefault(cur_id.type_name, ([], {}))
+                    if label_parts[1] not in intf_positions:
+                        intf_positions[label_parts[1]] = len(intf_labels)
+                        intf_labels.append(cur_label)
+            elif record.kind == "global":
+                cur_block = None
+
+                # stack-unit U port P portmode quad [speed 10G]
+                line_parts = record.text.split(" ") if record.text.startswith("stack-unit ") else ()
+                if (len(line_parts) >= 6 and line_parts[2] == "port" and line_parts[4] == "portmode"
+                        and line_parts[1].isdigit() and line_parts[3].isdigit()):
+                    unit_port = (int(line_parts[1]), int(line_parts[3]))
+                    port = self._port(*unit_port)
+                    if port["stackunit"] is None:
+                        port["stackunit"] = record.text
+                        self.fanout_ports.append(unit_port)
+            elif cur_block is not None:
+                if record.kind == "member" and record.mode == "channel-member":
+                    # expanded into one line per member
+                    channel_records.append((cur_label, cur_block, len(cur_block), record))
+                elif record.kind == "member" and cur_id.is_vlan and record.mode in self.vlan_members:
+                    vlan_records.append((cur_label, record))
+                elif cur_id.is_physical and record.text.split(" ", 1)[0].lower() == "port-channel":
+                    # lacp membership (port-channel N mode active/passive), indexed by port-channel
+                    lag_id = os9_intfid(" ".join(record.text.split(" ")[:2]))
+                    self.lacp_members.setdefault(lag_id, []).append(cur_label)
+
+                cur_block.append(record.text)
+
+        os9_profilelines("OS9Config", len(self.records))
+
+        # identical ranges share their spans, so each is only expanded once
+        member_ids = {}  # (interface type, spans) -> list of member IDs
+        for vlan_label,record in vlan_records:
+            range_key = (record.label, record.spans)
+            if range_key not in member_ids:
+                member_ids[range_key] = [os9_intfid(member) for member in self.expand(record)]
+
+            vlan_members = self.vlan_members[record.mode]
+            for member_id in member_ids[range_key]:
+                vlan_members.setdefault(member_id, []).append(vlan_label)
+
+        for lag_label,cur_block,position,record in reversed(channel_records):
+            members = self.expand(record)
+            cur_block[position:position + 1] = [f"channel-member {member}" for member in members]
+            for member in members:
+                self.channel_lags[os9_intfid(member)] = lag_label
+
+    def _port(self, unit, port):
+        return self.ports.setdefault((unit, port), {"parent": None, "children": [], "stackunit": None})
+
+    def expand(self, record):
+        """
+        Returns the interfaces of a "member" record
 
-                cur_intf_cfg.append(f"interface {vlan_intf_label}")
-                cur_intf_cfg.append(conf_line)
-                out.append(cur_intf_cfg)
+        :param record: Record listing interfaces
+        :type record: OS9Record
+        :return: List of interface labels
+        :rtype: list
+        """
 
-        return out
+        return os9_expandspans(record.label, record.spans, self.port_index)
 
-    def os9_tagged(intf_label, sw_config, man_fields, default_port):
+    def get_global(self, prefix):
         """
-        Create OS9 commands for "tagged" attribute
-
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param defaulted: If true, this interface is defaulted before executing
-        :type defaulted: boolean
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set tagged
+        Returns the top level lines that start with a prefix
+
+        :param prefix: Start of the lines (ex. "stack-unit ")
+        :type prefix: str
+        :return: List of config lines
         :rtype: list
         """
 
-        out = []
-
-        if "tagged" in man_fields:
-            tagged_vllist = getTaggedVlanList(man_fields["tagged"])
-        else:
-            tagged_vllist = []
+        return [record.text for record in self.records if record.kind == "global" and record.text.startswith(prefix)]
 
-        if "tagged" in man_fields:
-            for cur_vlan in tagged_vllist:
-                vlan_intf_label = f"Vlan {str(cur_vlan)}"
+    def get_labels(self):
+        """
+        Returns the labels of the interfaces in the config, in the order they appear
 
-                vlan_running_fields = OS9_GETINTFCONFIG(vlan_intf_label, sw_config)
-                conf_line = f"tagged {intf_label}"
+        :return: List of interface labels
+        :rtype: list
+        """
 
-                if conf_line not in vlan_running_fields or default_port:
-                    cur_intf_cfg = []
+        return [record.label for record in self.records if record.kind == "interface"]
 
-                    cur_intf_cfg.append(f"interface {vlan_intf_label}")
-                    cur_intf_cfg.append(conf_line)
-                    out.append(cur_intf_cfg)
+    def get_port(self, unit, port):
+        """
+        Returns the interfaces and fanout line of a physical port
+
+        :param unit: Stack unit number
+        :type unit: int
+        :param port: Port number
+        :type port: int
+        :return: Dict with "parent" (label or None), "children" (list of sub-port labels) and "stackunit"
+                 (fanout line or None)
+        :rtype: dict
+        """
 
-        return out
+        return self.ports.get((unit, port), {"parent": None, "children": [], "stackunit": None})
 
-    def os9_lagmembers(man_fields, running_fields, default_port):
+    def get_intf(self, intf):
         """
-        Create OS9 commands for "lag-members" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set lag-members
+        Returns the sub-lines of an interface block
+
+        :param intf: Label (or ID) of the interface
+        :type intf: str
+        :return: List of config lines below the interface (stripped)
         :rtype: list
         """
 
-        out = []
+        return self.blocks.get(os9_intfid(intf), [])
 
-        if "lag-members" in man_fields:
-            channel_members = man_fields["lag-members"]
+    def get_vlans(self, intf, vlan_mode):
+        """
+        Returns the VLAN interfaces that have an interface as a member
 
-            for lag_member in channel_members:
-                conf_line = f"channel-member {lag_member}"
+        :param intf: Label (or ID) of the member interface
+        :type intf: str
+        :param vlan_mode: "untagged" or "tagged"
+        :type vlan_mode: str
+        :return: List of VLAN labels (ex. "Vlan 10")
+        :rtype: list
+        """
 
-                if conf_line not in running_fields or default_port:
-                    out.append(conf_line)  # add channel member if not on switch
+        return self.vlan_members[vlan_mode].get(os9_intfid(intf), [])
 
-            for cfg_line in running_fields:
-                if cfg_line.startswith("channel-member"):
-                    mem_intf_label = " ".join(cfg_line.split(" ")[1:])
-                    if mem_intf_label not in channel_members and not default_port:
-                        conf_line = f"no channel-member {mem_intf_label}"
-                        out.insert(0, conf_line)  # remove any existing channel members if they exist
+    def get_vlanbits(self, intf, vlan_mode):
+        """
+        Returns the VLANs that have an interface as a member as a bitset
+
+        :param intf: Label (or ID) of the member interface
+        :type intf: str
+        :param vlan_mode: "untagged" or "tagged"
+        :type vlan_mode: str
+        :return: Bitset of vlans
+        :rtype: int
+        """
 
-        return out
+        return os9_vlanbits([vlan_label.split(" ")[-1] for vlan_label in self.get_vlans(intf, vlan_mode)])
 
-    def os9_cleanlacpmembers(intf_label, sw_config, man_fields, default_list):
+    def get_lacpmembers(self, intf):
         """
-        Removed LACP config from ports that need it
-
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :return: List of OS9 commands to clean LACP interfaces
+        Returns the physical interfaces that are LACP members of a port-channel
+
+        :param intf: Label (or ID) of the port-channel
+        :type intf: str
+        :return: List of physical interface labels
         :rtype: list
         """
 
-        out = []
+        return self.lacp_members.get(os9_intfid(intf), [])
 
-        # clean existing members
-        existing_member_list = os9_searchconfig(sw_config, physical_interface_types, ["port-channel"], intf_label)
+    def get_lag(self, intf):
+        """
+        Returns the port-channel that has an interface as a channel-member (static LAG)
 
-        for existing_member in existing_member_list:
-            if not("lacp-members-active" in man_fields and existing_member in man_fields["lacp-members-active"]) and\
-               not("lacp-members-passive" in man_fields and existing_member in man_fields["lacp-members-passive"]):
-                if existing_member in default_list:
-                    continue
+        :param intf: Label (or ID) of the physical interface
+        :type intf: str
+        :return: Label of the port-channel, or None
+        :rtype: str
+        """
+
+        return self.channel_lags.get(os9_intfid(intf))
 
-                cur_intf_cfg = []
+def OS9_LOADCONFIG(sw_config):
+    """
+    Returns the parsed config for gathered switch facts.
+    Configs are cached by the hash of their text, so the same config is only parsed once per process.
 
-                cur_intf_cfg.append(f"interface {existing_member}")
-                conf_line = "no port-channel-protocol LACP"
-                cur_intf_cfg.append(conf_line)
+    :param sw_config: Output of os9_facts (or the config text itself)
+    :type sw_config: dict
+    :return: Parsed switch configuration
+    :rtype: OS9Config
+    """
 
-                out.append(cur_intf_cfg)
+    if isinstance(sw_config, dict):
+        sw_config = sw_config["ansible_facts"]["ansible_net_config"]
 
-        return out
+    config_hash = hashlib.sha256(sw_config.encode()).hexdigest()
 
-    def os9_lacpmembersactive(intf_label, sw_config, man_fields):
-        """
-        Create OS9 commands for "lag-members-active" attribute
-
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :return: List of OS9 commands to set lag-members-active
-        :rtype: list
-        """
+    if config_hash in os9_config_cache:
+        os9_config_cache.move_to_end(config_hash)
+        return os9_config_cache[config_hash]
 
-        out = []
+    conf = OS9Config(os9_tokenize(sw_config))
 
-        if "lacp-members-active" in man_fields:
-            channel_members = man_fields["lacp-members-active"]
+    os9_config_cache[config_hash] = conf
+    while len(os9_config_cache) > os9_config_cache_size:
+        # evict the least recently used config
+        os9_config_cache.popitem(last=False)
 
-            for lag_member in channel_members:
-                lag_member_fields = OS9_GETINTFCONFIG(lag_member, sw_config)
+    return conf
 
-                conf_line = f"{intf_label.lower()} mode active"
-                if conf_line not in lag_member_fields:
-                    cur_intf_cfg = []
+# Running config snapshots, so repeated runs within the TTL don't have to gather the config again
+os9_snapshot_dir = os.environ.get("OS9_SNAPSHOT_DIR",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "ansible-switches", "snapshots"))
 
-                    cur_intf_cfg.append(f"interface {lag_member}")
-                    cur_intf_cfg.append("port-channel-protocol LACP")
-                    cur_intf_cfg.append(conf_line)
+class OS9SnapshotStore(object):
+    """
+    On-disk store of running configs, one JSON file per inventory hostname, used by os9_reconcile and
+    helpers/os9_plan.py (it is not a filter, filters don't write to disk).
+    Each snapshot has the time it was taken and the sha256 of the config, so stale or damaged snapshots are ignored.
+    """
 
-                    out.append(cur_intf_cfg)
+    def __init__(self, snapshot_dir=None):
+        self.snapshot_dir = snapshot_dir or os9_snapshot_dir
 
-        return out
+    def path(self, hostname):
+        return os.path.join(self.snapshot_dir, hostname.replace(os.sep, "_") + ".json")
 
-    def os9_lacpmemberspassive(intf_label, sw_config, man_fields):
+    def get(self, hostname, ttl):
         """
-        Create OS9 commands for "lag-members-passive" attribute
-
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :return: List of OS9 commands to set lag-members-passive
-        :rtype: list
+        Returns the config text of a host if its snapshot is younger than ttl seconds
+
+        :param hostname: Inventory hostname
+        :type hostname: str
+        :param ttl: Maximum age of the snapshot in seconds (0 disables snapshots)
+        :type ttl: int
+        :return: Config text or None
+        :rtype: str
         """
 
-        out = []
-
-        if "lacp-members-passive" in man_fields:
-            channel_members = man_fields["lacp-members-passive"]
-
-            for lag_member in channel_members:
-                lag_member_fields = OS9_GETINTFCONFIG(lag_member, sw_config)
+        if float(ttl) <= 0:
+            return None
 
-                conf_line = f"{intf_label.lower()} mode passive"
-                if conf_line not in lag_member_fields:
-                    cur_intf_cfg = []
+        try:
+            with open(self.path(hostname)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
 
-                    cur_intf_cfg.append(f"interface {lag_member}")
-                    cur_intf_cfg.append("port-channel-protocol LACP")
-                    cur_intf_cfg.append(conf_line)
+        try:
+            if time.time() - snapshot["timestamp"] > float(ttl):
+                return None
 
-                    out.append(cur_intf_cfg)
+            config_text = snapshot["config"]
+            if hashlib.sha256(config_text.encode()).hexdigest() != snapshot["sha256"]:
+                # damaged snapshot, gather it again
+                return None
+        except (KeyError, TypeError, AttributeError):
+            return None
 
-        return out
+        return config_text
 
-    def os9_lacprate(man_fields, running_fields, default_port):
+    def put(self, hostname, config_text):
         """
-        Create OS9 commands for "lacp-rate" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set lacp-rate
-        :rtype: list
+        Saves the config text of a host. The snapshot is written to a temporary file and renamed over the old one,
+        so a reader never sees a partial snapshot.
         """
 
-        out = []
-
-        if "lacp-rate" in man_fields:
-            if man_fields["lacp-rate"] == "fast":
-                conf_line = "lacp fast-switchover"
+        os.makedirs(self.snapshot_dir, exist_ok=True)
 
-                if conf_line not in running_fields or default_port:
-                    out.append(conf_line)
-
-        elif "lacp fast-switchover" in running_fields and not default_port:
-            out.append("no lacp fast-switchover")
+        snapshot = {
+            "hostname": hostname,
+            "timestamp": time.time(),
+            "sha256": hashlib.sha256(config_text.encode()).hexdigest(),
+            "config": config_text
+        }
 
-        return out
+        fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_dir, prefix=".snapshot-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path(hostname))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
-    def os9_mlag(man_fields, running_fields, default_port):
+    def drop(self, hostname):
         """
-        Create OS9 commands for "mlag" attribute
-
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set mlag
-        :rtype: list
+        Removes the snapshot of a host, once commands have been pushed to it
         """
 
-        out = []
+        try:
+            os.unlink(self.path(hostname))
+        except FileNotFoundError:
+            pass
 
-        if "mlag" in man_fields:
-            conf_line = f"vlt-peer-lag {man_fields['mlag'].lower()}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)
+def os9_parseblock(running_fields):
+    """
+    Parses the running config lines of an interface so each attribute can be checked without scanning the lines
 
-        elif any(item.startswith("vlt-peer-lag") for item in running_fields) and not default_port:
-            out.append("no vlt-peer-lag")
+    :param running_fields: Interface attributes in the running config
+    :type running_fields: list
+    :return: Dict with "lines" (set of lines), "keys" (first 1 and 2 words -> lines) and "words" (set of words)
+    :rtype: dict
+    """
 
-        return out
+    out = {
+        "lines": set(running_fields),
+        "keys": {},
+        "words": set()
+    }
 
-    #
-    # Combine all configuration for the interface
-    #
+    for line in running_fields:
+        line_parts = line.split(" ")
 
-    running_config = OS9_GETINTFCONFIG(intf_label, sw_config)
+        out["keys"].setdefault(line_parts[0], []).append(line)
+        if len(line_parts) > 1:
+            out["keys"].setdefault(" ".join(line_parts[:2]), []).append(line)
 
-    cur_intf_cfg = []
-    output = []
+        if line_parts[0] not in ("name", "description"):
+            # free text isn't searched for keywords
+            out["words"].update(line_parts)
 
-    portmode_out,default_port = os9_portmode(intf_fields, running_config)
-    if default_port:
-        default_list.append(intf_label)
+    return out
 
-    # General
-    cur_intf_cfg += os9_name(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_description(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_state(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_mtu(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_autoneg(intf_label, intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_fec(intf_fields, running_config, default_port)
-    # L3
-    cur_intf_cfg += os9_ip4(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_ip6(intf_fields, running_config, default_port)
-    # LAG
-    cur_intf_cfg += os9_lagmembers(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_lacprate(intf_fields, running_config, default_port)
+def os9_valuerule(rule, intf_label, man_fields, running, default_port):
+    """
+    Create OS9 commands for an attribute that is either set to a value or removed (ex. "description")
 
-    # VLAN interfaces / L2
-    cur_intf_cfg += portmode_out
-    cur_intf_cfg += os9_mlag(intf_fields, running_config, default_port)
-    # STP
-    cur_intf_cfg += os9_edgeport(intf_fields, running_config, default_port)
+    :param rule: Rule from os9_attribute_rules
+    :type rule: dict
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param default_port: If true, this port is being defaulted
+    :type default_port: boolean
+    :return: List of OS9 commands to set the attribute
+    :rtype: list
+    """
 
-    # these go directly to output because they are controlling other interfaces
-    cleanvlan_list = os9_cleanvlans(intf_label, sw_config, intf_fields, default_port, managed_vlan_list)
-    output += cleanvlan_list
+    out = []
+
+    if rule["field"] in man_fields:
+        # attribute exists in the manifest
+        value = str(man_fields[rule["field"]])
+        if rule.get("lower"):
+            value = value.lower()
 
-    untag_list = os9_untagged(intf_label, sw_config, intf_fields, default_port)
-    output += untag_list
+        conf_line = rule["set"].format(value)
+        if conf_line not in running["lines"] or default_port:
+            out.append(conf_line)  # add to out only if not already in switch conf
 
-    tag_list = os9_tagged(intf_label, sw_config, intf_fields, default_port)
-    output += tag_list
+    elif rule["key"] in running["keys"] and not default_port:
+        # attribute exists on the switch, but shouldn't
+        out.append(rule["clear"])
 
-    # These change physical interfaces
-    lacp_members_cleaned = os9_cleanlacpmembers(intf_label, sw_config, intf_fields, default_list)
-    output += lacp_members_cleaned
+    return out
 
-    lacp_members_active_list = os9_lacpmembersactive(intf_label, sw_config, intf_fields)
-    output += lacp_members_active_list
+def os9_state(rule, intf_label, man_fields, running, default_port):
+    """
+    Create OS9 commands for "state" attribute
 
-    lacp_members_passive_list = os9_lacpmemberspassive(intf_label, sw_config, intf_fields)
-    output += lacp_members_passive_list
+    :param rule: Rule from os9_attribute_rules
+    :type rule: dict
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param default_port: If true, this port is being defaulted
+    :type default_port: boolean
+    :return: List of OS9 commands to set state
+    :rtype: list
+    """
 
-    # add interface config line
-    if len(cur_intf_cfg) > 0:
-        cur_intf_cfg.insert(0, f"interface {intf_label}")
+    out = []
 
-        if default_port:
-            intf_type = intf_label.split(" ")[0]
-            if intf_type.lower() in physical_interface_types:
-                # this is a physical interface
-                cur_intf_cfg.insert(0, f"default interface {intf_label}")
-            elif intf_type.lower() in lag_interface_types:
-                # this is a port channel, so it just needs to be delete
-                cur_intf_cfg.insert(0, f"no interface {intf_label}")
+    # Create a no prefix based on manifest value
+    if "state" in man_fields and man_fields["state"] == "up":
+        no_str = "no "
+    else:
+        no_str = ""
 
-        output.insert(0, cur_intf_cfg)
+    conf_line = f"{no_str}shutdown"
+    if conf_line not in running["lines"] or default_port:
+        out.append(conf_line)  # add to out only if not already in switch conf
 
-    return output,default_list
+    return out
 
-def OS9_FANOUTCFG(sw_config, manifest):
+def os9_autoneg(rule, intf_label, man_fields, running, default_port):
     """
-    This method will create OS9 commands for fanout interfaces
+    Create OS9 commands for "autoneg" attribute
 
-    :param sw_config: Switch configuration
-    :type sw_config: str
-    :param manifest: YAML manifest
-    :type manifest: dict
-    :return: List of OS9 commands
+    :param rule: Rule from os9_attribute_rules
+    :type rule: dict
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param default_port: If true, this port is being defaulted
+    :type default_port: boolean
+    :return: List of OS9 commands to set autoneg
     :rtype: list
     """
 
-    conf_lines = sw_config["ansible_facts"]["ansible_net_config"].splitlines()
-    conf_lines = OS9_GETEXTENDEDCFG(conf_lines)
+    intf_type = os9_intfid(intf_label).type_name
+
+    if intf_type == "gigabitethernet" or intf_type == "tengigabitethernet":
+        # support negotiation command
+        conf_line = "negotiation auto"
+    elif intf_type == "twentyfivegige":
+        conf_line = "intf-type cr1 autoneg"
+    elif intf_type == "fiftygige":
+        conf_line = "intf-type cr2 autoneg"
+    elif intf_type == "hundredgige" or intf_type == "fortygige":
+        conf_line = "intf-type cr4 autoneg"
+    else:
+        # not a physical interface
+        return []
 
     out = []
 
-    manifest_stackunits = []  # hold existing stuff for 2nd for loop
+    if "autoneg" in man_fields and not man_fields["autoneg"]:
+        conf_line = f"no {conf_line}"
 
-    # Add fanouts that need to be added
-    for intf,items in manifest.items():
-        if "fanout" in items:
-            # this is a fanout interface
-            fanout_speed = items["fanout"]["speed"]
-            fanout_type = items["fanout"]["type"]
-            port_num = intf.split("/")[-1]
-
-            conf_line_base = f"stack-unit 1 port {port_num} portmode {fanout_type}"
-            manifest_stackunits.append(conf_line_base)
-            conf_line = f"{conf_line_base} speed {fanout_speed}"
-            manifest_stackunits.append(conf_line)
-
-            if conf_line not in conf_lines and conf_line_base not in conf_lines:
-                parent_port_num = f"1/{port_num}"
-                search_pattern = rf'^interface .*{re.escape(parent_port_num)}$'
-                search_matches = [line for line in conf_lines if re.match(search_pattern, line)]
-                parent_port_label = " ".join(search_matches[0].split(" ")[1:])
-
-                out.append(f"default interface {parent_port_label}")
-                out.append(f"{conf_line} no-confirm")
+        if conf_line not in running["lines"] or default_port:
+            out.append(conf_line)
 
-    # Remove fanouts that need to be removed
-    for line in [s for s in conf_lines if s.startswith("stack-unit 1 port")]:
-        # loop through existing stack-units
-        if line in manifest_stackunits:
-            # supposed to be there
+    elif "autoneg" in running["words"] or "negotiation" in running["words"]:
+        out.append(conf_line)
+
+    return out
+
+def os9_fec(rule, intf_label, man_fields, running, default_port):
+    """
+    Create OS9 commands for "fec" attribute
+
+    :param rule: Rule from os9_attribute_rules
+    :type rule: dict
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param default_port: If true, this port is being defaulted
+    :type default_port: boolean
+    :return: List of OS9 commands to set fec
+    :rtype: list
+    """
+
+    out = []
+
+    # Create a no prefix based on manifest value
+    if "fec" in man_fields:
+        if man_fields["fec"]:
+            conf_line = "fec enable"
+        else:
+            conf_line = "no fec enable"
+
+        if conf_line not in running["lines"] or default_port:
+            out.append(conf_line)
+    elif "fec" in running["words"]:
+        # fec field exists
+        conf_line = "fec default"
+        out.append(conf_line)
+
+    return out
+
+def os9_edgeport(rule, intf_label, man_fields, running, default_port):
+    """
+    Create OS9 commands for "edge-port" attribute
+
+    :param rule: Rule from os9_attribute_rules
+    :type rule: dict
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param default_port: If true, this port is being defaulted
+    :type default_port: boolean
+    :return: List of OS9 commands to set edge-port
+    :rtype: list
+    """
+
+    out = []
+
+    # Every edge port interface will be defined as an edge port for all 3 protocols
+    os9_stp_types = ["rstp", "pvst", "mstp"]
+
+    is_edgeport = "stp-edge" in man_fields and man_fields["stp-edge"]
+    for stp_type in os9_stp_types:
+        # Loop through each stp type available
+        conf_line = f"spanning-tree {stp_type} edge-port"
+        if is_edgeport:
+            if conf_line not in running["lines"] or default_port:
+                out.append(conf_line)  # add to out only if not already in switch conf
+        else:
+            if conf_line in running["lines"] and not default_port:
+                out.append(f"no {conf_line}")
+
+    return out
+
+def os9_lagmembers(rule, intf_label, man_fields, running, default_port):
+    """
+    Create OS9 commands for "lag-members" attribute
+
+    :param rule: Rule from os9_attribute_rules
+    :type rule: dict
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param default_port: If true, this port is being defaulted
+    :type default_port: boolean
+    :return: List of OS9 commands to set lag-members
+    :rtype: list
+    """
+
+    out = []
+
+    if "lag-members" in man_fields:
+        channel_members = man_fields["lag-members"]
+        member_ids = {os9_intfid(lag_member) for lag_member in channel_members}
+        running_ids = {os9_intfid(cfg_line[len("channel-member "):])
+                       for cfg_line in running["keys"].get("channel-member", [])}
+
+        for lag_member in channel_members:
+            conf_line = f"channel-member {lag_member}"
+
+            if os9_intfid(lag_member) not in running_ids or default_port:
+                out.append(conf_line)  # add channel member if not on switch
+
+        for cfg_line in running["keys"].get("channel-member", []):
+            mem_intf_label = " ".join(cfg_line.split(" ")[1:])
+            if os9_intfid(mem_intf_label) not in member_ids and not default_port:
+                conf_line = f"no channel-member {mem_intf_label}"
+                out.insert(0, conf_line)  # remove any existing channel members if they exist
+
+    return out
+
+def os9_lacprate(rule, intf_label, man_fields, running, default_port):
+    """
+    Create OS9 commands for "lacp-rate" attribute
+
+    :param rule: Rule from os9_attribute_rules
+    :type rule: dict
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param default_port: If true, this port is being defaulted
+    :type default_port: boolean
+    :return: List of OS9 commands to set lacp-rate
+    :rtype: list
+    """
+
+    out = []
+
+    if "lacp-rate" in man_fields:
+        if man_fields["lacp-rate"] == "fast":
+            conf_line = "lacp fast-switchover"
+
+            if conf_line not in running["lines"] or default_port:
+                out.append(conf_line)
+
+    elif "lacp fast-switchover" in running["lines"] and not default_port:
+        out.append("no lacp fast-switchover")
+
+    return out
+
+def os9_portmode(man_fields, running, in_lag=False):
+    """
+    Create OS9 commands for "portmode" attribute
+
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running: Parsed running config of the interface
+    :type running: dict
+    :param in_lag: If true, the interface is a channel-member of a port-channel
+    :type in_lag: boolean
+    :return: Tuple of <OS9 commands to set portmode>,<defaulted port>
+    :rtype: tuple
+    """
+
+    out = []
+    def_intf = False  # if true then the interface needs to be defaulted before continuing
+
+    if "portmode" in man_fields:
+        if "port-channel-protocol LACP" in running["lines"] or in_lag:
+            # default interface if part of lag, OS9 doesn't take switchport on a lag member
+            def_intf = True
+
+        intf_portmode = man_fields["portmode"]
+
+        has_switchport = "switchport" in running["lines"]
+        has_portmode = "portmode hybrid" in running["lines"]
+
+        if intf_portmode == "hybrid":
+            # for hybrid port, portmode hybrid needs to go first
+            if not has_portmode:
+                out.append("portmode hybrid")
+
+                if has_switchport:
+                    # You cannot apply portmode hybrid unless switchport doesn't exist
+                    def_intf = True
+
+        if not has_switchport or def_intf:
+            out.append("switchport")  # only apply if not already on switch
+
+        if not def_intf:
+            # remove L3 fields since they are mutually exclusive if they exist
+            if "ip address" in running["keys"]:
+                out.insert(0, "no ip address")
+
+            if "ipv6 address" in running["keys"]:
+                out.insert(0, "no ipv6 address")
+    else:
+        if "switchport" in running["lines"]:
+            def_intf = True
+
+        if "portmode hybrid" in running["lines"] and not def_intf:
+            out.append("no portmode hybrid")
+
+    return out,def_intf
+
+# Attributes of an interface, in the order their commands are sent.
+# Simple attributes are set with "set" (formatted with the manifest value) and removed with "clear" when "key"
+# is in the running config. Other attributes have a "generate" method which returns their commands.
+os9_attribute_rules = [
+    # General
+    {"field": "name", "key": "name", "set": "name {}", "clear": "no name"},
+    {"field": "description", "key": "description", "set": "description {}", "clear": "no description"},
+    {"field": "state", "generate": os9_state},
+    {"field": "mtu", "key": "mtu", "set": "mtu {}", "clear": "no mtu"},
+    {"field": "autoneg", "generate": os9_autoneg},
+    {"field": "fec", "generate": os9_fec},
+    # L3
+    {"field": "ip4", "key": "ip address", "set": "ip address {}", "clear": "no ip address"},
+    {"field": "ip6", "key": "ipv6 address", "set": "ipv6 address {}", "clear": "no ipv6 address"},
+    # LAG
+    {"field": "lag-members", "generate": os9_lagmembers},
+    {"field": "lacp-rate", "generate": os9_lacprate},
+    # VLAN interfaces / L2 (portmode is generated first since it decides if the port is defaulted)
+    {"field": "portmode"},
+    {"field": "mlag", "key": "vlt-peer-lag", "set": "vlt-peer-lag {}", "clear": "no vlt-peer-lag", "lower": True},
+    # STP
+    {"field": "stp-edge", "generate": os9_edgeport}
+]
+
+class OS9IntfSpec(object):
+    """
+    Desired state of an interface, from the compiled manifest
+    """
+
+    __slots__ = ("intf_id", "label", "fields")
+
+    def __init__(self, label, fields):
+        """
+        :param label: Label of the interface in the manifest
+        :type label: str
+        :param fields: Manifest fields of the interface
+        :type fields: dict
+        """
+
+        self.intf_id = os9_intfid(label)
+        self.label = label
+        self.fields = fields
+
+    @property
+    def managed(self):
+        return bool(self.fields.get("managed"))
+
+    @property
+    def lacp_members(self):
+        """
+        List of (member label, "active" or "passive"), active members first
+        """
+
+        return [(member, "active") for member in self.fields.get("lacp-members-active", [])] + \
+               [(member, "passive") for member in self.fields.get("lacp-members-passive", [])]
+
+    @property
+    def untagged_bits(self):
+        return os9_vlanbits([self.fields["untagged"]]) if "untagged" in self.fields else 0
+
+    @property
+    def tagged_bits(self):
+        return os9_vlanbits(self.fields["tagged"]) if "tagged" in self.fields else 0
+
+    @property
+    def fanout(self):
+        return self.fields.get("fanout")
+
+class OS9DesiredState(object):
+    """
+    Desired state of a switch: one OS9IntfSpec per interface of the compiled manifest, in manifest order,
+    and the VLANs and interfaces that are allowed to exist.
+    """
+
+    def __init__(self, intf, vlans, compiled=None):
+        """
+        :param intf: Interface manifest
+        :type intf: dict
+        :param vlans: VLAN manifest
+        :type vlans: dict
+        :param compiled: Output of OS9_COMPILEMANIFEST for intf and vlans, if it is already compiled
+        :type compiled: dict
+        """
+
+        if compiled is None:
+            compiled = OS9_COMPILEMANIFEST(intf, vlans)
+
+        self.specs = [OS9IntfSpec(label, fields) for label, fields in compiled["manifest"].items()]
+        self.managed_vlans = compiled["managed_vlans"]
+        self.vlan_ids = {int(key) for key in vlans}
+        self.intf_ids = {spec.intf_id for spec in self.specs}
+
+class OS9IntfState(object):
+    """
+    Current state of an interface, from the running config
+    """
+
+    __slots__ = ("intf_id", "lines", "untagged", "tagged", "lacp_members", "lag")
+
+    def __init__(self, conf, intf_id):
+        """
+        :param conf: Parsed switch configuration
+        :type conf: OS9Config
+        :param intf_id: ID of the interface
+        :type intf_id: OS9IntfId
+        """
+
+        self.intf_id = intf_id
+        self.lines = conf.get_intf(intf_id)
+        self.untagged = conf.get_vlans(intf_id, "untagged")  # VLAN labels, in config order
+        self.tagged = conf.get_vlans(intf_id, "tagged")
+        self.lacp_members = conf.get_lacpmembers(intf_id)
+        self.lag = conf.get_lag(intf_id)  # port-channel of a static channel-member
+
+    @property
+    def running(self):
+        """
+        The lines of the block parsed by os9_parseblock (attributes, including vlt-peer-lag and channel members).
+        It isn't kept, so only the block being compared is parsed at a time.
+        """
+
+        return os9_parseblock(self.lines)
+
+    @property
+    def untagged_bits(self):
+        return os9_vlanbits([vlan_label.split(" ")[-1] for vlan_label in self.untagged])
+
+    @property
+    def tagged_bits(self):
+        return os9_vlanbits([vlan_label.split(" ")[-1] for vlan_label in self.tagged])
+
+class OS9CurrentState(object):
+    """
+    Current state of a switch. Interfaces are built from the config indexes the first time they are looked up,
+    so a diff only pays for the interfaces it compares.
+    """
+
+    def __init__(self, conf):
+        """
+        :param conf: Parsed switch configuration
+        :type conf: OS9Config
+        """
+
+        self.conf = conf
+        self.intfs = {}  # interface ID -> OS9IntfState
+
+    def get(self, intf):
+        """
+        Returns the state of an interface (empty if it isn't in the config)
+
+        :param intf: Label (or ID) of the interface
+        :type intf: str
+        :rtype: OS9IntfState
+        """
+
+        intf_id = os9_intfid(intf)
+        if intf_id not in self.intfs:
+            self.intfs[intf_id] = OS9IntfState(self.conf, intf_id)
+
+        return self.intfs[intf_id]
+
+class OS9Change(namedtuple("OS9Change", ["kind", "target", "reset", "lines"])):
+    """
+    One change of a diff.
+
+    kind is "fanout" (lines are top level commands for the port in target), "remove" (the interface in target is
+    deleted), "intf" (attributes of the interface in target), "vlan" (membership lines on the VLAN, or "range vlan
+    A - B", in target) or "lacp" (LACP lines on the member in target). reset is "default" or "delete" if the
+    interface is reset before its lines are applied.
+    """
+
+    __slots__ = ()
+
+    def render(self):
+        """
+        :return: List of OS9 commands, an interface block for "intf", "vlan" and "lacp" changes
+        :rtype: list
+        """
+
+        if self.kind == "fanout":
+            return list(self.lines)
+
+        if self.kind == "remove":
+            return [f"no interface {self.target}"]
+
+        out = []
+        if self.reset == "default":
+            out.append(f"default interface {self.target}")
+        elif self.reset == "delete":
+            out.append(f"no interface {self.target}")
+
+        out.append(f"interface {self.target}")
+        out += self.lines
+
+        return out
+
+def os9_diffattrs(spec, state, attr_cache):
+    """
+    Compares the attributes of an interface with os9_attribute_rules
+
+    :param spec: Desired state of the interface
+    :type spec: OS9IntfSpec
+    :param state: Current state of the interface
+    :type state: OS9IntfState
+    :param attr_cache: Dict to share the result between interfaces with the same signature
+    :type attr_cache: dict
+    :return: Tuple of <OS9 commands for the interface>,<defaulted port>
+    :rtype: tuple
+    """
+
+    # The commands only depend on the interface type, manifest fields, running block and static lag membership
+    signature = (spec.intf_id.type_name, repr(sorted(spec.fields.items())), tuple(state.lines),
+                 state.lag is not None)
+    if signature in attr_cache:
+        return attr_cache[signature]
+
+    out = []
+
+    running = state.running
+    portmode_out,default_port = os9_portmode(spec.fields, running, state.lag is not None)
+
+    for rule in os9_attribute_rules:
+        if rule["field"] == "portmode":
+            out += portmode_out
+        elif "generate" in rule:
+            out += rule["generate"](rule, spec.label, spec.fields, running, default_port)
+        else:
+            out += os9_valuerule(rule, spec.label, spec.fields, running, default_port)
+
+    attr_cache[signature] = (tuple(out), default_port)
+
+    return attr_cache[signature]
+
+def os9_diffvlans(spec, state, default_port, managed_vlan_list):
+    """
+    Compares the VLAN memberships of an interface. Memberships that aren't in the manifest are removed
+    (unless the VLAN is managed), then the untagged and tagged VLANs that are missing are added.
+
+    :param spec: Desired state of the interface
+    :type spec: OS9IntfSpec
+    :param state: Current state of the interface
+    :type state: OS9IntfState
+    :param default_port: If true, this port is being defaulted (it has no memberships left)
+    :type default_port: boolean
+    :param managed_vlan_list: List of VLANs that are managed
+    :type managed_vlan_list: list
+    :return: List of "vlan" changes
+    :rtype: list
+    """
+
+    out = []
+    untagged_bits = spec.untagged_bits
+    tagged_bits = spec.tagged_bits
+
+    if not default_port:
+        for vlan_mode,vlan_bits in (("untagged", untagged_bits), ("tagged", tagged_bits)):
+            for existing_vlan in getattr(state, vlan_mode):
+                vlan_id = existing_vlan.split(" ")[-1]
+                if not (vlan_bits >> int(vlan_id)) & 1 and vlan_id not in managed_vlan_list:
+                    # Don't remove managed vlan
+                    out.append(OS9Change("vlan", existing_vlan, None, (f"no {vlan_mode} {spec.label}",)))
+
+    if "untagged" in spec.fields:
+        if not state.untagged_bits & untagged_bits or default_port:
+            out.append(OS9Change("vlan", f"Vlan {spec.fields['untagged']}", None, (f"untagged {spec.label}",)))
+
+    if "tagged" in spec.fields:
+        tagged_vlbits = tagged_bits
+        if not default_port:
+            # only add the vlans that the interface isn't already tagged in
+            tagged_vlbits &= ~state.tagged_bits
+
+        for range_start,range_end in os9_vlanruns(tagged_vlbits):
+            if range_start == range_end:
+                target = f"Vlan {range_start}"
+            else:
+                target = f"range vlan {range_start} - {range_end}"
+            out.append(OS9Change("vlan", target, None, (f"tagged {spec.label}",)))
+
+    return out
+
+def os9_difflacp(spec, state, current, default_ids):
+    """
+    Compares the LACP members of a port-channel. Members that aren't in the manifest lose their LACP config
+    (unless they were already defaulted), then the members that are missing are added.
+
+    :param spec: Desired state of the port-channel
+    :type spec: OS9IntfSpec
+    :param state: Current state of the port-channel
+    :type state: OS9IntfState
+    :param current: Current state of the switch, for the blocks of the members
+    :type current: OS9CurrentState
+    :param default_ids: IDs of the interfaces that have been defaulted
+    :type default_ids: set
+    :return: List of "lacp" changes
+    :rtype: list
+    """
+
+    out = []
+    lacp_members = spec.lacp_members
+
+    member_ids = {os9_intfid(member) for member,_ in lacp_members}
+    for existing_member in state.lacp_members:
+        member_id = os9_intfid(existing_member)
+        if member_id not in member_ids and member_id not in default_ids:
+            out.append(OS9Change("lacp", existing_member, None, ("no port-channel-protocol LACP",)))
+
+    for lag_member,lacp_mode in lacp_members:
+        conf_line = f"{spec.label.lower()} mode {lacp_mode}"
+        if conf_line not in current.get(lag_member).lines:
+            out.append(OS9Change("lacp", lag_member, None, ("port-channel-protocol LACP", conf_line)))
+
+    return out
+
+def os9_diffconfig(current, desired):
+    """
+    Compares every interface of the manifest with the running config, in one pass in manifest order.
+    Managed interfaces and fanout ports are skipped.
+
+    :param current: Current state of the switch
+    :type current: OS9CurrentState
+    :param desired: Desired state of the switch
+    :type desired: OS9DesiredState
+    :return: List of changes
+    :rtype: list
+    """
+
+    out = []
+    default_ids = set()  # interfaces defaulted so far
+    attr_cache = {}
+
+    for spec in desired.specs:
+        if spec.managed or "fanout" in spec.fields:
             continue
 
-        line_parts = line.split(" ")
-        port_num = line_parts[3]
+        state = current.get(spec.intf_id)
+        attr_lines,default_port = os9_diffattrs(spec, state, attr_cache)
+
+        if default_port:
+            default_ids.add(spec.intf_id)
+
+        if attr_lines:
+            reset = None
+            if default_port and spec.intf_id.is_physical:
+                reset = "default"
+            elif default_port and spec.intf_id.is_lag:
+                # a port channel can't be defaulted, it is deleted
+                reset = "delete"
+            out.append(OS9Change("intf", spec.label, reset, attr_lines))
+
+        # these change other interfaces (VLANs and LACP members)
+        out += os9_diffvlans(spec, state, default_port, desired.managed_vlans)
+        out += os9_difflacp(spec, state, current, default_ids)
+
+    return out
+
+def os9_diffclean(current, desired):
+    """
+    Finds the VLAN interfaces and port channels of the running config that aren't in the manifest
+
+    :param current: Current state of the switch
+    :type current: OS9CurrentState
+    :param desired: Desired state of the switch
+    :type desired: OS9DesiredState
+    :return: List of "remove" changes
+    :rtype: list
+    """
+
+    out = []
+
+    intf_labels = current.conf.get_labels()
+    os9_profilelines("os9_diffclean", len(intf_labels))
+    for intf_label in intf_labels:
+        intf_id = os9_intfid(intf_label)
+        if intf_id.is_vlan and intf_id.port == 1:
+            # skip default vlan
+            continue
+
+        not_manifest_vlan = intf_id.is_vlan and intf_id.port not in desired.vlan_ids
+        not_manifest_lag = intf_id.is_lag and intf_id not in desired.intf_ids
+
+        if not_manifest_vlan or not_manifest_lag:
+            out.append(OS9Change("remove", intf_label, "delete", ()))
+
+    return out
+
+class OS9Diff(object):
+    """
+    Structural diff between the desired state of a switch and its running config.
+
+    The sections are computed the first time they are read: "fanout" (stack-unit changes), "config" (interface
+    attributes, VLAN and LACP memberships) and "clean" (interfaces to delete). Each is a list of OS9Change in the
+    order the commands are sent. OS9_FANOUTCFG, OS9_GETCONFIG and OS9_CLEANINTF render one section each.
+    """
+
+    def __init__(self, current, desired):
+        """
+        :param current: Current state of the switch
+        :type current: OS9CurrentState
+        :param desired: Desired state of the switch
+        :type desired: OS9DesiredState
+        """
+
+        self.current = current
+        self.desired = desired
+        self.sections = {}
+
+    def _section(self, name, diff_func):
+        if name not in self.sections:
+            self.sections[name] = diff_func(self.current, self.desired)
+
+        return self.sections[name]
+
+    @property
+    def fanout(self):
+        return self._section("fanout", os9_difffanout)
+
+    @property
+    def config(self):
+        return self._section("config", os9_diffconfig)
+
+    @property
+    def clean(self):
+        return self._section("clean", os9_diffclean)
+
+def os9_diff(sw_config, intf, vlans, compiled=None):
+    """
+    Returns the diff between the manifests of a switch and its running config
+
+    :param sw_config: Output of os9_facts (or the config text itself)
+    :type sw_config: dict
+    :param intf: Interface manifest
+    :type intf: dict
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param compiled: Output of OS9_COMPILEMANIFEST for intf and vlans, if it is already compiled
+    :type compiled: dict
+    :rtype: OS9Diff
+    """
+
+    return OS9Diff(OS9CurrentState(OS9_LOADCONFIG(sw_config)), OS9DesiredState(intf, vlans, compiled))
+
+# Sub-ports created by a fanout, by portmode (number of sub-ports) and speed (interface type of the sub-ports).
+# Fanouts that aren't listed here can't be predicted, so the config is gathered again after them.
+os9_fanout_subports = {
+    "single": 1,
+    "dual": 2,
+    "quad": 4
+}
+os9_fanout_types = {
+    "10G": "TenGigabitEthernet",
+    "25G": "twentyFiveGigE",
+    "40G": "fortyGigE"
+}
+
+def os9_fanoutplan(sw_config, desired):
+    """
+    Plans the fanout changes of a switch from its port index, so each fanout port is only looked up once.
+    Fanouts that are removed come first, so a port can be fanned out another way in the same plan.
+
+    :param sw_config: Parsed switch configuration
+    :type sw_config: OS9Config
+    :param desired: Desired state of the switch
+    :type desired: OS9DesiredState
+    :return: List of "add" or "remove" dicts, with the OS9 commands of the change in "lines"
+    :rtype: list
+    """
+
+    remove_changes = []
+    add_changes = []
+
+    manifest_stackunits = set()  # lines of the fanouts in the manifest, with and without the speed
+
+    # Add fanouts that need to be added
+    for spec in desired.specs:
+        if "fanout" not in spec.fields:
+            continue
+
+        # this is a fanout interface
+        intf_id = spec.intf_id
+        fanout_speed = spec.fanout["speed"]
+        fanout_type = spec.fanout["type"]
+
+        conf_line_base = f"stack-unit {intf_id.unit} port {intf_id.port} portmode {fanout_type}"
+        conf_line = f"{conf_line_base} speed {fanout_speed}"
+        manifest_stackunits.update((conf_line_base, conf_line))
 
-        search_pattern = rf'^interface .*1/{port_num}/\d$'
-        search_matches = [match_line for match_line in conf_lines if re.match(search_pattern, match_line)]
+        port = sw_config.get_port(intf_id.unit, intf_id.port)
+        if port["stackunit"] in (conf_line_base, conf_line):
+            # already fanned out this way
+            continue
 
-        for child_intf in search_matches:
-            out.append(f"default {child_intf}")
+        add_lines = []
+        if port["parent"] is not None:
+            add_lines.append(f"default interface {port['parent']}")
+        # otherwise the port is fanned out another way (the parent comes back defaulted when that is removed)
+        # or isn't in the config at all
+        add_lines.append(f"{conf_line} no-confirm")
+        add_changes.append({"add": conf_line, "unit": intf_id.unit, "port": intf_id.port, "parent": port["parent"],
+                            "type": fanout_type, "speed": fanout_speed, "lines": add_lines})
 
-        conf_line_index = line.find("speed")
+    # Remove fanouts that need to be removed
+    os9_profilelines("os9_fanoutplan", len(sw_config.fanout_ports))
+    for unit,port_num in sw_config.fanout_ports:
+        port = sw_config.get_port(unit, port_num)
+        if port["stackunit"] in manifest_stackunits:
+            # supposed to be there
+            continue
+
+        remove_lines = [f"default interface {child_intf}" for child_intf in port["children"]]
+
+        conf_line_index = port["stackunit"].find(" speed ")
         if conf_line_index == -1:
-            conf_line = line
+            conf_line = port["stackunit"]
         else:
-            conf_line = line[:conf_line_index - 1]
+            conf_line = port["stackunit"][:conf_line_index]
 
-        out.append(f"no {conf_line} no-confirm")
+        remove_lines.append(f"no {conf_line} no-confirm")
+        remove_changes.append({"remove": port["stackunit"], "unit": unit, "port": port_num,
+                               "children": list(port["children"]), "lines": remove_lines})
 
-    return out
+    return remove_changes + add_changes
+
+def os9_difffanout(current, desired):
+    """
+    Compares the fanout ports of the manifest with the stack-unit lines of the running config
+
+    :param current: Current state of the switch
+    :type current: OS9CurrentState
+    :param desired: Desired state of the switch
+    :type desired: OS9DesiredState
+    :return: List of "fanout" changes
+    :rtype: list
+    """
+
+    return [OS9Change("fanout", (change["unit"], change["port"]), None, tuple(change["lines"]))
+            for change in os9_fanoutplan(current.conf, desired)]
+
+@os9_profiledfilter
+def OS9_FANOUTCFG(sw_config, manifest):
+    """
+    This method will create OS9 commands for fanout interfaces
+
+    :param sw_config: Switch configuration
+    :type sw_config: str
+    :param manifest: YAML manifest
+    :type manifest: dict
+    :return: List of OS9 commands
+    :rtype: list
+    """
+
+    return [line for change in os9_diff(sw_config, manifest, {}).fanout for line in change.render()]
 
+@os9_profiledfilter
+def OS9_FANOUTMODEL(sw_config, manifest):
+    """
+    Predicts the switch config after the commands of OS9_FANOUTCFG are applied, so it doesn't have to be gathered
+    again. Fanned out ports are replaced by their sub-ports (and removed fanouts by their parent port) with the
+    default config, and memberships of the removed interfaces are dropped.
+
+    :param sw_config: Switch configuration
+    :type sw_config: dict
+    :param manifest: YAML manifest
+    :type manifest: dict
+    :return: Predicted config in the same format as os9_facts, or an empty dict if it can't be predicted
+    :rtype: dict
+    """
+
+    conf = OS9_LOADCONFIG(sw_config)
+    changes = os9_fanoutplan(conf, OS9DesiredState(manifest, {}))
+
+    removed = set()  # IDs of interfaces that disappear
+    added = {}  # ID of the first interface replaced -> list of new interfaces
+    add_stackunits = []
+    remove_stackunits = set()
+    removed_ports = {}  # (unit, port) of removed fanouts -> ID of their first sub-port
+
+    # removals come first in the plan, so a port that is fanned out another way was already removed
+    for change in changes:
+        unit_port = (change["unit"], change["port"])
+        if "add" in change:
+            subport_count = os9_fanout_subports.get(change["type"])
+            subport_type = os9_fanout_types.get(change["speed"])
+            if subport_count is None or subport_type is None:
+                # unknown sub-ports
+                return {}
+
+            new_intfs = [f"{subport_type} {change['unit']}/{change['port']}/{i}" for i in range(1, subport_count + 1)]
+            if unit_port in removed_ports:
+                # the old sub-ports are replaced by the new ones instead of the parent port
+                added[removed_ports[unit_port]] = new_intfs
+            elif change["parent"] is not None and conf.get_port(*unit_port)["stackunit"] is None:
+                parent_id = os9_intfid(change["parent"])
+                removed.add(parent_id)
+                added[parent_id] = new_intfs
+            else:
+                # the port isn't in the config
+                return {}
+
+            add_stackunits.append(change["add"])
+        else:
+            # the parent port comes back with its own type, which is only known from the manifest.
+            # If it isn't in the manifest nothing is planned for it, so it can be left out of the model.
+            parent_labels = [intf for intf in manifest if os9_intfid(intf).is_physical
+                             and os9_intfid(intf).numbers == (change["unit"], change["port"], 0)]
+            if len(parent_labels) > 1 or not change["children"]:
+                return {}
+
+            child_ids = [os9_intfid(child) for child in change["children"]]
+            removed.update(child_ids)
+            added[child_ids[0]] = parent_labels
+            remove_stackunits.add(change["remove"])
+            removed_ports[unit_port] = child_ids[0]
+
+    out = []
+    skip_block = False
+    member_cache = {}  # (interface type, spans) -> members that are left, or None if none were removed
+    os9_profilelines("OS9_FANOUTMODEL", len(conf.records))
+    for record in conf.records:
+        if record.kind in ("line", "member"):
+            if skip_block:
+                continue
+
+            if record.kind == "member":
+                range_key = (record.label, record.spans)
+                if range_key not in member_cache:
+                    members = conf.expand(record)
+                    kept_members = [member for member in members if os9_intfid(member) not in removed]
+                    member_cache[range_key] = kept_members if len(kept_members) < len(members) else None
+
+                if member_cache[range_key] is not None:
+                    # memberships of interfaces that were defaulted are dropped
+                    out += [f"{' ' * record.indent}{record.mode} {member}" for member in member_cache[range_key]]
+                    continue
+
+            out.append(record.render())
+            continue
+
+        skip_block = False
+        if record.kind == "interface":
+            intf_id = os9_intfid(record.label)
+            for new_intf in added.pop(intf_id, []):
+                out += [f"interface {new_intf}", " no ip address", " shutdown"]
+
+            if intf_id in removed:
+                skip_block = True
+                continue
+        elif record.text in remove_stackunits:
+            continue
+
+        out.append(record.text)
+
+    # new fanouts go after the existing ones, or before the first interface
+    stackunit_index = [i for i, line in enumerate(out) if line.startswith("stack-unit ")]
+    if stackunit_index:
+        insert_index = stackunit_index[-1] + 1
+    else:
+        insert_index = next((i for i, line in enumerate(out) if line.startswith("interface ")), len(out))
+    out[insert_index:insert_index] = add_stackunits
+
+    if added:
+        # a replaced interface wasn't found
+        return {}
+
+    out_facts = {"ansible_net_config": "\n".join(out)}
+    if isinstance(sw_config, dict) and "ansible_net_hostname" in sw_config["ansible_facts"]:
+        out_facts["ansible_net_hostname"] = sw_config["ansible_facts"]["ansible_net_hostname"]
+
+    return {"ansible_facts": out_facts, "predicted": True}
+
+@os9_profiledfilter
 def OS9_CLEANINTF(sw_config, manifest, vlans):
     """
     This method will create os9 commands to delete interfaces that have been removed from the manifest
@@ -967,33 +1891,639 @@ def OS9_CLEANINTF(sw_config, manifest, vlans):
     :rtype: list
     """
 
-    conf_lines = sw_config["ansible_facts"]["ansible_net_config"].splitlines()
-    conf_lines = OS9_GETEXTENDEDCFG(conf_lines)
+    return [line for change in os9_diff(sw_config, manifest, vlans).clean for line in change.render()]
+
+def os9_vlanheaderrange(header):
+    """
+    Returns the VLANs a VLAN block header applies to
+
+    :param header: Block header (ex. "interface Vlan 10" or "interface range vlan 10 - 20")
+    :type header: str
+    :return: (first vlan, last vlan), or None if the header isn't a single VLAN or a single run of VLANs
+    :rtype: tuple
+    """
+
+    header_parts = header.lower().split()
+
+    if len(header_parts) == 3 and header_parts[1] == "vlan" and header_parts[2].isdigit():
+        return int(header_parts[2]), int(header_parts[2])
+
+    if len(header_parts) == 6 and header_parts[1:3] == ["range", "vlan"] and header_parts[4] == "-" \
+            and header_parts[3].isdigit() and header_parts[5].isdigit():
+        return int(header_parts[3]), int(header_parts[5])
+
+    return None
+
+def os9_mergevlanruns(vlan_blocks):
+    """
+    Merges membership lines by the VLAN they apply to, so each VLAN is in one block. VLANs with the same lines
+    are put back together in runs, ex. "range vlan 10 - 20" (port A) and "range vlan 15 - 30" (port B) become
+    10 - 14 (A), 15 - 20 (A and B) and 21 - 30 (B).
+
+    :param vlan_blocks: Dict of header -> dict of member lines, in the order they were planned
+    :type vlan_blocks: OrderedDict
+    :return: 2D list of os9 commands, one block per run of VLANs (sorted), then the blocks with other headers
+    :rtype: list
+    """
+
+    entries = []  # (first vlan, last vlan, member lines)
+    other_blocks = []
+
+    for header,lines in vlan_blocks.items():
+        vlan_range = os9_vlanheaderrange(header)
+        if vlan_range is None:
+            other_blocks.append([header] + list(lines))
+        else:
+            entries.append((vlan_range[0], vlan_range[1], list(lines)))
+
+    # sweep the VLANs, the lines only change where an entry starts or ends
+    events = {}  # vlan -> (indexes of the entries starting, indexes of the entries ending before it)
+    for index,(range_start,range_end,_) in enumerate(entries):
+        events.setdefault(range_start, ([], []))[0].append(index)
+        events.setdefault(range_end + 1, ([], []))[1].append(index)
+
+    runs = []  # [first vlan, last vlan, member lines]
+    active = set()
+    points = sorted(events)
+
+    for point,next_point in zip(points, points[1:]):
+        starting,ending = events[point]
+        active.difference_update(ending)
+        active.update(starting)
+
+        if not active:
+            continue
 
-    search_keys = ["interface " + i for i in vlan_interface_types] + ["interface " + i for i in lag_interface_types]
+        lines = tuple(OrderedDict.fromkeys(line for index in sorted(active) for line in entries[index][2]))
+        if runs and runs[-1][1] == point - 1 and runs[-1][2] == lines:
+            runs[-1][1] = next_point - 1
+        else:
+            runs.append([point, next_point - 1, lines])
 
     out = []
+    for range_start,range_end,lines in runs:
+        if range_start == range_end:
+            out.append([f"interface Vlan {range_start}"] + list(lines))
+        else:
+            out.append([f"interface range vlan {range_start} - {range_end}"] + list(lines))
 
-    for line in conf_lines:
-        if line == "interface Vlan 1":
-            # skip default vlan
+    return out + other_blocks
+
+def OS9_MERGEVLANBLOCKS(config_blocks):
+    """
+    Merges VLAN membership changes so there is one block per VLAN (or run of VLANs with the same changes) instead
+    of one per interface/VLAN pair. Removals are moved before everything else (they only depend on the current
+    config) and additions after everything else (so the member interfaces are already set up), since OS9 won't
+    untag a port in a 2nd VLAN until it is removed from the 1st.
+
+    :param config_blocks: 2D list of os9 commands
+    :type config_blocks: list
+    :return: 2D list of os9 commands with membership blocks merged
+    :rtype: list
+    """
+
+    membership_keys = ("untagged ", "tagged ", "no untagged ", "no tagged ")
+
+    remove_blocks = OrderedDict()  # vlan header -> member lines
+    add_blocks = OrderedDict()
+    out = []
+
+    for block in config_blocks:
+        is_membership = len(block) > 1 and block[0].lower().startswith(("interface vlan ", "interface range vlan ")) and \
+            all(line.startswith(membership_keys) for line in block[1:])
+
+        if not is_membership:
+            out.append(block)
+            continue
+
+        for line in block[1:]:
+            vlan_blocks = remove_blocks if line.startswith("no ") else add_blocks
+            # dict keeps the first position of each member and drops repeats
+            vlan_blocks.setdefault(block[0], OrderedDict())[line] = None
+
+    return os9_mergevlanruns(remove_blocks) + out + os9_mergevlanruns(add_blocks)
+
+def os9_intfrange(intf_list):
+    """
+    Creates the OS9 range string for a list of interfaces (ex. "TenGigabitEthernet 1/1 - 4 , TenGigabitEthernet 1/6")
+
+    :param intf_list: List of interface labels
+    :type intf_list: list
+    :return: Range string for "interface range"
+    :rtype: str
+    """
+
+    out = []
+
+    intf_types = OrderedDict()  # interface type -> list of interface labels
+    for intf in intf_list:
+        intf_types.setdefault(intf.split(" ")[0], []).append(intf)
+
+    for intf_type,intf_labels in intf_types.items():
+        port_list = []
+        for intf in intf_labels:
+            intf_id = os9_intfid(intf)
+            if intf_id.is_physical and not intf_id.subport:
+                port_list.append((intf_id.unit, intf_id.port))
+            else:
+                # fanout ports aren't combined
+                out.append(intf)
+
+        port_list.sort()
+
+        i = 0
+        while i < len(port_list):
+            # find the end of this run of ports
+            j = i
+            while j + 1 < len(port_list) and port_list[j + 1] == (port_list[j][0], port_list[j][1] + 1):
+                j += 1
+
+            if i == j:
+                out.append(f"{intf_type} {port_list[i][0]}/{port_list[i][1]}")
+            else:
+                out.append(f"{intf_type} {port_list[i][0]}/{port_list[i][1]} - {port_list[j][1]}")
+
+            i = j + 1
+
+    return " , ".join(out)
+
+def OS9_GROUPINTFBLOCKS(config_blocks):
+    """
+    Combines physical interfaces that need exactly the same commands into a single "interface range" block
+
+    :param config_blocks: 2D list of os9 commands
+    :type config_blocks: list
+    :return: 2D list of os9 commands with identical interface blocks grouped
+    :rtype: list
+    """
+
+    groups = OrderedDict()  # (defaulted, commands) -> list of interface labels
+    out = []
+
+    for block in config_blocks:
+        default_port = len(block) > 1 and block[0].startswith("default interface ")
+        header_index = 1 if default_port else 0
+
+        intf_label = block[header_index][len("interface "):] if block[header_index].startswith("interface ") else ""
+        intf_cmds = tuple(block[header_index + 1:])
+
+        is_physical = os9_intfid(intf_label).is_physical
+        is_lacp = any(line.startswith(("port-channel", "no port-channel")) for line in intf_cmds)
+
+        if not is_physical or is_lacp or len(intf_cmds) == 0 or \
+           (default_port and block[0] != f"default interface {intf_label}"):
+            out.append(block)
+            continue
+
+        group_key = (default_port, intf_cmds)
+        if group_key not in groups:
+            groups[group_key] = []
+            out.append(group_key)  # the group goes where its first interface was
+
+        groups[group_key].append(intf_label)
+
+    for i,block in enumerate(out):
+        if not isinstance(block, tuple):
             continue
 
-        if line.lower().startswith(tuple(search_keys)):
-            line_parts = line.split(" ")
-            intf_type = line_parts[1]
-            intf_num = line_parts[-1]
-            intf_label = " ".join(line_parts[1:])
+        default_port,intf_cmds = block
+        intf_list = groups[block]
+
+        group_block = [f"default interface {intf}" for intf in intf_list] if default_port else []
+        if len(intf_list) == 1:
+            group_block.append(f"interface {intf_list[0]}")
+        else:
+            group_block.append(f"interface range {os9_intfrange(intf_list)}")
+
+        out[i] = group_block + list(intf_cmds)
+
+    return out
+
+# Attribute keys of interface lines, longest first (a line and its "no" form have the same key).
+# Other lines are their own key.
+os9_line_keys = sorted([
+    "shutdown", "description", "name", "mtu", "ip address", "ipv6 address", "switchport", "portmode hybrid",
+    "vlt-peer-lag", "lacp fast-switchover", "fec", "negotiation auto", "intf-type", "port-channel-protocol LACP",
+    "spanning-tree rstp edge-port", "spanning-tree pvst edge-port", "spanning-tree mstp edge-port"
+], key=len, reverse=True)
+
+# Keys that are off when no line has them, so "no <key>" does nothing if the interface has no such line
+os9_absent_keys = {
+    "description", "name", "mtu", "ip address", "ipv6 address", "switchport", "portmode hybrid", "vlt-peer-lag",
+    "lacp fast-switchover", "port-channel-protocol LACP", "spanning-tree rstp edge-port",
+    "spanning-tree pvst edge-port", "spanning-tree mstp edge-port"
+}
+
+# Lines of an interface right after it is defaulted or created
+os9_default_lines = {"no ip address", "shutdown"}
+
+def os9_linekey(line):
+    """
+    Returns the attribute a line sets (ex. "mtu" for "mtu 9216" and "no mtu")
+
+    :param line: Interface config line
+    :type line: str
+    :return: Attribute key (channel-member lines are keyed by the ID of the member)
+    :rtype: str or tuple
+    """
+
+    if line.startswith("no "):
+        line = line[len("no "):]
+
+    if line.startswith("channel-member "):
+        # each member is its own attribute
+        return "channel-member", os9_intfid(line[len("channel-member "):])
+
+    for key in os9_line_keys:
+        if line == key or line.startswith(key + " "):
+            return key
+
+    return line
+
+def os9_rangelabels(range_str):
+    """
+    Expands the target of an "interface" command into interface labels (the reverse of os9_intfrange)
+
+    :param range_str: Header without "interface " (ex. "range TenGigabitEthernet 1/1 - 4 , TenGigabitEthernet 1/6")
+    :type range_str: str
+    :return: List of interface labels
+    :rtype: list
+    """
+
+    if not range_str.startswith("range "):
+        return [range_str]
+
+    range_str = range_str[len("range "):]
+
+    if range_str.lower().startswith("vlan "):
+        range_parts = range_str.split(" ")
+        range_end = int(range_parts[-1]) if len(range_parts) > 2 else int(range_parts[1])
+        return [f"Vlan {vlan_id}" for vlan_id in range(int(range_parts[1]), range_end + 1)]
+
+    out = []
+    for range_item in range_str.split(" , "):
+        range_parts = range_item.split(" ")
+        if len(range_parts) == 4:
+            # "Type U/P - Q"
+            unit,start_port = range_parts[1].split("/")
+            out += [f"{range_parts[0]} {unit}/{port}" for port in range(int(start_port), int(range_parts[3]) + 1)]
+        else:
+            out.append(range_item)
+
+    return out
+
+def os9_membershipline(intf, line):
+    """
+    Parses a VLAN membership line (ex. "no tagged TenGigabitEthernet 1/1" under "interface Vlan 10")
+
+    :return: Tuple of <member ID>,<vlan mode>,<is removal>, or None if it isn't a membership line
+    :rtype: tuple
+    """
+
+    if not os9_intfid(intf).is_vlan:
+        return None
+
+    is_removal = line.startswith("no ")
+    line_parts = line[len("no "):].split(" ", 1) if is_removal else line.split(" ", 1)
+    if line_parts[0] not in ("untagged", "tagged") or len(line_parts) < 2:
+        return None
+
+    return os9_intfid(line_parts[1]), line_parts[0], is_removal
+
+class OS9PlanState(object):
+    """
+    The state of a switch while a plan is simulated: the lines of each interface and the VLAN memberships
+    of each member. Interfaces are copied from the running config the first time a command touches them.
+    """
+
+    def __init__(self, sw_config):
+        self.sw_config = sw_config
+        self.intfs = {}  # interface ID -> set of lines, or None if the interface doesn't exist
+        self.members = {}  # member ID -> set of (vlan ID, vlan mode)
+        self.deleted_vlans = set()  # IDs of VLANs deleted by the plan
+
+    def get_lines(self, intf):
+        intf_id = os9_intfid(intf)
+        if intf_id not in self.intfs:
+            self.intfs[intf_id] = set(self.sw_config.get_intf(intf_id)) if intf_id in self.sw_config.blocks else None
+        return self.intfs[intf_id]
+
+    def get_members(self, member_id):
+        if member_id not in self.members:
+            self.members[member_id] = set()
+            for vlan_mode in ["untagged", "tagged"]:
+                for vlan_label in self.sw_config.get_vlans(member_id, vlan_mode):
+                    if os9_intfid(vlan_label) not in self.deleted_vlans:
+                        self.members[member_id].add((os9_intfid(vlan_label), vlan_mode))
+        return self.members[member_id]
+
+    def create(self, intf):
+        self.intfs[os9_intfid(intf)] = set(os9_default_lines)
+
+    def reset(self, intf, exists):
+        """
+        Defaults (exists) or deletes an interface, which also removes its VLAN memberships
+        """
+
+        intf_id = os9_intfid(intf)
+        self.intfs[intf_id] = set(os9_default_lines) if exists else None
+        self.get_members(intf_id).clear()
+
+        if intf_id.is_vlan:
+            for vlan_set in self.members.values():
+                vlan_set.difference_update({(intf_id, "untagged"), (intf_id, "tagged")})
+            self.deleted_vlans.add(intf_id)
+
+    def is_noop(self, intf, line):
+        """
+        Returns True if line wouldn't change interface intf
+        """
+
+        membership = os9_membershipline(intf, line)
+        if membership is not None:
+            member_id,vlan_mode,is_removal = membership
+            return ((os9_intfid(intf), vlan_mode) in self.get_members(member_id)) != is_removal
+
+        intf_lines = self.get_lines(intf)
+        if intf_lines is None:
+            return False
+
+        if line in intf_lines:
+            return True
+
+        line_key = os9_linekey(line)
+        return line.startswith("no ") and line_key in os9_absent_keys and \
+            not any(os9_linekey(intf_line) == line_key and not intf_line.startswith("no ") for intf_line in intf_lines)
+
+    def apply(self, intf, line):
+        """
+        Changes the state of interface intf as line would
+        """
+
+        membership = os9_membershipline(intf, line)
+        if membership is not None:
+            member_id,vlan_mode,is_removal = membership
+            if is_removal:
+                self.get_members(member_id).discard((os9_intfid(intf), vlan_mode))
+            else:
+                self.get_members(member_id).add((os9_intfid(intf), vlan_mode))
+            return
+
+        intf_lines = self.get_lines(intf)
+        if intf_lines is None:
+            self.create(intf)
+            intf_lines = self.get_lines(intf)
+
+        line_key = os9_linekey(line)
+        intf_lines.difference_update([intf_line for intf_line in intf_lines if os9_linekey(intf_line) == line_key])
+        if line == "no port-channel-protocol LACP":
+            # the LACP sub-commands go with it
+            intf_lines.difference_update([intf_line for intf_line in intf_lines if intf_line.startswith("port-channel ")])
+        if not (line.startswith("no ") and line_key in os9_absent_keys):
+            intf_lines.add(line)
+
+def OS9_OPTIMIZEPLAN(config_blocks, sw_config):
+    """
+    Simulates a plan against the running config and removes the commands that don't change anything, like
+    "shutdown" on a port that was just defaulted, and VLAN memberships that are removed and added back (or added
+    and removed) with nothing in between depending on them. Blocks that are left with nothing to do are removed.
+
+    :param config_blocks: 2D list of os9 commands, in the order they are sent
+    :type config_blocks: list
+    :param sw_config: Parsed switch configuration
+    :type sw_config: OS9Config
+    :return: 2D list of os9 commands
+    :rtype: list
+    """
+
+    state = OS9PlanState(sw_config)
+    out = []  # list of (block, creates an interface)
+
+    # membership changes that would be undone by the opposite change:
+    # (member, vlan, vlan mode) -> (block, line) of the change
+    pending = {}
+    pending_intfs = {}  # member or vlan -> keys of its pending changes
+
+    def drop_pending(intf_id):
+        for pending_key in pending_intfs.pop(intf_id, []):
+            pending.pop(pending_key, None)
+
+    for block in config_blocks:
+        out_block = []
+        targets = []
+        creates = False
+        lacp_skipped = False  # "port-channel-protocol LACP" was left out, but the lines after it need it
+
+        for line in block:
+            if line.startswith(("default interface ", "no interface ")):
+                intf = line.split(" ", 2)[2]
+                exists = line.startswith("default ")
+                if exists and state.get_lines(intf) == os9_default_lines and \
+                        not state.get_members(os9_intfid(intf)):
+                    # already in the default state
+                    continue
+                if not exists and state.get_lines(intf) is None:
+                    continue
+
+                state.reset(intf, exists)
+                drop_pending(os9_intfid(intf))
+                out_block.append(line)
+            elif line.startswith("interface "):
+                targets = os9_rangelabels(line[len("interface "):])
+                for intf in targets:
+                    if state.get_lines(intf) is None:
+                        # entering an interface that doesn't exist creates it
+                        state.create(intf)
+                        creates = True
+                out_block.append(line)
+            elif targets and all(state.is_noop(intf, line) for intf in targets):
+                lacp_skipped = lacp_skipped or line == "port-channel-protocol LACP"
+            else:
+                membership = os9_membershipline(targets[0], line) if len(targets) == 1 else None
+                if membership is not None:
+                    member_id = membership[0]
+                    pending_key = (member_id, os9_intfid(targets[0]), membership[1])
+                    if pending_key in pending:
+                        # this undoes an earlier change, so neither is needed
+                        pending_block,pending_line = pending.pop(pending_key)
+                        pending_block.remove(pending_line)
+                        state.apply(targets[0], line)
+                        continue
+
+                    # other changes to the member may depend on this one
+                    drop_pending(member_id)
+                    pending[pending_key] = (out_block, line)
+                    pending_intfs.setdefault(pending_key[0], []).append(pending_key)
+                    pending_intfs.setdefault(pending_key[1], []).append(pending_key)
+                else:
+                    for intf in targets:
+                        drop_pending(os9_intfid(intf))
+                        membership = os9_membershipline(intf, line)
+                        if membership is not None:
+                            drop_pending(membership[0])
+
+                if lacp_skipped and line.startswith("port-channel "):
+                    out_block.append("port-channel-protocol LACP")
+                lacp_skipped = False
+
+                for intf in targets:
+                    state.apply(intf, line)
+                out_block.append(line)
+
+        out.append((out_block, creates))
+
+    # drop what is left of blocks that have nothing to do
+    config_blocks = []
+    for out_block,creates in out:
+        if out_block and out_block[-1].startswith("interface ") and not creates:
+            out_block.pop()
+        if out_block:
+            config_blocks.append(out_block)
+
+    return config_blocks
+
+# Schema of the interface and vlan manifests (group_vars/all/vlans.yaml, host_vars/HOST/interfaces.yaml)
+os9_vlan_id_schema = {"type": "integer", "minimum": 1, "maximum": 4094}
+os9_intf_label_schema = {"type": "string", "pattern": r"^\S+ \d+(/\d+)*$"}
+
+os9_manifest_schema = {
+    "type": "object",
+    "properties": {
+        "interfaces": {
+            "type": "object",
+            "propertyNames": os9_intf_label_schema,
+            "additionalProperties": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "state": {"enum": ["up", "down"]},
+                    "mtu": {"type": "integer", "minimum": 576, "maximum": 9416},
+                    "fec": {"type": "boolean"},
+                    "autoneg": {"type": "boolean"},
+                    "stp-edge": {"type": "boolean"},
+                    "managed": {"type": "boolean"},
+                    "portmode": {"enum": ["access", "trunk", "hybrid"]},
+                    "untagged": os9_vlan_id_schema,
+                    "tagged": {
+                        "type": "array",
+                        "items": {"anyOf": [os9_vlan_id_schema, {"type": "string", "pattern": r"^\d+:\d+$"}]}
+                    },
+                    "ip4": {"type": "string", "pattern": r"^\d+\.\d+\.\d+\.\d+/\d+$"},
+                    "ip6": {"type": "string"},
+                    "lag-members": {"type": "array", "items": os9_intf_label_schema},
+                    "lacp-members-active": {"type": "array", "items": os9_intf_label_schema},
+                    "lacp-members-passive": {"type": "array", "items": os9_intf_label_schema},
+                    "lacp-rate": {"enum": ["fast", "slow"]},
+                    "mlag": os9_intf_label_schema,
+                    "fanout": {
+                        "type": "object",
+                        "properties": {
+                            "type": {"type": "string"},
+                            "speed": {"type": "string"}
+                        },
+                        "required": ["type", "speed"]
+                    }
+                }
+            }
+        },
+        "vlans": {
+            "type": "object",
+            # 1-4094
+            "propertyNames": {"pattern": r"^([1-9]\d{0,2}|[1-3]\d{3}|40[0-8]\d|409[0-4])$"},
+            "additionalProperties": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "managed": {"type": "boolean"}
+                },
+                "additionalProperties": False
+            }
+        }
+    }
+}
 
-            not_manifest_vlan = intf_type == "Vlan" and int(intf_num) not in vlans
-            not_manifest_lag = intf_type == "Port-channel" and intf_label not in manifest
+def OS9_VALIDATEMANIFEST(intf, vlans):
+    """
+    Validates the manifests of a switch against os9_manifest_schema
 
-            if not_manifest_vlan or not_manifest_lag:
-                out.append(f"no {line}")
+    :param intf: Interface manifest
+    :type intf: dict
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :return: List of errors (ex. "interfaces > Vlan 10 > state: 'on' is not one of ['up', 'down']"), empty if valid
+    :rtype: list
+    """
+
+    if not HAS_JSONSCHEMA:
+        raise ImportError("jsonschema is required to validate manifests (pip install jsonschema)")
+
+    # vlan ids are integer keys in YAML, but JSON schema only has string keys
+    manifest = {"interfaces": intf, "vlans": {str(key): value for key, value in vlans.items()}}
+    validator = jsonschema.Draft7Validator(os9_manifest_schema)
+
+    out = []
+    for error in sorted(validator.iter_errors(manifest), key=lambda e: [str(p) for p in e.absolute_path]):
+        out.append(" > ".join(str(p) for p in error.absolute_path) + f": {error.message}")
 
     return out
 
-def OS9_GETCONFIG(sw_config, intf, vlans):
+def OS9_COMPILEMANIFEST(intf, vlans):
+    """
+    Normalizes the manifests of a switch into the form OS9_GETCONFIG plans from
+
+    :param intf: Interface manifest
+    :type intf: dict
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :return: Dict with "manifest" (vlans as "Vlan N" merged with the interfaces) and "managed_vlans" (list of str)
+    :rtype: dict
+    """
+
+    managed_vlan_list = [str(key) for key, value in vlans.items() if "managed" in value and value["managed"]]
+    vlans = {"Vlan " + str(key): value for key, value in vlans.items()}
+
+    # VLAN interfaces in the interface manifest are merged with their VLAN however they are written
+    vlan_labels = {os9_intfid(label): label for label in vlans}
+    intf = {vlan_labels.get(os9_intfid(label), label): fields for label, fields in intf.items()}
+
+    return {
+        "manifest": merge_dicts(vlans, intf),
+        "managed_vlans": managed_vlan_list
+    }
+
+def OS9_PRUNEVLANS(vlans, intf, pinned=None):
+    """
+    Reduces the VLAN manifest to the VLANs a switch needs: VLANs its interfaces tag or untag, VLANs configured
+    in its interface manifest (ex. L3 VLAN interfaces), pinned VLANs and managed VLANs. The rest are planned as
+    if they weren't in the manifest, so they aren't created (and are removed if they exist).
+
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param intf: Interface manifest of the switch
+    :type intf: dict
+    :param pinned: VLANs to keep even if nothing uses them (list of vlans or vlan ranges like 1000:1010)
+    :type pinned: list
+    :return: VLAN manifest with only the VLANs the switch needs
+    :rtype: dict
+    """
+
+    vlan_bits = os9_vlanbits(pinned or [])
+
+    for key, fields in intf.items():
+        if os9_intfid(key).is_vlan:
+            vlan_bits |= 1 << os9_intfid(key).port
+        if "untagged" in fields:
+            vlan_bits |= 1 << int(fields["untagged"])
+        if "tagged" in fields:
+            vlan_bits |= os9_vlanbits(fields["tagged"])
+
+    return {key: value for key, value in vlans.items()
+            if vlan_bits >> int(key) & 1 or ("managed" in value and value["managed"])}
+
+@os9_profiledfilter
+def OS9_GETCONFIG(sw_config, intf, vlans, compiled=None):
     """
     Main method which returns a 2d list of commands, where each nested list is an interface
 
@@ -1003,34 +2533,85 @@ def OS9_GETCONFIG(sw_config, intf, vlans):
     :type manifest: dict
     :param type: Type of manifest (vlan or intf)
     :type type: str
+    :param compiled: Output of OS9_COMPILEMANIFEST for intf and vlans, if it is already compiled
+    :type compiled: dict
     :return: 2D List os os9 commands
     :rtype: list
     """
 
-    conf_lines = sw_config["ansible_facts"]["ansible_net_config"].splitlines()
-    conf_lines = OS9_GETEXTENDEDCFG(conf_lines)
+    diff = os9_diff(sw_config, intf, vlans, compiled)
+    conf_lines = diff.current.conf
 
-    managed_vlan_list = [str(key) for key, value in vlans.items() if "managed" in value and value["managed"]]
-    vlans = {"Vlan " + str(key): value for key, value in vlans.items()}
-    manifest = merge_dicts(vlans, intf)
+    out = [change.render() for change in diff.config]
+    del diff  # the changes are rendered, so they don't have to be kept while the plan is optimized
 
-    out = []
-    default_list = []
+    out = OS9_GROUPINTFBLOCKS(out)
+    out = OS9_MERGEVLANBLOCKS(out)
 
-    for key,fields in manifest.items():
-        if "managed" in fields and fields["managed"]:
-            # Don't edit managed interfaces
-            continue
+    return OS9_OPTIMIZEPLAN(out, conf_lines)
 
-        if "fanout" in fields:
-            # Skip fanouts
-            continue
+# Top level lines every switch must have, sent first if any is missing ({hostname} is the inventory hostname)
+os9_global_lines = ["ip ssh connection-rate-limit 60", "hostname {hostname}"]
 
-        intf_lines,default_list = OS9_GENERATEINTFCONFIG(key, fields, conf_lines, managed_vlan_list, default_list)
-        if len(intf_lines) > 0:
-            out += intf_lines
+def os9_planfanout(sw_config, intf, global_lines):
+    """
+    Plans the first stages of a reconcile: the missing global lines and the fanout change
 
-    return out
+    :param sw_config: Running switch config
+    :type sw_config: dict
+    :param intf: Interface manifest
+    :type intf: dict
+    :param global_lines: Top level lines the config must have
+    :type global_lines: list
+    :return: Tuple of (dict of "global" and "fanout" commands, config to plan the manifest against after them or
+             None if the fanout change can't be predicted)
+    :rtype: tuple
+    """
+
+    conf = OS9_LOADCONFIG(sw_config)
+
+    plan = {
+        "global": [line for line in global_lines if line not in conf.get_global(line)],
+        "fanout": OS9_FANOUTCFG(sw_config, intf),
+    }
+
+    if not plan["fanout"]:
+        return plan, sw_config
+
+    # fanout changes only add or remove ports, so the config after them is predicted if possible
+    return plan, OS9_FANOUTMODEL(sw_config, intf) or None
+
+def os9_planmanifest(plan, sw_config, intf, vlans, compiled=None):
+    """
+    Plans the last stages of a reconcile (manifest and deleted interfaces) against the config after the fanout
+
+    :param plan: Output of os9_planfanout, the "config" and "clean" commands are added to it
+    :type plan: dict
+    :return: plan
+    :rtype: dict
+    """
+
+    plan["config"] = OS9_GETCONFIG(sw_config, intf, vlans, compiled)
+    plan["clean"] = OS9_CLEANINTF(sw_config, intf, vlans)
+
+    return plan
+
+def os9_reconcileplan(sw_config, intf, vlans, global_lines, compiled=None):
+    """
+    Plans everything os9_reconcile would push, without a switch. When the fanout change can't be predicted, the
+    manifest is planned against the config before it (os9_reconcile gathers the config again instead).
+
+    :return: Dict of "global", "fanout", "config" and "clean" commands, and "predicted" (None without a fanout
+             change, else whether the config after it was predicted)
+    :rtype: dict
+    """
+
+    plan, after_fanout = os9_planfanout(sw_config, intf, global_lines)
+
+    os9_planmanifest(plan, after_fanout or sw_config, intf, vlans, compiled)
+    plan["predicted"] = after_fanout is not None if plan["fanout"] else None
+
+    return plan
 
 def merge_dicts(dict1, dict2):
     """
@@ -1062,5 +2643,8 @@ class FilterModule(object):
         return {
             "OS9_GETCONFIG": OS9_GETCONFIG,
             "OS9_CLEANINTF": OS9_CLEANINTF,
-            "OS9_FANOUTCFG": OS9_FANOUTCFG
+            "OS9_FANOUTCFG": OS9_FANOUTCFG,
+            "OS9_FANOUTMODEL": OS9_FANOUTMODEL,
+            "OS9_VALIDATEMANIFEST": OS9_VALIDATEMANIFEST,
+            "OS9_PRUNEVLANS": OS9_PRUNEVLANS
         }
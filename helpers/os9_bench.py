@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the OS9 filter plugin (filter_plugins/dell_os9.py)
+
+Generates synthetic running configs and matching manifests, from a single 48 port TOR up to a 4 unit stack
+with every VLAN and heavy fanout, then times each filter and each phase (tokenize, index, plan) and records the
+peak memory. Runs fully offline.
+
+Usage:
+    helpers/os9_bench.py [--scenario NAME ...] [--repeat N] [--output FILE] [--compare OLD_FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "filter_plugins"))
+import dell_os9  # noqa: E402
+
+# name -> parameters of the generated switch
+SCENARIOS = {
+    "tor-48": {
+        "units": 1,
+        "ports": 48,
+        "uplinks": 4,
+        "fanouts": 0,
+        "vlans": 300,
+        "trunk_vlans": 200,
+        "lags": 2,
+    },
+    "core-100g": {
+        "units": 1,
+        "ports": 32,
+        "uplinks": 0,
+        "fanouts": 0,
+        "vlans": 750,
+        "trunk_vlans": 700,
+        "lags": 8,
+    },
+    "stack-2": {
+        "units": 2,
+        "ports": 48,
+        "uplinks": 6,
+        "fanouts": 4,
+        "vlans": 1000,
+        "trunk_vlans": 1000,
+        "lags": 8,
+    },
+    "stack-4-full": {
+        "units": 4,
+        "ports": 48,
+        "uplinks": 6,
+        "fanouts": 6,
+        "vlans": 4093,
+        "trunk_vlans": 4000,
+        "lags": 16,
+    },
+}
+
+PORT_TYPE = "TenGigabitEthernet"
+UPLINK_TYPE = "fortyGigE"
+
+
+def vlan_ranges(vlan_list):
+    """
+    Compresses a sorted list of vlans into manifest ranges (ex. [2, 3, 4, 7] -> ["2:4", 7])
+    """
+
+    out = []
+    i = 0
+    while i < len(vlan_list):
+        j = i
+        while j + 1 < len(vlan_list) and vlan_list[j + 1] == vlan_list[j] + 1:
+            j += 1
+        out.append(vlan_list[i] if i == j else f"{vlan_list[i]}:{vlan_list[j]}")
+        i = j + 1
+    return out
+
+
+def intf_ranges(intf_list):
+    """
+    Compresses interface labels into OS9 running config ranges (ex. "TenGigabitEthernet 1/1-1/4,1/6")
+    """
+
+    out = []
+    by_type = {}
+    for intf in intf_list:
+        intf_type, intf_num = intf.split(" ")
+        by_type.setdefault(intf_type, []).append([int(i) for i in intf_num.split("/")])
+
+    for intf_type, nums in by_type.items():
+        nums.sort()
+        parts = []
+        i = 0
+        while i < len(nums):
+            j = i
+            while j + 1 < len(nums) and nums[j + 1][:-1] == nums[j][:-1] and nums[j + 1][-1] == nums[j][-1] + 1:
+                j += 1
+            first = "/".join(map(str, nums[i]))
+            parts.append(first if i == j else f"{first}-{'/'.join(map(str, nums[j]))}")
+            i = j + 1
+        out.append(f"{intf_type} {','.join(parts)}")
+
+    return out
+
+
+def generate(params, seed=0, drift=0.1):
+    """
+    Generates a manifest and a running config that differs from it by about "drift"
+
+    :return: Tuple of (running config text, interfaces manifest, vlans manifest)
+    """
+
+    rnd = random.Random(seed)
+
+    vlans = {}
+    for vlan_id in range(2, params["vlans"] + 2):
+        vlans[vlan_id] = {"name": f"BENCH-{vlan_id}", "description": f"Benchmark vlan {vlan_id}"}
+    vlan_ids = sorted(vlans)
+    trunk_vlans = vlan_ids[:params["trunk_vlans"]]
+
+    interfaces = {}
+    fanout_lines = []
+    for unit in range(1, params["units"] + 1):
+        for port in range(1, params["ports"] + 1):
+            label = f"{PORT_TYPE} {unit}/{port}"
+            if port % 4 == 0:
+                # unused port
+                interfaces[label] = {"state": "down"}
+            elif port % 4 == 1:
+                interfaces[label] = {
+                    "description": f"trunk {unit}/{port}",
+                    "state": "up",
+                    "mtu": 9216,
+                    "portmode": "trunk",
+                    "tagged": vlan_ranges(trunk_vlans),
+                }
+            else:
+                interfaces[label] = {
+                    "description": f"access {unit}/{port}",
+                    "state": "up",
+                    "mtu": 9216,
+                    "portmode": "hybrid",
+                    "untagged": rnd.choice(vlan_ids),
+                    "stp-edge": True,
+                }
+
+        for uplink in range(params["ports"] + 1, params["ports"] + params["uplinks"] + 1):
+            label = f"{UPLINK_TYPE} {unit}/{uplink}"
+            if uplink - params["ports"] <= params["fanouts"]:
+                interfaces[label] = {"fanout": {"type": "quad", "speed": "10G"}}
+                if rnd.random() > drift:
+                    fanout_lines.append(f"stack-unit {unit} port {uplink} portmode quad speed 10G")
+                for sub_port in range(1, 5):
+                    interfaces[f"{PORT_TYPE} {unit}/{uplink}/{sub_port}"] = {
+                        "description": f"fanout {unit}/{uplink}/{sub_port}",
+                        "state": "up",
+                        "portmode": "trunk",
+                        "tagged": vlan_ranges(trunk_vlans[:100]),
+                    }
+            else:
+                interfaces[label] = {"state": "up", "mtu": 9216}
+
+    physical = [label for label in interfaces if "fanout" not in interfaces[label]]
+    for lag in range(1, params["lags"] + 1):
+        members = [physical.pop() for i in range(2) if physical]
+        for member in members:
+            interfaces[member] = {"state": "up"}
+        interfaces[f"Port-channel {lag}"] = {
+            "description": f"lag {lag}",
+            "state": "up",
+            "mtu": 9216,
+            "portmode": "trunk",
+            "tagged": vlan_ranges(trunk_vlans),
+            "lacp-members-active": members,
+            "mlag": f"Port-channel {lag}",
+        }
+
+    return render(interfaces, vlans, fanout_lines, rnd, drift), interfaces, vlans
+
+
+def render(interfaces, vlans, fanout_lines, rnd, drift):
+    """
+    Renders a running config for the manifest, leaving out about "drift" of the settings
+    """
+
+    lines = ["!", "hostname BENCH", "!"] + fanout_lines + ["!"]
+    fanned = {line.split(" ")[1] + "/" + line.split(" ")[3] for line in fanout_lines}
+
+    tagged = {}
+    untagged = {}
+    lacp = {}
+
+    for label, fields in interfaces.items():
+        if label.startswith("Port-channel"):
+            for member in fields.get("lacp-members-active", []):
+                lacp[member] = label
+
+    for label, fields in interfaces.items():
+        if label.startswith(("Port-channel", "Vlan")):
+            continue
+
+        port_num = label.split(" ")[1]
+        parent = "/".join(port_num.split("/")[:2])
+        is_fanout_port = "fanout" in fields
+        if (is_fanout_port and port_num in fanned) or (port_num.count("/") == 2 and parent not in fanned):
+            continue
+
+        lines.append(f"interface {label}")
+        if "description" in fields and rnd.random() > drift:
+            lines.append(f" description {fields['description']}")
+        lines.append(" no ip address")
+        if "mtu" in fields and rnd.random() > drift:
+            lines.append(f" mtu {fields['mtu']}")
+        if "portmode" in fields and rnd.random() > drift:
+            if fields["portmode"] == "hybrid":
+                lines.append(" portmode hybrid")
+            lines.append(" switchport")
+        if fields.get("stp-edge") and rnd.random() > drift:
+            lines += [f" spanning-tree {stp} edge-port" for stp in ("rstp", "pvst", "mstp")]
+        if label in lacp:
+            lines.append(" port-channel-protocol LACP")
+            lines.append(f"  {lacp[label].lower()} mode active")
+        lines.append(" no shutdown" if fields.get("state") == "up" and rnd.random() > drift else " shutdown")
+        lines.append("!")
+
+        for vlan_run in dell_os9.os9_vlanruns(dell_os9.os9_vlanbits(fields.get("tagged", []))):
+            for tag_vlan in range(vlan_run[0], vlan_run[1] + 1):
+                if rnd.random() > drift:
+                    tagged.setdefault(tag_vlan, []).append(label)
+        if "untagged" in fields and rnd.random() > drift:
+            untagged.setdefault(fields["untagged"], []).append(label)
+
+    for label, fields in interfaces.items():
+        if not label.startswith("Port-channel"):
+            continue
+        lines.append(f"interface {label}")
+        if rnd.random() > drift:
+            lines.append(f" description {fields['description']}")
+        lines += [" no ip address", f" mtu {fields['mtu']}", " switchport"]
+        lines.append(f" vlt-peer-lag {fields['mlag'].lower()}")
+        lines.append(" no shutdown")
+        lines.append("!")
+        for vlan_run in dell_os9.os9_vlanruns(dell_os9.os9_vlanbits(fields["tagged"])):
+            for tag_vlan in range(vlan_run[0], vlan_run[1] + 1):
+                if rnd.random() > drift:
+                    tagged.setdefault(tag_vlan, []).append(label)
+
+    for vlan_id, fields in vlans.items():
+        if rnd.random() < drift / 4:
+            # missing vlan
+            continue
+        lines.append(f"interface Vlan {vlan_id}")
+        if rnd.random() > drift:
+            lines.append(f" description {fields['description']}")
+        if rnd.random() > drift:
+            lines.append(f" name {fields['name']}")
+        lines.append(" no ip address")
+        members = tagged.get(vlan_id, [])
+        lines += [f" tagged {r}" for r in intf_ranges([m for m in members if not m.startswith("Port-channel")])]
+        lags = [m.split(" ")[1] for m in members if m.startswith("Port-channel")]
+        if lags:
+            lines.append(f" tagged Port-channel {','.join(lags)}")
+        lines += [f" untagged {r}" for r in intf_ranges(untagged.get(vlan_id, []))]
+        lines.append(" shutdown")
+        lines.append("!")
+
+    # a vlan that isn't in the manifest
+    lines += [f"interface Vlan {max(vlans) + 1}", " no ip address", " shutdown", "!", "end"]
+
+    return "\n".join(lines) + "\n"
+
+
+def timed(func, *args):
+    """
+    Runs a function, returning (result, seconds)
+    """
+
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_scenario(name, params, repeat):
+    """
+    Times the phases and filters of one scenario, keeping the best of "repeat" runs
+    """
+
+    config_text, interfaces, vlans = generate(params)
+    sw_config = {"ansible_facts": {"ansible_net_config": config_text}}
+    conf_lines = config_text.splitlines()
+
+    timings = {}
+
+    def record(key, seconds):
+        timings[key] = min(timings.get(key, seconds), seconds)
+
+    for i in range(repeat):
+        dell_os9.os9_config_cache.clear()
+
+        # phases
+        records, seconds = timed(list, dell_os9.os9_tokenize(config_text))
+        record("phase_tokenize", seconds)
+        conf, seconds = timed(dell_os9.OS9Config, records)
+        record("phase_index", seconds)
+        dell_os9.OS9_LOADCONFIG(sw_config)  # warm the cache so the filter only plans
+        plan, seconds = timed(dell_os9.OS9_GETCONFIG, sw_config, interfaces, vlans)
+        record("phase_plan", seconds)
+
+        # filters, each with a cold cache
+        for filter_name in ("OS9_FANOUTCFG", "OS9_GETCONFIG", "OS9_CLEANINTF"):
+            dell_os9.os9_config_cache.clear()
+            filter_func = getattr(dell_os9, filter_name)
+            if filter_name == "OS9_FANOUTCFG":
+                result, seconds = timed(filter_func, sw_config, interfaces)
+            else:
+                result, seconds = timed(filter_func, sw_config, interfaces, vlans)
+            record(filter_name, seconds)
+
+    # peak memory of a full cold planning run
+    dell_os9.os9_config_cache.clear()
+    tracemalloc.start()
+    dell_os9.OS9_FANOUTCFG(sw_config, interfaces)
+    dell_os9.OS9_GETCONFIG(sw_config, interfaces, vlans)
+    dell_os9.OS9_CLEANINTF(sw_config, interfaces, vlans)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "params": params,
+        "config_lines": len(conf_lines),
+        "config_records": len(records),
+        "manifest_interfaces": len(interfaces),
+        "plan_blocks": len(plan),
+        "plan_lines": sum(len(block) for block in plan),
+        "seconds": timings,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OS9 filter plugin against synthetic configs")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (can be repeated, default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario, the best is kept (default: 3)")
+    parser.add_argument("--output", default="bench_output.json", help="JSON results file (default: bench_output.json)")
+    parser.add_argument("--compare", help="Previous JSON results file to compare against")
+    args = parser.parse_args()
+
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "scenarios": {},
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["scenarios"]
+
+    for name in args.scenario or SCENARIOS:
+        result = bench_scenario(name, SCENARIOS[name], args.repeat)
+        results["scenarios"][name] = result
+
+        print(f"{name}: {result['config_lines']} config lines, {result['plan_blocks']} blocks / "
+              f"{result['plan_lines']} lines planned, peak memory {result['peak_memory_bytes'] / 1e6:.1f} MB")
+        for key, seconds in result["seconds"].items():
+            line = f"    {key:<16} {seconds * 1000:10.1f} ms"
+            if previous and name in previous and key in previous[name]["seconds"]:
+                old_seconds = previous[name]["seconds"][key]
+                line += f"    ({seconds / old_seconds:.2f}x of {old_seconds * 1000:.1f} ms)" if old_seconds else ""
+            print(line)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
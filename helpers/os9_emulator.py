@@ -0,0 +1,1351 @@
+#!/usr/bin/env python3
+"""
+OS9 CLI emulator for offline push tests and benchmarks
+
+Runs emulated Dell OS9 switches that keep a running config and accept the commands the deploy sends
+(configure terminal, interface, tagged/untagged, channel-member, port-channel-protocol LACP, default interface,
+no interface, stack-unit ... portmode, write memory, copy running-config startup-config, ...). Each switch
+answers "show running-config" and "show version" like a real one, so the deploy playbook and os9_reconcile can
+run against it unchanged. Commands can be given a latency, and "ip ssh connection-rate-limit" is enforced.
+
+Usage:
+    helpers/os9_emulator.py [--host HOST ...] [--configs DIR | --scenario NAME] [--listen ADDR] [--base-port PORT]
+                            [--latency SECONDS] [--show-latency SECONDS] [--save-latency SECONDS]
+                            [--inventory-out FILE] [--stats-json FILE]
+    helpers/os9_emulator.py --stdio [--host HOST] [--configs DIR | --scenario NAME]
+
+Each host listens for SSH on its own port (--base-port, then the next ports in order), and --inventory-out
+writes an inventory pointing the hosts at them with their groups from the inventory. Switches are seeded from
+their saved running config (--configs, named like for helpers/os9_plan.py) or from a benchmark scenario.
+SSH needs paramiko (pip install paramiko). --stdio runs one switch on stdin/stdout instead.
+
+The emulator doesn't use the OS9 filter plugin: the commands and how they change the running config are its
+own, so a push test checks the planner against a separate model of the switch. Only seeding a switch from a
+benchmark scenario imports helpers/os9_bench.py (and with it the filter plugin).
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import signal
+import socket
+import sys
+import threading
+import time
+
+try:
+    import paramiko
+    HAS_PARAMIKO = True
+except ImportError:
+    HAS_PARAMIKO = False
+
+from ansible.inventory.helpers import sort_groups
+from ansible.inventory.manager import InventoryManager
+from ansible.parsing.dataloader import DataLoader
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Saved running configs are named like for helpers/os9_plan.py
+CONFIG_EXTENSIONS = ["", ".txt", ".cfg"]
+
+OS9_VERSION = "9.14(2.4)"
+
+# Connections per minute allowed before "ip ssh connection-rate-limit" is set (the OS9 default)
+DEFAULT_RATE_LIMIT = 10
+
+# Interface types as the running config spells them. The CLI takes them in any case, and cut to any prefix only
+# one of them has (ex. "te", "po", "vl").
+INTF_TYPES = ["GigabitEthernet", "TenGigabitEthernet", "twentyFiveGigE", "fortyGigE", "fiftyGigE", "hundredGigE",
+              "ManagementEthernet", "Port-channel", "Vlan"]
+LAG_TYPE = "Port-channel"
+VLAN_TYPE = "Vlan"
+MGMT_TYPE = "ManagementEthernet"
+
+# Lines of an interface that was just created or defaulted, by command
+FACTORY_LINES = {"ip address": "no ip address", "shutdown": "shutdown"}
+
+# Interface commands, by the command without its value (a new value replaces the old one):
+#   value: "required" if the command takes a value, "optional" if it can have one
+#   types: interface types it applies to ("physical" for any physical port), every type if it isn't set
+#   shown: "set" if the running config lists it while it is set ("no" removes it), "both" if the "no" form is
+#       listed too (ex. "no shutdown"), "unset" if it is the default and only its "no" form is listed
+#       (ex. "no negotiation auto")
+#   reset: value that puts it back to its default (ex. "fec default")
+#   no_line: line listed for the "no" form, when it drops the value (ex. "no ip address")
+INTF_COMMANDS = {
+    "description": {"value": "required", "shown": "set"},
+    "name": {"value": "required", "types": (VLAN_TYPE,), "shown": "set"},
+    "ip address": {"value": "required", "shown": "both", "no_line": "no ip address"},
+    "ipv6 address": {"value": "required", "shown": "set"},
+    "mtu": {"value": "required", "shown": "set"},
+    "portmode hybrid": {"types": ("physical", LAG_TYPE), "shown": "set"},
+    "switchport": {"types": ("physical", LAG_TYPE), "shown": "set"},
+    "vlt-peer-lag": {"value": "required", "types": (LAG_TYPE,), "shown": "set"},
+    "lacp fast-switchover": {"types": (LAG_TYPE,), "shown": "set"},
+    "negotiation auto": {"types": ("physical",), "shown": "unset"},
+    "intf-type": {"value": "required", "types": ("physical",), "shown": "unset"},
+    "fec": {"value": "required", "types": ("physical",), "shown": "both", "reset": "default"},
+    "spanning-tree rstp edge-port": {"value": "optional", "types": ("physical", LAG_TYPE), "shown": "set"},
+    "spanning-tree pvst edge-port": {"value": "optional", "types": ("physical", LAG_TYPE), "shown": "set"},
+    "spanning-tree mstp edge-port": {"value": "optional", "types": ("physical", LAG_TYPE), "shown": "set"},
+    "port-channel-protocol LACP": {"types": ("physical",), "shown": "set"},
+    "shutdown": {"shown": "both"},
+}
+
+# Order of the lines of an interface in the running config. Lines loaded from a saved config that aren't
+# commands of INTF_COMMANDS are kept as they are, before shutdown.
+INTF_ORDER = ["description", "name", "ip address", "ipv6 address", "mtu", "channel-member", "portmode hybrid",
+              "switchport", "vlt-peer-lag", "lacp fast-switchover", "negotiation auto", "intf-type", "fec",
+              "spanning-tree rstp edge-port", "spanning-tree pvst edge-port", "spanning-tree mstp edge-port",
+              "port-channel-protocol LACP", "tagged", "untagged", "shutdown"]
+
+MTU_RANGE = (594, 12000)
+MAX_VLAN = 4094
+
+# Sub-ports of a fanout port mode
+FANOUT_SUBPORTS = {
+    "single": 1,
+    "dual": 2,
+    "quad": 4
+}
+
+# Interface type of the sub-ports, by the speed of "stack-unit ... portmode ... speed"
+FANOUT_SPEED_TYPES = {
+    "10G": "TenGigabitEthernet",
+    "25G": "twentyFiveGigE",
+    "40G": "fortyGigE",
+    "50G": "fiftyGigE"
+}
+
+# Speed of the sub-ports when "stack-unit ... portmode" has no speed
+DEFAULT_FANOUT_SPEEDS = {
+    "single": "40G",
+    "dual": "50G",
+    "quad": "10G"
+}
+
+# Parent port type of a fanout, by the speed of its sub-ports, when the parent isn't in the config
+FANOUT_PARENT_TYPES = {
+    "TenGigabitEthernet": "fortyGigE",
+    "fortyGigE": "fortyGigE",
+    "twentyFiveGigE": "hundredGigE",
+    "fiftyGigE": "hundredGigE"
+}
+
+ERROR_INPUT = "% Error: Invalid input at \"^\" marker."
+
+INTF_RE = re.compile(r"^(?P<type>[A-Za-z-]+?)\s*(?P<numbers>\d+(/\d+)*)$")
+
+
+class CLIError(Exception):
+    """
+    Raised by a command that the switch rejects, with the error the CLI prints
+    """
+
+
+class Intf(collections.namedtuple("Intf", ["type", "numbers"])):
+    """
+    Interface of the emulated switch, by its type (spelled like INTF_TYPES) and port numbers
+    """
+
+    __slots__ = ()
+
+    @property
+    def label(self):
+        return f"{self.type} {'/'.join(str(number) for number in self.numbers)}"
+
+    @property
+    def is_physical(self):
+        return self.type not in (LAG_TYPE, VLAN_TYPE, MGMT_TYPE)
+
+    @property
+    def subport(self):
+        return self.numbers[2] if self.is_physical and len(self.numbers) == 3 else 0
+
+    def order(self):
+        """
+        Sort key of the running config: physical ports by number, then the management port, port-channels and VLANs
+        """
+
+        if self.is_physical:
+            return 0, self.numbers, self.type
+        return [MGMT_TYPE, LAG_TYPE, VLAN_TYPE].index(self.type) + 1, self.numbers, self.type
+
+    def applies(self, types):
+        return types is None or self.type in types or (self.is_physical and "physical" in types)
+
+
+def intf_type(word):
+    """
+    Returns the interface type of a type word of the CLI (ex. "te", "tengigabitethernet", "Vlan")
+
+    :raises CLIError: if no type or more than one starts with the word
+    """
+
+    word = word.lower()
+    matches = [name for name in INTF_TYPES if name.lower() == word] or \
+        [name for name in INTF_TYPES if name.lower().startswith(word)]
+    if len(matches) != 1:
+        raise CLIError(ERROR_INPUT)
+
+    return matches[0]
+
+
+def make_intf(type_word, numbers):
+    """
+    Returns an interface from its type word and port numbers (ex. "1/49/1")
+
+    :raises CLIError: if the numbers don't fit the interface type
+    """
+
+    name = intf_type(type_word)
+    try:
+        numbers = tuple(int(number) for number in numbers.split("/"))
+    except ValueError:
+        raise CLIError(ERROR_INPUT)
+
+    if name in (LAG_TYPE, VLAN_TYPE):
+        valid = len(numbers) == 1 and numbers[0] >= 1
+    elif name == MGMT_TYPE:
+        valid = len(numbers) == 2
+    else:
+        valid = len(numbers) in (2, 3)
+    if not valid:
+        raise CLIError(ERROR_INPUT)
+
+    return Intf(name, numbers)
+
+
+def parse_intf(text):
+    """
+    Parses one interface as the CLI takes it (ex. "TenGigabitEthernet 1/1", "te1/1", "vlan 10")
+    """
+
+    match = INTF_RE.match(text.strip())
+    if match is None:
+        raise CLIError(ERROR_INPUT)
+
+    return make_intf(match.group("type"), match.group("numbers"))
+
+
+def expand_span(first, last):
+    """
+    Returns the interfaces from an interface to a port number, the last number is counted up
+    (ex. "1/1 - 4", "1/1 - 1/4" or "1/49/1 - 1/49/4")
+
+    :param first: First interface
+    :type first: Intf
+    :param last: Last port, in full or its last number
+    :type last: str
+    :rtype: list
+    """
+
+    try:
+        last_numbers = tuple(int(number) for number in last.strip().split("/"))
+    except ValueError:
+        raise CLIError(ERROR_INPUT)
+
+    if len(last_numbers) == 1:
+        last_numbers = first.numbers[:-1] + last_numbers
+    if last_numbers[:-1] != first.numbers[:-1] or last_numbers[-1] < first.numbers[-1]:
+        raise CLIError(ERROR_INPUT)
+
+    return [make_intf(first.type, "/".join(str(number) for number in first.numbers[:-1] + (port,)))
+            for port in range(first.numbers[-1], last_numbers[-1] + 1)]
+
+
+def parse_members(text):
+    """
+    Parses the members of a tagged, untagged or channel-member line, one interface type with a comma separated
+    list of ports and ranges (ex. "TenGigabitEthernet 1/1-1/4,1/6", "te 1/49/1-4", "Port-channel 1,2")
+
+    :rtype: list
+    """
+
+    text_parts = text.strip().split(None, 1)
+    if len(text_parts) != 2:
+        raise CLIError(ERROR_INPUT)
+
+    out = []
+    for item in text_parts[1].replace(" ", "").split(","):
+        first,_,last = item.partition("-")
+        first_intf = make_intf(text_parts[0], first)
+        out += expand_span(first_intf, last) if last else [first_intf]
+
+    return out
+
+
+def parse_targets(target):
+    """
+    Parses the interfaces of an "interface" command, one interface or a range
+    (ex. "Vlan 10", "range TenGigabitEthernet 1/1 - 4 , TenGigabitEthernet 1/6", "range vlan 10 - 20")
+
+    :rtype: list
+    """
+
+    if target.split(" ", 1)[0].lower() != "range":
+        return [parse_intf(target)]
+
+    out = []
+    for item in target.split(" ", 1)[1].split(","):
+        item_parts = item.strip().split(None, 1)
+        if len(item_parts) != 2:
+            raise CLIError(ERROR_INPUT)
+
+        first,_,last = item_parts[1].partition("-")
+        first_intf = parse_intf(f"{item_parts[0]} {first.strip()}")
+        out += expand_span(first_intf, last) if last.strip() else [first_intf]
+
+    return out
+
+
+def member_ranges(intfs):
+    """
+    Returns interfaces like OS9 lists VLAN and port-channel members: one line per interface type, with the
+    ports that follow each other as ranges (ex. "TenGigabitEthernet 1/1-1/4,1/6")
+    """
+
+    intf_types = collections.OrderedDict()  # interface type -> list of [first, last] runs
+    for intf in sorted(intfs, key=Intf.order):
+        runs = intf_types.setdefault(intf.type, [])
+        if runs and runs[-1][1].numbers[:-1] == intf.numbers[:-1] and runs[-1][1].numbers[-1] + 1 == intf.numbers[-1]:
+            runs[-1][1] = intf
+        else:
+            runs.append([intf, intf])
+
+    out = []
+    for name,runs in intf_types.items():
+        spans = [first.label.split(" ")[1] + (f"-{last.label.split(' ')[1]}" if last != first else "")
+                 for first,last in runs]
+        out.append(f"{name} {','.join(spans)}")
+
+    return out
+
+
+def match_command(command):
+    """
+    Returns the key of INTF_COMMANDS of an interface command (without "no") and its value
+
+    :raises CLIError: if it isn't an interface command
+    """
+
+    command_lower = command.lower()
+    for key in sorted(INTF_COMMANDS, key=len, reverse=True):
+        if command_lower == key.lower() or command_lower.startswith(key.lower() + " "):
+            return key, command[len(key):].strip()
+
+    raise CLIError(ERROR_INPUT)
+
+
+class OS9Switch(object):
+    """
+    State of an emulated switch: the running config, the startup config and the stats of the sessions.
+    Sessions share it, so every change is made with the lock held.
+
+    The interface commands follow INTF_COMMANDS, and the switch enforces the OS9 rules the deploy has to order its
+    commands around (ex. an interface needs "switchport" before it can join a VLAN, and can't leave Layer-2 mode
+    while it is in one).
+    """
+
+    def __init__(self, hostname, config_text, latency=None):
+        """
+        :param hostname: Hostname of the switch (replaced by the hostname line of the config if it has one)
+        :type hostname: str
+        :param config_text: Running config to start from (output of "show running-config")
+        :type config_text: str
+        :param latency: Seconds each "config", "show" and "save" command takes
+        :type latency: dict
+        """
+
+        self.hostname = hostname
+        self.latency = latency or {}
+        self.lock = threading.Lock()
+
+        self.globals = []  # list of [top level line, list of sub-lines]
+        # interface -> {"lines": command key -> line, "lacp": LACP sub-lines, "channel_members": set of interfaces,
+        #               "other": loaded lines that aren't in INTF_COMMANDS}
+        self.intfs = {}
+        self.members = {}  # VLAN -> {"tagged": set of member interfaces, "untagged": set of member interfaces}
+        self.parent_types = {}  # (unit, port) of fanned out ports -> interface type of the parent port
+        self.rate_limit = DEFAULT_RATE_LIMIT
+        self.connections = collections.deque()  # times of the connections of the last minute
+
+        self.stats = {"connections": 0, "rejected": 0, "commands": 0, "config_lines": 0, "errors": 0, "saves": 0}
+
+        self.load(config_text)
+        self.startup = self.render()
+
+    def load(self, config_text):
+        """
+        Replaces the running config with the output of "show running-config"
+        """
+
+        self.globals = []
+        self.intfs = {}
+        self.members = {}
+
+        cur_global = None
+        cur_intf = None
+        in_lacp = False
+        for line in config_text.split("\n"):
+            line = line.rstrip()
+            text = line.strip()
+            if not text or text.startswith("!") or text.startswith("Current Configuration") or text == "end":
+                cur_global = cur_intf = None
+                continue
+
+            if not line.startswith(" "):
+                cur_global = cur_intf = None
+                if text.startswith("interface "):
+                    cur_intf = parse_intf(text[len("interface "):])
+                    self.add_intf(cur_intf, lines={})
+                else:
+                    cur_global = [text, []]
+                    self.globals.append(cur_global)
+                continue
+
+            if cur_global is not None:
+                cur_global[1].append(line)
+            elif cur_intf is not None:
+                in_lacp = self.load_intf_line(cur_intf, line, in_lacp)
+
+        for line,_ in self.globals:
+            self.set_global(line)
+
+    def load_intf_line(self, intf, line, in_lacp):
+        """
+        Adds a line of an interface block of a saved config, without checking it like a command
+
+        :return: True if the line is port-channel-protocol LACP (its sub-lines follow)
+        :rtype: bool
+        """
+
+        intf_state = self.intfs[intf]
+        text = line.strip()
+        text_parts = text.split(" ", 1)
+
+        if line.startswith("  "):
+            if in_lacp:
+                intf_state["lacp"].append(text)
+            else:
+                intf_state["other"].append(line)
+            return in_lacp
+
+        if intf.type == VLAN_TYPE and text_parts[0] in ("tagged", "untagged"):
+            self.members[intf][text_parts[0]].update(parse_members(text_parts[1]))
+        elif intf.type == LAG_TYPE and text_parts[0] == "channel-member":
+            intf_state["channel_members"].update(parse_members(text_parts[1]))
+        else:
+            negated = text.startswith("no ")
+            try:
+                key,value = match_command(text[len("no "):] if negated else text)
+            except CLIError:
+                intf_state["other"].append(line)
+                return False
+            self.set_line(intf, key, value, negated)
+
+        return text == "port-channel-protocol LACP"
+
+    #
+    # Running config
+    #
+
+    def render(self):
+        """
+        Returns the running config like "show running-config"
+        """
+
+        out = ["Current Configuration ...", f"! Version {OS9_VERSION}", "!"]
+
+        for line,sub_lines in self.globals:
+            out.append(line)
+            out += sub_lines
+        out.append("!")
+
+        for intf in sorted(self.intfs, key=Intf.order):
+            intf_state = self.intfs[intf]
+            out.append(f"interface {intf.label}")
+
+            for key in INTF_ORDER:
+                if key in ("tagged", "untagged"):
+                    if intf.type == VLAN_TYPE:
+                        out += [f" {key} {members}" for members in member_ranges(self.members[intf][key])]
+                    continue
+                if key == "channel-member":
+                    out += [f" channel-member {members}" for members in member_ranges(intf_state["channel_members"])]
+                    continue
+
+                if key == "shutdown":
+                    out += intf_state["other"]
+                if key in intf_state["lines"]:
+                    out.append(f" {intf_state['lines'][key]}")
+                if key == "port-channel-protocol LACP":
+                    out += [f"  {line}" for line in intf_state["lacp"]]
+
+            out.append("!")
+
+        out.append("end")
+
+        return "\n".join(out)
+
+    def set_global(self, line):
+        """
+        Applies side effects of a top level line (hostname and SSH rate limit)
+        """
+
+        line_parts = line.split(" ")
+        if line_parts[0] == "hostname" and len(line_parts) == 2:
+            self.hostname = line_parts[1]
+        elif line.startswith("ip ssh connection-rate-limit ") and line_parts[-1].isdigit():
+            self.rate_limit = int(line_parts[-1])
+
+    def allow_connection(self):
+        """
+        Counts a new SSH connection, returns False if it goes over the connection rate limit of the last minute
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            while self.connections and now - self.connections[0] > 60:
+                self.connections.popleft()
+
+            if len(self.connections) >= self.rate_limit:
+                self.stats["rejected"] += 1
+                return False
+
+            self.connections.append(now)
+            self.stats["connections"] += 1
+            return True
+
+    #
+    # Interface state
+    #
+
+    def add_intf(self, intf, lines=None):
+        """
+        Adds an interface, with the factory lines unless lines are given
+        """
+
+        self.intfs[intf] = {"lines": dict(FACTORY_LINES if lines is None else lines), "lacp": [],
+                            "channel_members": set(), "other": []}
+        if intf.type == VLAN_TYPE:
+            self.members.setdefault(intf, {"tagged": set(), "untagged": set()})
+
+    def set_line(self, intf, key, value, negated):
+        """
+        Sets the line of an interface command, as INTF_COMMANDS says the running config shows it
+        """
+
+        spec = INTF_COMMANDS[key]
+        intf_state = self.intfs[intf]
+        line = f"{key} {value}" if value else key
+
+        if negated:
+            if spec["shown"] == "set":
+                intf_state["lines"].pop(key, None)
+            else:
+                intf_state["lines"][key] = spec.get("no_line", f"no {line}")
+        elif spec["shown"] == "unset" or (value and value == spec.get("reset")):
+            intf_state["lines"].pop(key, None)
+        else:
+            intf_state["lines"][key] = line
+
+        if key == "port-channel-protocol LACP" and key not in intf_state["lines"]:
+            # the LACP sub-commands go with it
+            intf_state["lacp"] = []
+
+    def is_l2(self, intf):
+        return "switchport" in self.intfs[intf]["lines"]
+
+    def is_l3(self, intf):
+        intf_lines = self.intfs[intf]["lines"]
+        return intf_lines.get("ip address", "no ip address") != "no ip address" or "ipv6 address" in intf_lines
+
+    def vlans_of(self, intf, vlan_mode=None):
+        """
+        Returns the VLANs an interface is a member of (tagged or untagged, or both if vlan_mode isn't given)
+        """
+
+        return [vlan for vlan,vlan_members in self.members.items()
+                if any(intf in vlan_members[mode] for mode in ([vlan_mode] if vlan_mode else ["tagged", "untagged"]))]
+
+    def lag_of(self, intf):
+        """
+        Returns the port-channel an interface is a member of, or None
+        """
+
+        for lag,intf_state in self.intfs.items():
+            if intf in intf_state["channel_members"]:
+                return lag
+
+        return None
+
+    def is_default(self, intf):
+        intf_state = self.intfs[intf]
+        return intf_state["lines"] == FACTORY_LINES and not intf_state["other"] and not self.vlans_of(intf) and \
+            self.lag_of(intf) is None
+
+    def drop_member(self, intf):
+        """
+        Removes an interface from every VLAN and port-channel
+        """
+
+        for vlan_members in self.members.values():
+            vlan_members["untagged"].discard(intf)
+            vlan_members["tagged"].discard(intf)
+        for intf_state in self.intfs.values():
+            intf_state["channel_members"].discard(intf)
+
+    #
+    # Config commands
+    #
+
+    def get_intf(self, text):
+        """
+        Returns an existing interface
+
+        :raises CLIError: if the interface doesn't exist
+        """
+
+        intf = parse_intf(text)
+        if intf not in self.intfs:
+            raise CLIError(f"% Error: No such interface {intf.label}.")
+
+        return intf
+
+    def enter_intfs(self, target):
+        """
+        Returns the interfaces of an "interface" command, creating VLANs and port-channels
+
+        :param target: Target of the command (ex. "Vlan 10", "range TenGigabitEthernet 1/1 - 4")
+        :type target: str
+        :return: List of interfaces
+        :rtype: list
+        """
+
+        out = parse_targets(target)
+        for intf in out:
+            if intf in self.intfs:
+                continue
+            if intf.type not in (VLAN_TYPE, LAG_TYPE):
+                raise CLIError(f"% Error: No such interface {intf.label}.")
+            if intf.type == VLAN_TYPE and intf.numbers[0] > MAX_VLAN:
+                raise CLIError(ERROR_INPUT)
+
+            self.add_intf(intf)
+
+        return out
+
+    def default_intf(self, text):
+        """
+        Applies "default interface", which puts a physical port back to its factory lines and removes it from its
+        VLANs and its port-channel
+        """
+
+        intf = self.get_intf(text)
+        if not intf.is_physical:
+            raise CLIError(ERROR_INPUT)
+
+        self.drop_member(intf)
+        self.add_intf(intf)
+
+    def delete_intf(self, text):
+        intf = self.get_intf(text)
+        if intf == Intf(VLAN_TYPE, (1,)):
+            raise CLIError("% Error: Default VLAN cannot be deleted.")
+        if intf.type not in (VLAN_TYPE, LAG_TYPE):
+            raise CLIError(ERROR_INPUT)
+
+        self.drop_member(intf)
+        self.members.pop(intf, None)
+        del self.intfs[intf]
+
+    def fanout(self, line_parts, remove):
+        """
+        Applies "[no] stack-unit U port P portmode TYPE [speed SPEED] [no-confirm]"
+        """
+
+        if line_parts[-1] == "no-confirm":
+            line_parts = line_parts[:-1]
+
+        if len(line_parts) not in (6, 8) or line_parts[2] != "port" or line_parts[4] != "portmode" \
+                or not line_parts[1].isdigit() or not line_parts[3].isdigit():
+            raise CLIError(ERROR_INPUT)
+
+        unit = int(line_parts[1])
+        port = int(line_parts[3])
+        portmode = line_parts[5]
+        prefix = " ".join(line_parts[:6])
+        subport_count = FANOUT_SUBPORTS.get(portmode)
+        if subport_count is None:
+            raise CLIError(ERROR_INPUT)
+
+        existing = [entry for entry in self.globals if entry[0] == prefix or entry[0].startswith(prefix + " ")]
+        subports = sorted((intf for intf in self.intfs if intf.subport and intf.numbers[:2] == (unit, port)),
+                          key=Intf.order)
+
+        if remove:
+            if not existing:
+                raise CLIError(f"% Error: Port {unit}/{port} is not in {portmode} mode.")
+            if not all(self.is_default(subport) for subport in subports):
+                raise CLIError("% Error: Port is not in default mode.")
+
+            parent_type = self.parent_types.pop((unit, port), None)
+            if parent_type is None:
+                parent_type = FANOUT_PARENT_TYPES.get(subports[0].type, "fortyGigE") if subports else "fortyGigE"
+
+            for subport in subports:
+                del self.intfs[subport]
+            self.add_intf(Intf(parent_type, (unit, port)))
+            self.globals = [entry for entry in self.globals if entry not in existing]
+            return
+
+        speed = line_parts[7] if len(line_parts) == 8 else DEFAULT_FANOUT_SPEEDS[portmode]
+        subport_type = FANOUT_SPEED_TYPES.get(speed)
+        if subport_type is None:
+            raise CLIError(ERROR_INPUT)
+
+        parents = [intf for intf in self.intfs if intf.is_physical and intf.numbers == (unit, port)]
+        if existing or not parents:
+            raise CLIError(f"% Error: Port {unit}/{port} is already in fanout mode.")
+        if not self.is_default(parents[0]):
+            raise CLIError("% Error: Port is not in default mode.")
+
+        self.parent_types[(unit, port)] = parents[0].type
+        del self.intfs[parents[0]]
+        for i in range(1, subport_count + 1):
+            self.add_intf(Intf(subport_type, (unit, port, i)))
+
+        stackunit_line = " ".join(line_parts)
+        stackunit_index = [i for i, entry in enumerate(self.globals) if entry[0].startswith("stack-unit ")]
+        self.globals.insert(stackunit_index[-1] + 1 if stackunit_index else 0, [stackunit_line, []])
+
+    def config_global(self, line):
+        """
+        Applies a top level config command
+        """
+
+        line_parts = line.split(" ")
+
+        if line.startswith("default interface "):
+            self.default_intf(line[len("default interface "):])
+        elif line.startswith("no interface "):
+            self.delete_intf(line[len("no interface "):])
+        elif line_parts[0] == "stack-unit":
+            self.fanout(line_parts, remove=False)
+        elif line.startswith("no stack-unit "):
+            self.fanout(line_parts[1:], remove=True)
+        elif line.startswith("no "):
+            self.globals = [entry for entry in self.globals
+                            if entry[0] != line[len("no "):] and not entry[0].startswith(line[len("no "):] + " ")]
+            if line == "no ip ssh connection-rate-limit":
+                self.rate_limit = DEFAULT_RATE_LIMIT
+        else:
+            # a line replaces the line that only differs by its value (ex. "hostname NEW")
+            line_key = " ".join(line_parts[:-1]) if len(line_parts) > 1 else line
+            for entry in self.globals:
+                if entry[0] == line or " ".join(entry[0].split(" ")[:-1]) == line_key:
+                    entry[0] = line
+                    break
+            else:
+                self.globals.append([line, []])
+
+            self.set_global(line)
+
+    def config_membership(self, vlan, vlan_mode, members, remove):
+        """
+        Applies "[no] tagged/untagged MEMBERS" under a VLAN
+        """
+
+        vlan_members = self.members[vlan]
+        other_mode = "tagged" if vlan_mode == "untagged" else "untagged"
+
+        for member in parse_members(members):
+            if not (member.is_physical or member.type == LAG_TYPE):
+                raise CLIError(ERROR_INPUT)
+
+            if remove:
+                vlan_members[vlan_mode].discard(member)
+                continue
+
+            if member not in self.intfs:
+                raise CLIError(f"% Error: No such interface {member.label}.")
+            if not self.is_l2(member):
+                raise CLIError(f"% Error: {member.label} is not in Layer-2 mode.")
+            if member in vlan_members[other_mode]:
+                raise CLIError(f"% Error: {member.label} is {other_mode} in this Vlan.")
+            if vlan_mode == "untagged" and any(other != vlan for other in self.vlans_of(member, "untagged")):
+                raise CLIError(f"% Error: {member.label} is untagged in another Vlan.")
+            if self.vlans_of(member, other_mode) and "portmode hybrid" not in self.intfs[member]["lines"]:
+                # a port is either tagged or untagged, unless it is in hybrid mode
+                raise CLIError(f"% Error: {member.label} is {other_mode} in another Vlan, it needs portmode hybrid.")
+
+            vlan_members[vlan_mode].add(member)
+
+    def config_channel_member(self, lag, members, remove):
+        """
+        Applies "[no] channel-member MEMBERS" under a port-channel
+        """
+
+        channel_members = self.intfs[lag]["channel_members"]
+
+        for member in parse_members(members):
+            if not member.is_physical:
+                raise CLIError(ERROR_INPUT)
+
+            if remove:
+                channel_members.discard(member)
+                continue
+
+            if member not in self.intfs:
+                raise CLIError(f"% Error: No such interface {member.label}.")
+            if self.is_l2(member):
+                raise CLIError(f"% Error: {member.label} is in Layer-2 mode.")
+            if self.is_l3(member):
+                raise CLIError(f"% Error: {member.label} is in Layer-3 mode.")
+            if self.lag_of(member) not in (None, lag):
+                raise CLIError(f"% Error: {member.label} is already part of a port-channel.")
+
+            channel_members.add(member)
+
+    def config_intf(self, intf, line):
+        """
+        Applies an interface config command to one interface
+
+        :return: True if the command enters the LACP mode of the interface
+        :rtype: bool
+        """
+
+        negated = line.startswith("no ")
+        command = line[len("no "):] if negated else line
+        command_parts = command.split(" ", 1)
+
+        if intf.type == VLAN_TYPE and command_parts[0].lower() in ("tagged", "untagged") and len(command_parts) == 2:
+            self.config_membership(intf, command_parts[0].lower(), command_parts[1], negated)
+            return False
+        if intf.type == LAG_TYPE and command_parts[0].lower() == "channel-member" and len(command_parts) == 2:
+            self.config_channel_member(intf, command_parts[1], negated)
+            return False
+
+        key,value = match_command(command)
+        spec = INTF_COMMANDS[key]
+        if not intf.applies(spec.get("types")):
+            raise CLIError(ERROR_INPUT)
+        if (value and "value" not in spec) or (not value and spec.get("value") == "required" and not negated):
+            raise CLIError(ERROR_INPUT)
+        if key == "mtu" and not negated and not (value.isdigit() and MTU_RANGE[0] <= int(value) <= MTU_RANGE[1]):
+            raise CLIError(ERROR_INPUT)
+
+        if key in ("ip address", "ipv6 address") and not negated:
+            if self.is_l2(intf):
+                raise CLIError("% Error: Port is in Layer-2 mode.")
+            if self.lag_of(intf) is not None:
+                raise CLIError("% Error: Port is part of a port-channel.")
+        if key == "switchport" and not negated:
+            if self.is_l3(intf):
+                raise CLIError("% Error: Port is in Layer-3 mode.")
+            if self.lag_of(intf) is not None:
+                raise CLIError("% Error: Port is part of a port-channel.")
+        if key == "switchport" and negated and self.vlans_of(intf):
+            raise CLIError("% Error: Port is a member of a Vlan.")
+        if key == "portmode hybrid" and self.is_l2(intf):
+            raise CLIError("% Error: Port is in Layer-2 mode.")
+
+        self.set_line(intf, key, value, negated)
+
+        return key == "port-channel-protocol LACP" and not negated
+
+    def config_lacp(self, intf, line):
+        """
+        Applies "[no] port-channel N mode active/passive" under port-channel-protocol LACP
+        """
+
+        negated = line.startswith("no ")
+        line_parts = line.split(" ")[1:] if negated else line.split(" ")
+        if len(line_parts) < 2 or not line_parts[1].isdigit() or \
+                (not negated and (len(line_parts) != 4 or line_parts[2:3] != ["mode"]
+                                  or line_parts[3] not in ("active", "passive"))):
+            raise CLIError(ERROR_INPUT)
+
+        lacp_lines = self.intfs[intf]["lacp"]
+        # one port-channel per port, a new one replaces it
+        lacp_lines[:] = [] if not negated else [lacp_line for lacp_line in lacp_lines
+                                               if lacp_line.split(" ")[:2] != line_parts[:2]]
+        if not negated:
+            lacp_lines.append(" ".join(line_parts))
+
+    def save(self):
+        self.startup = self.render()
+        self.stats["saves"] += 1
+
+    def version(self):
+        return "\n".join([
+            "Dell Real Time Operating System Software",
+            "Dell Operating System Version: 2.0",
+            f"Dell Application Software Version: {OS9_VERSION}",
+            "Copyright (c) 1999-2019 by Dell Inc. All Rights Reserved.",
+            "Dell Networking OS uptime is 0 day(s), 0 hour(s), 0 minute(s)",
+            "",
+            "System image file is \"system://A\"",
+            "",
+            "System Type: S4048-ON",
+        ])
+
+
+
+class OS9Session(object):
+    """
+    One CLI session on an emulated switch: the mode the session is in, and the commands it runs
+    """
+
+    def __init__(self, switch):
+        self.switch = switch
+        self.mode = "exec"  # exec, config, interface or lacp
+        self.intfs = []  # interfaces of the interface and lacp modes
+        self.confirm = None  # command waiting for a yes/no answer
+        self.closed = False
+
+    def prompt(self):
+        if self.confirm is not None:
+            return "Proceed to copy the file [confirm yes/no]: "
+
+        if self.mode == "exec":
+            return f"{self.switch.hostname}#"
+        if self.mode == "config":
+            return f"{self.switch.hostname}(conf)#"
+
+        if len(self.intfs) == 1:
+            intf = self.intfs[0]
+            intf_mode = f"conf-if-{intf.type[:2].lower()}-{'/'.join(str(number) for number in intf.numbers)}"
+        else:
+            intf_mode = "conf-if-range"
+        if self.mode == "lacp":
+            intf_mode += "-lacp"
+
+        return f"{self.switch.hostname}({intf_mode})#"
+
+    def execute(self, line):
+        """
+        Runs one command line
+
+        :param line: Command, as typed
+        :type line: str
+        :return: Output of the command (without the prompt)
+        :rtype: str
+        """
+
+        line = " ".join(line.split())
+        if self.confirm is not None:
+            command, self.confirm = self.confirm, None
+            if line.lower() in ("yes", "y"):
+                time.sleep(self.switch.latency.get("save", 0))
+                with self.switch.lock:
+                    self.switch.save()
+                return "!\n" + f"{len(self.switch.startup)} bytes successfully copied"
+            return ""
+
+        if line == "" or line.startswith("!"):
+            return ""
+
+        with self.switch.lock:
+            self.switch.stats["commands"] += 1
+
+        try:
+            return self.dispatch(line)
+        except CLIError as e:
+            with self.switch.lock:
+                self.switch.stats["errors"] += 1
+            return str(e)
+
+    def dispatch(self, line):
+        if line == "end":
+            self.mode = "exec"
+            return ""
+
+        if line in ("exit", "quit"):
+            if self.mode == "lacp":
+                self.mode = "interface"
+            elif self.mode == "interface":
+                self.mode = "config"
+            elif self.mode == "config":
+                self.mode = "exec"
+            else:
+                self.closed = True
+            return ""
+
+        if line.startswith("do ") and self.mode != "exec":
+            return self.exec_command(line[len("do "):])
+
+        if self.mode == "exec":
+            return self.exec_command(line)
+
+        time.sleep(self.switch.latency.get("config", 0))
+        with self.switch.lock:
+            self.switch.stats["config_lines"] += 1
+            return self.config_command(line)
+
+    def exec_command(self, line):
+        if line in ("configure", "configure terminal", "conf", "conf t"):
+            self.mode = "config"
+            return ""
+
+        if line.startswith("terminal ") or line == "enable":
+            return ""
+
+        if line == "write memory" or line == "write":
+            time.sleep(self.switch.latency.get("save", 0))
+            with self.switch.lock:
+                self.switch.save()
+            return "!"
+
+        if line == "copy running-config startup-config":
+            self.confirm = line
+            return "File with same name already exist."
+
+        if line in ("logout", "exit"):
+            self.closed = True
+            return ""
+
+        command,_,grep = line.partition(" | grep ")
+        if command in ("show running-config", "show running-config | no-more", "show version"):
+            time.sleep(self.switch.latency.get("show", 0))
+            with self.switch.lock:
+                out = self.switch.version() if command == "show version" else self.switch.render()
+
+            if grep:
+                pattern = re.compile(grep.strip("\"'"))
+                out = "\n".join(out_line for out_line in out.split("\n") if pattern.search(out_line))
+            return out
+
+        raise CLIError(ERROR_INPUT)
+
+    def config_command(self, line):
+        if self.mode == "lacp":
+            if line.startswith(("port-channel ", "no port-channel ")):
+                for intf in self.intfs:
+                    self.switch.config_lacp(intf, line)
+                return ""
+
+            # OS9 runs a command of a parent mode from the sub-mode, and stays in the parent mode
+            self.mode = "interface"
+
+        if self.mode == "interface":
+            if not line.startswith(("interface ", "default interface ", "no interface ", "stack-unit ",
+                                    "no stack-unit ", "hostname ", "ip ssh ", "no ip ssh ")):
+                enters_lacp = False
+                for intf in self.intfs:
+                    enters_lacp = self.switch.config_intf(intf, line)
+                if enters_lacp:
+                    self.mode = "lacp"
+                return ""
+
+            self.mode = "config"
+
+        if line.startswith("interface "):
+            self.intfs = self.switch.enter_intfs(line[len("interface "):])
+            self.mode = "interface"
+            return ""
+
+        self.switch.config_global(line)
+        return ""
+
+
+#
+# SSH
+#
+
+class SSHServer(paramiko.ServerInterface if HAS_PARAMIKO else object):
+    """
+    Accepts password logins (any password, unless --user and --password are given) and one shell channel
+    """
+
+    def __init__(self, user=None, password=None):
+        self.user = user
+        self.password = password
+        self.shell_requested = threading.Event()
+
+    def check_auth_password(self, username, password):
+        if self.user is None or (username == self.user and password == self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+
+def serve_channel(channel, session):
+    """
+    Runs the CLI on an SSH channel: echoes what is typed and answers each line with its output and the prompt
+    """
+
+    def send(text):
+        channel.sendall(text.replace("\n", "\r\n").encode())
+
+    send(f"\n{session.prompt()}")
+
+    buffer = ""
+    last_char = ""
+    while not session.closed:
+        data = channel.recv(4096)
+        if not data:
+            break
+
+        for char in data.decode(errors="replace"):
+            if char == "\n" and last_char == "\r":
+                last_char = char
+                continue
+            last_char = char
+
+            if char in "\r\n":
+                output = session.execute(buffer)
+                buffer = ""
+                send("\n" + (output + "\n" if output else "") + ("" if session.closed else session.prompt()))
+            elif char in "\x08\x7f":
+                buffer = buffer[:-1]
+            else:
+                buffer += char
+                send(char)
+
+    channel.close()
+
+
+def serve_connection(sock, switch, host_key, user, password):
+    if not switch.allow_connection():
+        # over the connection rate limit, OS9 drops the connection
+        sock.close()
+        return
+
+    transport = paramiko.Transport(sock)
+    transport.add_server_key(host_key)
+    server = SSHServer(user, password)
+
+    try:
+        transport.start_server(server=server)
+        channel = transport.accept(30)
+        if channel is None or not server.shell_requested.wait(30):
+            return
+
+        serve_channel(channel, OS9Session(switch))
+    except (paramiko.SSHException, EOFError, OSError):
+        pass
+    finally:
+        transport.close()
+
+
+def serve_switch(listen, port, switch, host_key, user, password):
+    """
+    Accepts SSH connections for one switch, each served in its own thread
+    """
+
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_sock.bind((listen, port))
+    server_sock.listen(64)
+
+    while True:
+        sock,_ = server_sock.accept()
+        threading.Thread(target=serve_connection, args=(sock, switch, host_key, user, password), daemon=True).start()
+
+
+def serve_stdio(switch):
+    """
+    Runs the CLI of one switch on stdin/stdout
+    """
+
+    session = OS9Session(switch)
+    sys.stdout.write(session.prompt())
+    sys.stdout.flush()
+
+    for line in sys.stdin:
+        output = session.execute(line.rstrip("\r\n"))
+        if output:
+            sys.stdout.write("\n" + output)
+        if session.closed:
+            break
+        sys.stdout.write("\n" + session.prompt())
+        sys.stdout.flush()
+
+    sys.stdout.write("\n")
+
+
+#
+# Main
+#
+
+def find_config(configs_dir, host):
+    """
+    Finds the saved running config of a host
+
+    :return: Path of the config file or None
+    :rtype: str
+    """
+
+    for extension in CONFIG_EXTENSIONS:
+        path = os.path.join(configs_dir, host + extension)
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def load_groups(path):
+    """
+    Reads the groups of each host of an inventory, with the inventory parser of ansible
+
+    :return: Dict of hostname -> list of groups (without "all")
+    :rtype: dict
+    """
+
+    inventory = InventoryManager(loader=DataLoader(), sources=[path])
+
+    return {host.name: [group.name for group in sort_groups(host.get_groups()) if group.name != "all"]
+            for host in inventory.get_hosts()}
+
+
+def scenario_config(name, seed):
+    """
+    Generates the running config of a benchmark scenario
+    """
+
+    # imported here, only this needs the benchmark generator and the filter plugin it uses
+    from os9_bench import SCENARIOS, generate
+
+    if name not in SCENARIOS:
+        sys.exit(f"Unknown scenario {name} (choose from {', '.join(sorted(SCENARIOS))})")
+
+    return generate(SCENARIOS[name], seed=seed)[0]
+
+
+def write_inventory(path, hosts, inventory, listen, base_port):
+    """
+    Writes an inventory with the emulated hosts in their groups of the real inventory
+    """
+
+    groups = collections.OrderedDict()
+    for i, host in enumerate(hosts):
+        for group in inventory.get(host) or ["ungrouped"]:
+            groups.setdefault(group, []).append(f"{host} ansible_host={listen} ansible_port={base_port + i} "
+                                                f"ansible_network_os=dellemc.os9.os9")
+
+    with open(path, "w") as f:
+        for group, host_lines in groups.items():
+            f.write(f"[{group}]\n")
+            for host_line in host_lines:
+                f.write(host_line + "\n")
+            f.write("\n")
+
+
+def print_stats(switches, json_path=None):
+    out = {host: switch.stats for host, switch in switches.items()}
+
+    print(f"{'HOST':<24} {'CONNS':>6} {'REJECTED':>9} {'COMMANDS':>9} {'CONFIG':>8} {'ERRORS':>7} {'SAVES':>6}",
+          file=sys.stderr)
+    for host, stats in out.items():
+        print(f"{host:<24} {stats['connections']:>6} {stats['rejected']:>9} {stats['commands']:>9} "
+              f"{stats['config_lines']:>8} {stats['errors']:>7} {stats['saves']:>6}", file=sys.stderr)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(out, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate OS9 switches over SSH for offline push tests")
+    parser.add_argument("--host", action="append", help="Host to emulate (can be repeated, default: every host with "
+                                                        "a config in --configs, or os9-emu-1 with --scenario)")
+    parser.add_argument("--count", type=int, default=1, help="Number of hosts to emulate from --scenario "
+                                                            "(default: 1, named os9-emu-N)")
+    parser.add_argument("--configs", help="Directory of saved running configs to start from (HOST, HOST.txt or "
+                                          "HOST.cfg)")
+    parser.add_argument("--scenario", default="tor-48", help="Benchmark scenario of helpers/os9_bench.py to start "
+                                                              "from when there is no saved config (default: tor-48)")
+    parser.add_argument("--inventory", default=os.path.join(REPO_DIR, "hosts"), help="Inventory file, for the "
+                                                                                    "groups of the hosts")
+    parser.add_argument("--inventory-out", help="Write an inventory of the emulated hosts to this file")
+    parser.add_argument("--listen", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--base-port", type=int, default=2201, help="SSH port of the first host (default: 2201)")
+    parser.add_argument("--user", help="Only accept this user (default: any user and password)")
+    parser.add_argument("--password", help="Password of --user")
+    parser.add_argument("--host-key", help="SSH host key file (default: a new RSA key)")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds each config command takes (default: 0)")
+    parser.add_argument("--show-latency", type=float, default=0, help="Seconds each show command takes (default: 0)")
+    parser.add_argument("--save-latency", type=float, default=0, help="Seconds saving the config takes (default: 0)")
+    parser.add_argument("--stats-json", help="Write the stats of each host to this file on exit")
+    parser.add_argument("--stdio", action="store_true", help="Run the CLI of one host on stdin/stdout")
+    args = parser.parse_args()
+
+    if not args.stdio and not HAS_PARAMIKO:
+        sys.exit("paramiko is required to serve SSH (pip install paramiko), or use --stdio")
+
+    inventory = load_groups(args.inventory) if os.path.isfile(args.inventory) else {}
+
+    if args.host:
+        hosts = args.host
+    elif args.configs:
+        hosts = [host for host in inventory if find_config(args.configs, host)]
+    else:
+        hosts = [f"os9-emu-{i}" for i in range(1, args.count + 1)]
+
+    if not hosts:
+        sys.exit("No hosts to emulate")
+
+    latency = {"config": args.latency, "show": args.show_latency, "save": args.save_latency}
+    switches = collections.OrderedDict()
+    for i, host in enumerate(hosts):
+        config_path = find_config(args.configs, host) if args.configs else None
+        if config_path is not None:
+            with open(config_path) as f:
+                config_text = f.read()
+        else:
+            config_text = scenario_config(args.scenario, i)
+
+        switches[host] = OS9Switch(host, config_text, latency)
+        if config_path is None:
+            # generated configs all have the same hostname
+            switches[host].config_global(f"hostname {host}")
+
+    if args.stdio:
+        serve_stdio(switches[hosts[0]])
+        return
+
+    if args.host_key:
+        host_key = paramiko.RSAKey(filename=args.host_key)
+    else:
+        host_key = paramiko.RSAKey.generate(2048)
+
+    for i, (host, switch) in enumerate(switches.items()):
+        threading.Thread(target=serve_switch, args=(args.listen, args.base_port + i, switch, host_key, args.user,
+                                                    args.password), daemon=True).start()
+        print(f"{host}: ssh -p {args.base_port + i} {args.listen}", file=sys.stderr)
+
+    if args.inventory_out:
+        write_inventory(args.inventory_out, hosts, inventory, args.listen, args.base_port)
+        print(f"Inventory written to {args.inventory_out}", file=sys.stderr)
+
+    # stop on Ctrl-C or SIGTERM, and print the stats either way
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print_stats(switches, args.stats_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Manifest compiler for OS9 switches
+
+Loads the variables of each host like ansible does (all < group < host), validates the interface and vlan
+manifests against the schema of the OS9 filter plugin, and caches the compiled manifest in
+~/.cache/ansible-switches/manifests (or $OS9_MANIFEST_CACHE_DIR). The cache is keyed by the hash of every vars
+file of the host and of the code that compiles them, so an unchanged manifest is loaded from one pickle instead
+of parsing the YAML and normalizing it again. Only the helpers use the cache: the deploy playbook still has
+ansible load the vars files of every host.
+
+Usage:
+    helpers/os9_manifest.py [--host HOST ...] [--inventory FILE] [--no-cache]
+
+Every problem is listed and the exit status is 1 if a manifest is invalid. The deploy playbook runs this before
+any switch is contacted.
+"""
+
+import argparse
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+
+import yaml
+from ansible.inventory.helpers import sort_groups
+from ansible.inventory.manager import InventoryManager
+from ansible.parsing.dataloader import DataLoader
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CACHE_DIR = os.environ.get("OS9_MANIFEST_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "ansible-switches", "manifests"))
+
+sys.path.insert(0, os.path.join(REPO_DIR, "filter_plugins"))
+import dell_os9  # noqa: E402
+
+
+class ManifestError(Exception):
+    """
+    Raised when the manifest of a host doesn't match the schema
+    """
+
+    def __init__(self, host, errors):
+        # the args are kept as they are so the error can be pickled back from a pool worker
+        super().__init__(host, errors)
+        self.host = host
+        self.errors = errors
+
+    def __str__(self):
+        return f"Invalid manifest for {self.host}:\n" + "\n".join(f"  {error}" for error in self.errors)
+
+
+def load_inventory(path):
+    """
+    Reads the hosts of an inventory with the inventory parser of ansible, so [group:children] sections, YAML
+    inventories and inventory plugins give each host the same groups as in the deploy
+
+    :param path: Path of the inventory
+    :type path: str
+    :return: Dict of hostname -> dict with "groups" (list, without "all", in the order ansible loads their
+             group_vars) and "vars" (dict, the vars set in the inventory itself)
+    :rtype: dict
+    """
+
+    inventory = InventoryManager(loader=DataLoader(), sources=[path])
+
+    hosts = {}
+    for host in inventory.get_hosts():
+        hosts[host.name] = {
+            "groups": [group.name for group in sort_groups(host.get_groups()) if group.name != "all"],
+            "vars": dict(host.vars)
+        }
+
+    return hosts
+
+
+def vars_files(path):
+    """
+    Lists a vars file, or every YAML file in a vars directory
+
+    :param path: Path without extension (ex. "group_vars/all")
+    :type path: str
+    :return: Paths of the YAML files, in the order they are loaded
+    :rtype: list
+    """
+
+    if os.path.isdir(path):
+        return [os.path.join(path, file_name) for file_name in sorted(os.listdir(path))
+                if file_name.endswith((".yaml", ".yml"))]
+
+    return [path + extension for extension in [".yaml", ".yml"] if os.path.isfile(path + extension)]
+
+
+def host_vars_files(repo_dir, host, groups):
+    """
+    Lists the vars files of a host with the same precedence as ansible (all < group < host)
+
+    :return: Paths of the YAML files, in the order they are loaded
+    :rtype: list
+    """
+
+    paths = vars_files(os.path.join(repo_dir, "group_vars", "all"))
+    for group in groups:
+        paths += vars_files(os.path.join(repo_dir, "group_vars", group))
+    paths += vars_files(os.path.join(repo_dir, "host_vars", host))
+
+    return paths
+
+
+def load_vars_file(path):
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+@functools.lru_cache(maxsize=None)
+def compiler_hash():
+    """
+    Hashes the source of the code that compiles a manifest: this module and the module of the OS9 filters (the
+    schema, OS9_VALIDATEMANIFEST, OS9_PRUNEVLANS, OS9_COMPILEMANIFEST and what they call). A cache entry of
+    another version of either is never used.
+
+    :return: sha256 digest
+    :rtype: bytes
+    """
+
+    digest = hashlib.sha256()
+    for module in [sys.modules[__name__], inspect.getmodule(dell_os9.OS9_COMPILEMANIFEST)]:
+        digest.update(inspect.getsource(module).encode())
+
+    return digest.digest()
+
+
+def files_hash(paths):
+    """
+    Hashes the names and contents of files, along with the code that compiles them (see compiler_hash)
+
+    :return: sha256 hex digest
+    :rtype: str
+    """
+
+    digest = hashlib.sha256(compiler_hash())
+
+    for path in paths:
+        digest.update(os.path.basename(path).encode() + b"\0")
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+
+    return digest.hexdigest()
+
+
+def compile_host(repo_dir, host, groups, use_cache=True, loaded=None):
+    """
+    Loads, validates and compiles the manifest of a host, from the cache if its vars files haven't changed
+
+    :param repo_dir: Path of the ansible site
+    :type repo_dir: str
+    :param host: Inventory hostname
+    :type host: str
+    :param groups: Groups of the host
+    :type groups: list
+    :param use_cache: If false, the manifest is always compiled again (the cache is still updated)
+    :type use_cache: bool
+    :param loaded: Vars files already loaded (path -> vars), shared between the hosts compiled in a row so a file
+                   like group_vars/all with the VLAN manifest is only parsed once. Files loaded here are added.
+    :type loaded: dict
+    :return: Dict with "interfaces", "vlans" (pruned if the host has prune_vlans) and "compiled" (output of
+             OS9_COMPILEMANIFEST)
+    :rtype: dict
+    """
+
+    paths = host_vars_files(repo_dir, host, groups)
+    cache_path = os.path.join(CACHE_DIR, files_hash(paths) + ".pickle")
+
+    if use_cache:
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+    if loaded is None:
+        loaded = {}
+
+    host_vars = {}
+    for path in paths:
+        if path not in loaded:
+            loaded[path] = load_vars_file(path)
+        host_vars.update(loaded[path])
+
+    interfaces = host_vars.get("interfaces", {})
+    vlans = host_vars.get("vlans", {})
+
+    errors = dell_os9.OS9_VALIDATEMANIFEST(interfaces, vlans)
+    if errors:
+        raise ManifestError(host, errors)
+
+    if host_vars.get("prune_vlans"):
+        # same as the deploy playbook
+        vlans = dell_os9.OS9_PRUNEVLANS(vlans, interfaces, host_vars.get("pinned_vlans", []))
+
+    out = {
+        "interfaces": interfaces,
+        "vlans": vlans,
+        "compiled": dell_os9.OS9_COMPILEMANIFEST(interfaces, vlans)
+    }
+
+    # written to a temporary file first, so a concurrent run never loads a partial pickle
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix=".manifest-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(out, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and compile the OS9 switch manifests")
+    parser.add_argument("--host", action="append", help="Host to check (can be repeated, default: every host)")
+    parser.add_argument("--inventory", default=os.path.join(REPO_DIR, "hosts"), help="Inventory file")
+    parser.add_argument("--no-cache", action="store_true", help="Compile every manifest again")
+    args = parser.parse_args()
+
+    inventory = load_inventory(args.inventory)
+    host_list = args.host or list(inventory)
+
+    failed = 0
+    loaded = {}
+    for host in host_list:
+        try:
+            compile_host(REPO_DIR, host, inventory.get(host, {}).get("groups", []), not args.no_cache, loaded)
+        except ManifestError as e:
+            print(e, file=sys.stderr)
+            failed += 1
+
+    if failed:
+        sys.exit(f"{failed} of {len(host_list)} manifests are invalid")
+
+    print(f"{len(host_list)} manifests are valid")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Offline planner for OS9 switches
+
+Runs the OS9 filters against saved "show running-config" output, without Ansible or access to the switches,
+and prints the commands a deploy would push.
+
+Usage:
+    helpers/os9_plan.py [--configs DIR] [--snapshot-ttl SECONDS] [--host HOST ...] [--format text|json] [--jobs N]
+
+The configs directory holds one file per switch, named after the inventory hostname (HOST, HOST.txt or HOST.cfg).
+With --snapshot-ttl, the running config snapshots saved by the deploy playbook are used when they are fresh,
+and the configs directory is only needed for hosts without one.
+Hosts are planned in parallel in a process pool (--jobs, default: one per core).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, os.path.join(REPO_DIR, "filter_plugins"))
+import dell_os9  # noqa: E402
+from os9_manifest import ManifestError, compile_host, load_inventory  # noqa: E402
+
+CONFIG_EXTENSIONS = ["", ".txt", ".cfg"]
+
+# Compiled manifests of the hosts to plan, compiled once in the main process and shared with the pool workers
+manifests = {}
+
+
+def find_config(configs_dir, host):
+    """
+    Finds the saved running config of a host
+
+    :return: Path of the config file or None
+    :rtype: str
+    """
+
+    for extension in CONFIG_EXTENSIONS:
+        path = os.path.join(configs_dir, host + extension)
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def load_config(host, config_path, snapshot_ttl=0, snapshot_dir=None):
+    """
+    Reads the running config of a host, from a fresh snapshot if there is one or else from its saved config
+
+    :return: Tuple of (config text, source of the config)
+    :rtype: tuple
+    """
+
+    config_text = dell_os9.OS9SnapshotStore(snapshot_dir).get(host, snapshot_ttl)
+    if config_text is not None:
+        return config_text, "snapshot"
+
+    if config_path is None:
+        raise FileNotFoundError(f"The snapshot of {host} expired and there is no saved config")
+
+    with open(config_path) as f:
+        return f.read(), config_path
+
+
+def plan_host(config_text, interfaces, vlans, compiled=None, hostname=None):
+    """
+    Plans what os9_reconcile would push, against a saved config
+
+    :param config_text: Output of "show running-config"
+    :type config_text: str
+    :param interfaces: Interface manifest of the host
+    :type interfaces: dict
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param compiled: Compiled manifest (see helpers/os9_manifest.py)
+    :type compiled: dict
+    :param hostname: Inventory hostname, for the hostname global line and to name profiles
+    :type hostname: str
+    :return: Dict of "global", "fanout", "config" and "clean" commands, and "predicted" (see
+             dell_os9.os9_reconcileplan)
+    :rtype: dict
+    """
+
+    sw_config = {"ansible_facts": {"ansible_net_config": config_text}}
+    if hostname is not None:
+        sw_config["ansible_facts"]["ansible_net_hostname"] = hostname
+
+    global_lines = [line.format(hostname=hostname) for line in dell_os9.os9_global_lines
+                    if hostname is not None or "{hostname}" not in line]
+
+    return dell_os9.os9_reconcileplan(sw_config, interfaces, vlans, global_lines, compiled)
+
+
+def init_worker(host_manifests):
+    """
+    Pool initializer, so the compiled manifests are handed to each worker once instead of with every host
+    """
+
+    manifests.clear()
+    manifests.update(host_manifests)
+
+
+def plan_job(host, config_path, snapshot_ttl=0, snapshot_dir=None):
+    """
+    Loads the config of a host and plans it against its compiled manifest
+
+    :return: Tuple of (host, plan), where the plan also has the config "source" and the time it took in "seconds"
+    :rtype: tuple
+    """
+
+    start = time.perf_counter()
+
+    manifest = manifests[host]
+    config_text, source = load_config(host, config_path, snapshot_ttl, snapshot_dir)
+
+    plan = plan_host(config_text, manifest["interfaces"], manifest["vlans"], manifest["compiled"], host)
+    plan["source"] = source
+    plan["seconds"] = time.perf_counter() - start
+
+    return host, plan
+
+
+def plan_fleet(host_jobs, host_manifests, jobs):
+    """
+    Plans many hosts, in a process pool when there is more than one job
+
+    :param host_jobs: List of (host, config path, snapshot ttl, snapshot directory)
+    :type host_jobs: list
+    :param host_manifests: Dict of host -> compiled manifest (see compile_host in helpers/os9_manifest.py)
+    :type host_manifests: dict
+    :param jobs: Number of worker processes
+    :type jobs: int
+    :return: Dict of host -> plan, in the same order as host_jobs
+    :rtype: dict
+    """
+
+    if jobs <= 1 or len(host_jobs) <= 1:
+        init_worker(host_manifests)
+        return dict(plan_job(*host_job) for host_job in host_jobs)
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(host_jobs)), initializer=init_worker,
+                             initargs=(host_manifests,)) as pool:
+        # map keeps the order of the hosts, no matter which finishes first
+        results = pool.map(plan_job, *zip(*host_jobs))
+        return dict(results)
+
+
+def print_plan(host, plan):
+    print(f"### {host} ({plan['source']}, {plan['seconds'] * 1000:.1f} ms)")
+
+    if plan["global"]:
+        print("# global")
+        for line in plan["global"]:
+            print(line)
+
+    if plan["predicted"] is False:
+        print("# WARNING: the config after the fanout change can't be predicted, the manifest is planned against "
+              "the config before it (the deploy gathers it again after the fanout)")
+
+    if plan["fanout"]:
+        print("# fanout")
+        for line in plan["fanout"]:
+            print(line)
+
+    if plan["config"]:
+        print("# manifest")
+        for block in plan["config"]:
+            print(block[0])
+            for line in block[1:]:
+                print(f" {line}")
+            print("!")
+
+    if plan["clean"]:
+        print("# clean")
+        for line in plan["clean"]:
+            print(line)
+
+    if not plan["global"] and not plan["fanout"] and not plan["config"] and not plan["clean"]:
+        print("# no changes")
+
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the commands a deploy would push, from saved running configs")
+    parser.add_argument("--configs", help="Directory of saved running configs (HOST, HOST.txt or HOST.cfg)")
+    parser.add_argument("--snapshot-ttl", type=float, default=0,
+                        help="Use running config snapshots younger than this many seconds (default: 0, disabled)")
+    parser.add_argument("--snapshots", help="Snapshot directory (default: $OS9_SNAPSHOT_DIR or "
+                                            "~/.cache/ansible-switches/snapshots)")
+    parser.add_argument("--host", action="append", help="Host to plan (can be repeated, default: every host with a config)")
+    parser.add_argument("--inventory", default=os.path.join(REPO_DIR, "hosts"), help="Inventory file")
+    parser.add_argument("--format", choices=["text", "json"], default="text", help="Output format (default: text)")
+    parser.add_argument("--profile", metavar="DIR", help="Write a profile of the filters per host to DIR/HOST.json")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of hosts to plan in parallel (default: number of cores)")
+    args = parser.parse_args()
+
+    if args.configs is None and args.snapshot_ttl <= 0:
+        parser.error("--configs is required unless snapshots are used (--snapshot-ttl)")
+
+    if args.profile:
+        # read by the filters, in this process and the pool workers
+        os.environ["OS9_PROFILE_DIR"] = args.profile
+
+    inventory = load_inventory(args.inventory)
+    snapshots = dell_os9.OS9SnapshotStore(args.snapshots)
+
+    def has_snapshot(host):
+        return snapshots.get(host, args.snapshot_ttl) is not None
+
+    def host_config(host):
+        return find_config(args.configs, host) if args.configs else None
+
+    if args.host:
+        host_list = args.host
+    else:
+        host_list = [host for host in inventory if has_snapshot(host) or host_config(host)]
+
+    host_jobs = []
+    for host in host_list:
+        config_path = host_config(host)
+        if config_path is None and not has_snapshot(host):
+            sys.exit(f"No saved config or fresh snapshot for {host}")
+
+        host_jobs.append((host, config_path, args.snapshot_ttl, args.snapshots))
+
+    start = time.perf_counter()
+
+    # compiled here rather than in the workers, so the files shared by every host are parsed once
+    host_manifests = {}
+    loaded = {}
+    try:
+        for host in host_list:
+            host_manifests[host] = compile_host(REPO_DIR, host, inventory.get(host, {}).get("groups", []),
+                                                loaded=loaded)
+    except ManifestError as e:
+        sys.exit(str(e))
+
+    plans = plan_fleet(host_jobs, host_manifests, args.jobs)
+    print(f"Planned {len(plans)} hosts in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+    for host, plan in plans.items():
+        if plan["predicted"] is False:
+            print(f"Warning: the fanout change of {host} can't be predicted, its manifest was planned against the "
+                  "config before it", file=sys.stderr)
+
+    if args.format == "json":
+        json.dump(plans, sys.stdout, indent=2)
+        print()
+    else:
+        for host, plan in plans.items():
+            print_plan(host, plan)
+
+
+if __name__ == "__main__":
+    main()
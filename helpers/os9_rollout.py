@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Offline schedule of the os9_rolling strategy
+
+Loads the peer group and tier of each host from its vars files like the strategy does, and prints the waves the
+deploy would run if every switch took the same time. Members of a peer group are never in the same wave, and a
+wave never has more hosts of a tier than its limit.
+
+Usage:
+    helpers/os9_rollout.py [--host HOST ...] [--inventory FILE] [--format text|json]
+
+Hosts given with --host don't have to be in the inventory (ex. to check hosts that are commented out).
+"""
+
+import argparse
+import json
+import os
+import sys
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, os.path.join(REPO_DIR, "strategy_plugins"))
+from os9_manifest import host_vars_files, load_inventory, load_vars_file  # noqa: E402
+from os9_rolling import RollingScheduler, host_slot  # noqa: E402
+
+
+def load_host_vars(repo_dir, host, groups):
+    host_vars = {}
+    for path in host_vars_files(repo_dir, host, groups):
+        host_vars.update(load_vars_file(path))
+
+    return host_vars
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the waves of the os9_rolling deploy strategy")
+    parser.add_argument("--host", action="append", help="Host to schedule (can be repeated, default: every host)")
+    parser.add_argument("--inventory", default=os.path.join(REPO_DIR, "hosts"), help="Inventory file")
+    parser.add_argument("--format", choices=["text", "json"], default="text", help="Output format")
+    args = parser.parse_args()
+
+    inventory = load_inventory(args.inventory)
+    host_list = args.host or list(inventory)
+
+    hosts = {}
+    tier_limits = {}
+    for host in host_list:
+        host_vars = load_host_vars(REPO_DIR, host, inventory.get(host, {}).get("groups", []))
+        hosts[host] = host_slot(host, host_vars)
+        tier_limits.update(host_vars.get("os9_tier_limits") or {})
+
+    scheduler = RollingScheduler(hosts, tier_limits)
+    waves = scheduler.waves()
+
+    if args.format == "json":
+        print(json.dumps({
+            "hosts": {host: {"peer_group": group, "tier": tier, "site": site}
+                      for host, (group, tier, site) in hosts.items()},
+            "tier_limits": scheduler.tier_limits,
+            "waves": waves
+        }, indent=2))
+        return
+
+    for number, wave in enumerate(waves, start=1):
+        print(f"Wave {number}:")
+        for host in wave:
+            group, tier, site = hosts[host]
+            print(f"  {host:<24} peer group {group:<20} tier {site} {tier or '-'}")
+
+
+if __name__ == "__main__":
+    main()
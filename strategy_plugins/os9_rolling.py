@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import math
+import re
+
+from ansible.plugins.strategy.free import StrategyModule as FreeStrategyModule
+from ansible.template import Templar
+from ansible.utils.display import Display
+
+DOCUMENTATION = """
+    name: os9_rolling
+    short_description: Runs switches in parallel, but never both members of a VLT pair or too many of a tier
+    description:
+      - Works like the free strategy, except a host only starts the play when no other member of its peer group is
+        running and its tier is below its limit. A host holds its slot until it is done with the play (handlers
+        included, so the config is saved before its peer is touched).
+      - The peer group of a host is C(os9_peer_group) if it is set. Otherwise it is its name without a C(-A) / C(-B)
+        suffix (C(OCT9-SW-TORS-A) and C(OCT9-SW-TORS-B) are C(OCT9-SW-TORS)), or for a host with an C(mlag)
+        interface and a numbered name, the odd and even numbers are paired (C(OCT-CORE-1) with C(OCT-CORE-2)).
+        Any other host is a group of its own.
+      - The tier of a host is C(os9_tier) if it is set, otherwise C(core) or C(mcore) for C(*-CORE-N) /
+        C(*-MCORE-N) and the lowercase role for C(*-SW-ROLE) names (C(tors), C(mgmt), ...).
+        C(os9_tier_limits) (dict of tier -> hosts at a time, 0 for no limit) is merged over the defaults
+        (C(core) and C(mcore) are 1, other tiers have no limit).
+      - Tier limits are per site, C(os9_site) if it is set, otherwise the letters the name starts with
+        (C(OCT) for C(OCT9-SW-TORS-A), C(MOC) for C(MOC-CORE-1)). One MOC core and one OCT core can run together.
+      - If a host fails or is unreachable, the members of its peer group that haven't started are held: they
+        aren't run or contacted, and aren't counted as failed. A warning names them when they are held and at the
+        end of the play (they are missing from the recap).
+      - Hosts whose peer group or tier is the most constrained are started first.
+      - These variables are read from the inventory (host_vars, group_vars) and extra vars, not from the play.
+      - Tested with ansible-core 2.19 (see requirements.txt); it relies on how the free strategy tracks the hosts
+        that have a task running.
+    author: MOC/OCT
+"""
+
+DEFAULT_TIER_LIMITS = {"core": 1, "mcore": 1}
+
+# Peer switches of a VLT pair, ex. OCT9-SW-TORS-A / OCT9-SW-TORS-B
+PAIR_SUFFIX_RE = re.compile(r"^(?P<group>.+)-[AB]$", re.IGNORECASE)
+# Numbered switches, paired odd/even if they have an mlag interface, ex. OCT-CORE-1 / OCT-CORE-2
+NUMBERED_RE = re.compile(r"^(?P<group>.+)-(?P<number>\d+)$")
+SITE_RE = re.compile(r"^[A-Z]+", re.IGNORECASE)
+CORE_RE = re.compile(r"-(?P<tier>M?CORE)-\d+$", re.IGNORECASE)
+ROLE_RE = re.compile(r"-SW-(?P<tier>[A-Z]+)(-[AB])?$", re.IGNORECASE)
+
+display = Display()
+
+
+def has_mlag(interfaces):
+    """
+    Checks if an interface manifest has an mlag (VLT) port-channel
+    """
+
+    if not isinstance(interfaces, dict):
+        return False
+
+    return any(isinstance(fields, dict) and fields.get("mlag") for fields in interfaces.values())
+
+
+def peer_group(host, host_vars):
+    """
+    Peer group of a host, hosts of the same group never run at the same time
+
+    :param host: Inventory hostname
+    :type host: str
+    :param host_vars: Variables of the host (os9_peer_group, interfaces)
+    :type host_vars: dict
+    :return: Name of the peer group
+    :rtype: str
+    """
+
+    if host_vars.get("os9_peer_group"):
+        return str(host_vars["os9_peer_group"])
+
+    match = PAIR_SUFFIX_RE.match(host)
+    if match:
+        return match.group("group")
+
+    match = NUMBERED_RE.match(host)
+    if match and has_mlag(host_vars.get("interfaces")):
+        first = (int(match.group("number")) - 1) | 1  # odd number of the pair
+        return f"{match.group('group')}-{first}/{first + 1}"
+
+    return host
+
+
+def host_tier(host, host_vars):
+    """
+    Tier of a host, at most os9_tier_limits[tier] hosts of a tier run at the same time
+
+    :return: Name of the tier, or None if it has none
+    :rtype: str
+    """
+
+    if host_vars.get("os9_tier"):
+        return str(host_vars["os9_tier"])
+
+    match = CORE_RE.search(host) or ROLE_RE.search(host)
+    if match:
+        return match.group("tier").lower()
+
+    return None
+
+
+def host_site(host, host_vars):
+    """
+    Site of a host, tier limits are counted per site
+
+    :rtype: str
+    """
+
+    if host_vars.get("os9_site"):
+        return str(host_vars["os9_site"])
+
+    match = SITE_RE.match(host)
+    return match.group(0).upper() if match else host
+
+
+def host_slot(host, host_vars):
+    """
+    Peer group, tier and site of a host, as RollingScheduler takes them
+
+    :rtype: tuple
+    """
+
+    return peer_group(host, host_vars), host_tier(host, host_vars), host_site(host, host_vars)
+
+
+class RollingScheduler:
+    """
+    Decides which hosts can start, from their peer groups and tiers
+
+    Doesn't depend on how the hosts are run, so the schedule can be checked offline (see helpers/os9_rollout.py).
+    """
+
+    def __init__(self, hosts, tier_limits=None):
+        """
+        :param hosts: Dict of hostname -> (peer group, tier, site) (see host_slot), in inventory order
+        :type hosts: dict
+        :param tier_limits: Dict of tier -> hosts at a time (0 for no limit), merged over DEFAULT_TIER_LIMITS
+        :type tier_limits: dict
+        """
+
+        self.hosts = hosts
+        self.tier_limits = dict(DEFAULT_TIER_LIMITS, **(tier_limits or {}))
+
+        self.waiting = list(hosts)
+        self.active = set()
+        self.done = set()
+        self.held = set()
+
+        self.active_groups = set()
+        self.active_tiers = {}  # (site, tier) -> active hosts
+
+    def _limit(self, tier):
+        return int(self.tier_limits.get(tier) or 0) if tier is not None else 0
+
+    def _priority(self, host):
+        # a host of a large group or of a limited tier with many hosts left is started first, the end of the run
+        # is bounded by them
+        group, tier, site = self.hosts[host]
+        group_left = sum(1 for other in self.waiting if self.hosts[other][0] == group)
+
+        tier_rounds = 0
+        limit = self._limit(tier)
+        if limit:
+            tier_left = sum(1 for other in self.waiting if self.hosts[other][1:] == (tier, site))
+            tier_rounds = math.ceil(tier_left / limit)
+
+        return -max(group_left, tier_rounds)
+
+    def can_start(self, host):
+        group, tier, site = self.hosts[host]
+        limit = self._limit(tier)
+
+        return group not in self.active_groups and not (limit and self.active_tiers.get((site, tier), 0) >= limit)
+
+    def admit(self):
+        """
+        Starts every waiting host that can run now
+
+        :return: Hostnames that were started
+        :rtype: list
+        """
+
+        started = []
+        for host in sorted(self.waiting, key=self._priority):
+            if not self.can_start(host):
+                continue
+
+            group, tier, site = self.hosts[host]
+            self.active.add(host)
+            self.active_groups.add(group)
+            self.active_tiers[site, tier] = self.active_tiers.get((site, tier), 0) + 1
+            started.append(host)
+
+        for host in started:
+            self.waiting.remove(host)
+
+        return started
+
+    def release(self, host):
+        """
+        Marks a running host as done, freeing its peer group and tier slot
+        """
+
+        group, tier, site = self.hosts[host]
+        self.active.discard(host)
+        self.active_groups.discard(group)
+        self.active_tiers[site, tier] -= 1
+        self.done.add(host)
+
+    def hold_peers(self, host):
+        """
+        Moves the waiting members of the peer group of a host to held, so they are never started
+
+        :return: Hostnames that were held
+        :rtype: list
+        """
+
+        group = self.hosts[host][0]
+        held = [other for other in self.waiting if self.hosts[other][0] == group]
+        for other in held:
+            self.waiting.remove(other)
+            self.held.add(other)
+
+        return held
+
+    def can_run(self, host):
+        """
+        Checks if a host has been started, or is done (hosts waiting for a slot and held hosts can't run)
+        """
+
+        return host in self.active or host in self.done
+
+    def waves(self):
+        """
+        Simulates the run assuming every host takes the same time
+
+        :return: List of lists of hostnames that run together
+        :rtype: list
+        """
+
+        waves = []
+        while self.waiting:
+            wave = self.admit()
+            waves.append(wave)
+            for host in wave:
+                self.release(host)
+
+        return waves
+
+
+class StrategyModule(FreeStrategyModule):
+
+    def __init__(self, tqm):
+        super().__init__(tqm)
+        self._scheduler = None
+
+    def _host_vars(self, host):
+        task_vars = self._variable_manager.get_vars(host=host, _hosts=self._hosts_cache,
+                                                    _hosts_all=self._hosts_cache_all)
+        templar = Templar(loader=self._loader, variables=task_vars)
+
+        # interfaces is only checked for mlag, it isn't templated
+        host_vars = {"interfaces": task_vars.get("interfaces")}
+        for key in ["os9_peer_group", "os9_tier", "os9_site", "os9_tier_limits"]:
+            if key in task_vars:
+                host_vars[key] = templar.template(task_vars[key])
+
+        return host_vars
+
+    def _build_scheduler(self):
+        hosts = {}
+        mlag_hosts = []
+        tier_limits = {}
+
+        for host_name in self._hosts_cache:
+            host_vars = self._host_vars(self._inventory.get_host(host_name))
+            hosts[host_name] = host_slot(host_name, host_vars)
+            tier_limits.update(host_vars.get("os9_tier_limits") or {})
+            if has_mlag(host_vars["interfaces"]):
+                mlag_hosts.append(host_name)
+
+        for group in sorted({slot[0] for slot in hosts.values()}):
+            members = [host for host, slot in hosts.items() if slot[0] == group]
+            if len(members) > 1:
+                display.v(f"os9_rolling: peer group {group}: {', '.join(members)}")
+
+        for host_name in mlag_hosts:
+            # fine if its peer isn't in this play, but it may also need os9_peer_group
+            if sum(1 for slot in hosts.values() if slot[0] == hosts[host_name][0]) == 1:
+                display.vv(f"os9_rolling: {host_name} has an mlag interface, but no peer in this play")
+
+        return RollingScheduler(hosts, tier_limits)
+
+    def run(self, iterator, play_context):
+        # built by the first get_hosts_left, once the free strategy has set the hosts of the play
+        self._scheduler = None
+
+        result = super().run(iterator, play_context)
+
+        if self._scheduler is not None and self._scheduler.held:
+            display.warning(f"os9_rolling: not run because a peer failed or is unreachable: "
+                            f"{', '.join(sorted(self._scheduler.held))}")
+
+        return result
+
+    def _is_done(self, iterator, host):
+        # _blocked_hosts is the free strategy's record of the hosts with a task running, a host whose last task
+        # (or handler) is still running isn't done
+        if self._blocked_hosts.get(host.name, False):
+            return False
+
+        return iterator.get_next_task_for_host(host, peek=True)[1] is None
+
+    def get_hosts_left(self, iterator):
+        # the unreachable hosts are already left out
+        hosts_left = super().get_hosts_left(iterator)
+        reachable = {host.name for host in hosts_left}
+
+        if self._scheduler is None:
+            self._scheduler = self._build_scheduler()
+        scheduler = self._scheduler
+
+        for host_name in sorted(scheduler.active):
+            host = self._inventory.get_host(host_name)
+            unreachable = host_name not in reachable
+            if not unreachable and not self._is_done(iterator, host):
+                continue
+
+            scheduler.release(host_name)
+
+            if unreachable or iterator.is_failed(host):
+                # its peer may be the only half of the pair left, don't touch it
+                for peer_name in scheduler.hold_peers(host_name):
+                    display.warning(f"os9_rolling: {peer_name} is held and won't run, its peer {host_name} "
+                                    f"{'is unreachable' if unreachable else 'failed'}")
+
+        for host_name in scheduler.admit():
+            display.v(f"os9_rolling: starting {host_name}")
+
+        return [host for host in hosts_left if scheduler.can_run(host.name)]
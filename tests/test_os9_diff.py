@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Pushes the plans of the OS9 diff engine (OS9Diff) to the switch emulator and checks the configs they leave
+
+The bench fixture holds the sha256 of the config the deploy of the original filter plugin (2a77e7a, before any of
+the planner changes) leaves on an emulated switch, for benchmark scenarios it plans in reasonable time. The same
+switch reconciled like os9_reconcile does must end up with the same config. The case fixture is a manifest that
+spells port-channels, VLANs and ports in another case than the switch, with the config it must leave (the original
+filter deletes Port-channel 10 instead).
+
+Usage:
+    python3 -m pytest tests
+    python3 tests/test_os9_diff.py --write-fixtures OLD_DELL_OS9_PY
+    python3 tests/test_os9_diff.py --compare OLD_DELL_OS9_PY [SCENARIO/SEED ...]
+
+--write-fixtures rewrites the bench fixture with the deploy of another filter plugin, and --compare prints how
+the config it leaves differs from the one of the current planner. The original filter plugin is:
+    git show 2a77e7a:filter_plugins/dell_os9.py > /tmp/dell_os9_base.py
+"""
+
+import argparse
+import difflib
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import unittest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+sys.path.insert(0, os.path.join(REPO_DIR, "filter_plugins"))
+sys.path.insert(0, os.path.join(REPO_DIR, "helpers"))
+import dell_os9  # noqa: E402
+from os9_bench import SCENARIOS, generate  # noqa: E402
+from os9_emulator import OS9Session, OS9Switch  # noqa: E402
+
+BENCH_FIXTURE = os.path.join(FIXTURES_DIR, "os9_push_bench.json")
+CASE_FIXTURE = os.path.join(FIXTURES_DIR, "os9_diff_case.json")
+
+HOSTNAME = "os9-test"
+GLOBAL_LINES = [line.format(hostname=HOSTNAME) for line in dell_os9.os9_global_lines]
+
+# Scenarios and seeds of the bench fixture. The original filter takes too long to plan stack-4-full, and its deploy
+# of stack-2 seed 1 defaults a fortyGigE port the fanout already removed, which the switch rejects.
+BENCH_CASES = ["core-100g/0", "core-100g/1", "stack-2/0", "tor-48/0", "tor-48/1"]
+
+
+def facts(switch):
+    """
+    Running config of an emulated switch, in the same format as os9_facts
+    """
+
+    return {"ansible_facts": {"ansible_net_config": switch.render(), "ansible_net_hostname": HOSTNAME}}
+
+
+def push(switch, blocks):
+    """
+    Sends blocks of commands to an emulated switch, each in its own configure session
+
+    :return: (block, line, error) of each line the switch rejected
+    :rtype: list
+    """
+
+    errors = []
+    session = OS9Session(switch)
+    for block in blocks:
+        for line in ["configure terminal"] + block + ["end"]:
+            out = session.execute(line)
+            if out.startswith("%"):
+                errors.append((block[0], line, out))
+                session.execute("end")
+                break
+
+    return errors
+
+
+def reconcile(switch, interfaces, vlans):
+    """
+    Pushes a manifest to an emulated switch like os9_reconcile
+
+    :return: Tuple of (plan, rejected lines)
+    :rtype: tuple
+    """
+
+    plan, after_fanout = dell_os9.os9_planfanout(facts(switch), interfaces, GLOBAL_LINES)
+
+    errors = push(switch, [plan["global"]] if plan["global"] else [])
+    errors += push(switch, [[line] for line in plan["fanout"]])
+
+    # gathered again when the fanout change can't be predicted
+    dell_os9.os9_planmanifest(plan, after_fanout if after_fanout is not None else facts(switch), interfaces, vlans)
+
+    errors += push(switch, plan["config"])
+    errors += push(switch, [[line] for line in plan["clean"]])
+
+    return plan, errors
+
+
+def deploy_filters(planner, switch, interfaces, vlans):
+    """
+    Pushes a manifest to an emulated switch like the deploy of the original filter plugin: the global lines, the
+    fanout, then the manifest and the deleted interfaces planned against the config gathered after the fanout
+
+    :return: Rejected lines
+    :rtype: list
+    """
+
+    errors = push(switch, [[line] for line in GLOBAL_LINES])
+    errors += push(switch, [[line] for line in planner.OS9_FANOUTCFG(facts(switch), interfaces)])
+
+    sw_config = facts(switch)
+    errors += push(switch, planner.OS9_GETCONFIG(sw_config, interfaces, vlans))
+    errors += push(switch, [[line] for line in planner.OS9_CLEANINTF(sw_config, interfaces, vlans)])
+
+    return errors
+
+
+def config_digest(config_text):
+    return hashlib.sha256(config_text.encode()).hexdigest()
+
+
+def bench_switch(key):
+    """
+    Emulated switch and manifests of a benchmark scenario, keyed as NAME/SEED
+    """
+
+    name, seed = key.split("/")
+    config_text, interfaces, vlans = generate(SCENARIOS[name], seed=int(seed))
+
+    return OS9Switch(HOSTNAME, config_text), interfaces, vlans
+
+
+def load_case():
+    """
+    Loads the case fixture (configs are listed line by line)
+    """
+
+    with open(CASE_FIXTURE) as f:
+        case = json.load(f)
+
+    case["running_config"] = "\n".join(case["running_config"])
+    case["config"] = "\n".join(case["config"])
+    # JSON keys are strings, manifests key VLANs by number
+    case["vlans"] = {int(vlan_id): fields for vlan_id, fields in case["vlans"].items()}
+
+    return case
+
+
+def load_planner(path):
+    spec = importlib.util.spec_from_file_location("os9_fixture_planner", path)
+    planner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(planner)
+
+    return planner
+
+
+class PushTestCase(unittest.TestCase):
+
+    def assertConverged(self, switch, interfaces, vlans):
+        """
+        Checks that nothing is left to push once the plan was pushed
+        """
+
+        plan = dell_os9.os9_reconcileplan(facts(switch), interfaces, vlans, GLOBAL_LINES)
+        self.assertEqual({stage: plan[stage] for stage in ["global", "fanout", "config", "clean"]},
+                         {"global": [], "fanout": [], "config": [], "clean": []})
+
+
+class BenchPushTest(PushTestCase):
+    """
+    The benchmark scenarios leave the config the original filter plugin leaves
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        with open(BENCH_FIXTURE) as f:
+            cls.fixture = json.load(f)
+
+    def test_scenarios(self):
+        self.assertEqual(sorted(self.fixture["configs"]), sorted(BENCH_CASES))
+
+        for key, expected in sorted(self.fixture["configs"].items()):
+            with self.subTest(scenario=key):
+                switch, interfaces, vlans = bench_switch(key)
+                plan, errors = reconcile(switch, interfaces, vlans)
+
+                self.assertEqual(errors, [])
+                config_text = switch.render()
+                self.assertEqual(config_digest(config_text), expected["sha256"],
+                                 f"{key} leaves another config than the original filter plugin, see "
+                                 f"python3 tests/test_os9_diff.py --compare OLD_DELL_OS9_PY {key}")
+                self.assertConverged(switch, interfaces, vlans)
+
+
+class CaseInsensitiveTest(PushTestCase):
+    """
+    A manifest that spells port-channels, VLANs and ports in another case than the switch is matched to the
+    interfaces of the running config
+    """
+
+    def setUp(self):
+        self.case = load_case()
+        self.switch = OS9Switch(HOSTNAME, self.case["running_config"])
+        self.plan, self.errors = reconcile(self.switch, self.case["interfaces"], self.case["vlans"])
+
+    def test_config(self):
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.switch.render().splitlines(), self.case["config"].splitlines())
+        self.assertConverged(self.switch, self.case["interfaces"], self.case["vlans"])
+
+    def test_existing_interfaces(self):
+        # nothing is recreated, defaulted or deleted because of the case of its label
+        for block in self.plan["config"]:
+            self.assertFalse([line for line in block if line.startswith(("default interface", "no interface"))])
+        self.assertEqual(self.plan["clean"], [])
+
+        # lines and memberships that are on the switch aren't sent again
+        sent = {}
+        for block in self.plan["config"]:
+            sent.setdefault(block[0].lower(), []).extend(block[1:])
+        self.assertEqual(sent["interface port-channel 10"], ["description lag"])
+        self.assertEqual(sent["interface vlan 20"], ["name twenty"])
+
+
+def write_fixtures(planner_path):
+    """
+    Rewrites the bench fixture with the deploy of the filter plugin at a path
+    """
+
+    planner = load_planner(planner_path)
+
+    configs = {}
+    for key in BENCH_CASES:
+        switch, interfaces, vlans = bench_switch(key)
+        errors = deploy_filters(planner, switch, interfaces, vlans)
+        if errors:
+            sys.exit(f"{key}: the switch rejected {errors[0]}")
+
+        config_text = switch.render()
+        configs[key] = {"sha256": config_digest(config_text), "lines": len(config_text.splitlines())}
+        print(f"{key}: {configs[key]['lines']} lines", file=sys.stderr)
+
+    with open(BENCH_FIXTURE, "w") as f:
+        json.dump({"planner": os.path.basename(planner_path), "configs": configs}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(planner_path, keys):
+    """
+    Prints how the config the deploy of the filter plugin at a path leaves differs from the one of the current
+    planner
+    """
+
+    planner = load_planner(planner_path)
+
+    for key in keys or BENCH_CASES:
+        switch, interfaces, vlans = bench_switch(key)
+        deploy_filters(planner, switch, interfaces, vlans)
+
+        current, interfaces, vlans = bench_switch(key)
+        reconcile(current, interfaces, vlans)
+
+        diff = list(difflib.unified_diff(switch.render().splitlines(), current.render().splitlines(),
+                                         f"{key} {os.path.basename(planner_path)}", f"{key} current", lineterm=""))
+        print("\n".join(diff) if diff else f"{key}: same config")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the configs the OS9 diff engine leaves on the emulator")
+    parser.add_argument("--write-fixtures", metavar="PLANNER", help="Rewrite the bench fixture with this dell_os9.py")
+    parser.add_argument("--compare", metavar="PLANNER", help="Diff the configs this dell_os9.py leaves against the "
+                                                             "current planner")
+    args, unittest_args = parser.parse_known_args()
+
+    if args.write_fixtures:
+        write_fixtures(args.write_fixtures)
+    elif args.compare:
+        compare(args.compare, unittest_args)
+    else:
+        unittest.main(argv=[sys.argv[0]] + unittest_args)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Runs the os9_rolling strategy plugin in ansible-playbook, against hosts on the local connection
+
+Each host logs when it starts the play and when its handler (the config save of the deploy) is done, so the test
+can check that members of a peer group never run at the same time, and that the peer of a failed host is held.
+
+Usage:
+    python3 -m pytest tests
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import yaml
+from ansible.release import __version__ as ansible_version
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, os.path.join(REPO_DIR, "strategy_plugins"))
+from os9_rolling import RollingScheduler, host_slot  # noqa: E402
+
+# Minor version of ansible-core requirements.txt pins
+SUPPORTED_ANSIBLE = (2, 19)
+
+MLAG = {"Port-channel 10": {"mlag": "Port-channel 10"}}
+
+HOSTS = {
+    "OCT9-SW-TORS-A": {},
+    "OCT9-SW-TORS-B": {},
+    "OCT5-SW-TORS-A": {},
+    "OCT5-SW-TORS-B": {},
+    "OCT5-SW-MGMT": {},
+    "MOC-CORE-1": {"interfaces": MLAG},
+    "MOC-CORE-2": {"interfaces": MLAG},
+    "MOC-CORE-3": {"interfaces": MLAG},
+    "MOC-CORE-4": {"interfaces": MLAG},
+}
+
+PLAY = [{
+    "hosts": "all",
+    "gather_facts": False,
+    "strategy": "os9_rolling",
+    "tasks": [
+        {"ansible.builtin.shell": "echo start {{ inventory_hostname }} >> {{ log_path }}", "changed_when": True,
+         "notify": "Save Config"},
+        {"ansible.builtin.fail": {"msg": "failed on purpose"},
+         "when": "inventory_hostname == fail_host | default('')"},
+        {"ansible.builtin.shell": "sleep 0.2"},
+    ],
+    "handlers": [
+        {"name": "Save Config",
+         "ansible.builtin.shell": "sleep 0.2; echo end {{ inventory_hostname }} >> {{ log_path }}"},
+    ],
+}]
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = {host: host_slot(host, host_vars) for host, host_vars in HOSTS.items()}
+
+    def test_waves(self):
+        waves = RollingScheduler(self.hosts).waves()
+
+        self.assertEqual(sorted(host for wave in waves for host in wave), sorted(HOSTS))
+        for wave in waves:
+            groups = [self.hosts[host][0] for host in wave]
+            self.assertEqual(len(groups), len(set(groups)), wave)
+            # one core per site at a time
+            self.assertLessEqual(sum(1 for host in wave if self.hosts[host][1] == "core"), 1, wave)
+
+    def test_hold_peers(self):
+        scheduler = RollingScheduler(self.hosts)
+        started = scheduler.admit()
+        self.assertIn("OCT9-SW-TORS-A", started)
+        self.assertNotIn("OCT9-SW-TORS-B", started)
+
+        scheduler.release("OCT9-SW-TORS-A")
+        self.assertEqual(scheduler.hold_peers("OCT9-SW-TORS-A"), ["OCT9-SW-TORS-B"])
+        self.assertNotIn("OCT9-SW-TORS-B", scheduler.admit())
+        self.assertFalse(scheduler.can_run("OCT9-SW-TORS-B"))
+        self.assertTrue(scheduler.can_run("OCT9-SW-TORS-A"))
+
+
+@unittest.skipIf(shutil.which("ansible-playbook") is None, "ansible-playbook isn't installed")
+class PlaybookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, "log")
+
+        inventory = {"all": {"vars": {"ansible_connection": "local", "ansible_python_interpreter": sys.executable},
+                             "hosts": HOSTS}}
+        with open(os.path.join(self.tmp_dir, "inventory.yaml"), "w") as f:
+            yaml.safe_dump(inventory, f)
+        with open(os.path.join(self.tmp_dir, "play.yaml"), "w") as f:
+            yaml.safe_dump(PLAY, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_play(self, *extra_vars):
+        env = dict(os.environ, ANSIBLE_STRATEGY_PLUGINS=os.path.join(REPO_DIR, "strategy_plugins"),
+                   ANSIBLE_DEPRECATION_WARNINGS="false", ANSIBLE_NOCOLOR="true")
+        command = ["ansible-playbook", "-i", "inventory.yaml", "play.yaml", "--forks", "10",
+                   "-e", f"log_path={self.log_path}"]
+        for extra_var in extra_vars:
+            command += ["-e", extra_var]
+
+        # stdin/stdout as pipes, ansible refuses non-blocking ones
+        out = subprocess.run(command, cwd=self.tmp_dir, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, text=True)
+
+        events = []
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                events = [tuple(line.split()) for line in f]
+
+        return out, events
+
+    def assertPeersApart(self, events, failed=()):
+        """
+        Checks that no host started while a member of its peer group (or another core of the site) ran. A failed
+        host never logs its end, it is only checked when it starts.
+        """
+
+        hosts = {host: host_slot(host, host_vars) for host, host_vars in HOSTS.items()}
+        running = set()
+        for event, host in events:
+            if event == "start":
+                for other in running:
+                    self.assertNotEqual(hosts[host][0], hosts[other][0], f"{host} started while {other} ran")
+                    self.assertFalse(hosts[host][1] == hosts[other][1] == "core", f"{host} started while {other} ran")
+                if host not in failed:
+                    running.add(host)
+            else:
+                running.discard(host)
+
+    def test_supported_version(self):
+        self.assertEqual(tuple(int(part) for part in ansible_version.split(".")[:2]), SUPPORTED_ANSIBLE)
+
+    def test_peers_apart(self):
+        out, events = self.run_play()
+
+        self.assertEqual(out.returncode, 0, out.stdout)
+        self.assertEqual(sorted(host for event, host in events if event == "end"), sorted(HOSTS))
+        self.assertPeersApart(events)
+
+    def test_failed_peer_held(self):
+        out, events = self.run_play("fail_host=MOC-CORE-1")
+
+        self.assertEqual(out.returncode, 2, out.stdout)
+        started = [host for event, host in events if event == "start"]
+        self.assertIn("MOC-CORE-1", started)
+        self.assertNotIn("MOC-CORE-2", started)
+        self.assertEqual(sorted(started), sorted(set(HOSTS) - {"MOC-CORE-2"}))
+        self.assertPeersApart(events, failed=["MOC-CORE-1"])
+
+        # held, not failed
+        self.assertRegex(out.stdout, r"MOC-CORE-2 is held and won't run, its peer MOC-CORE-1 failed")
+        self.assertNotRegex(out.stdout, re.compile(r"^MOC-CORE-2\s+:", re.MULTILINE))
+        self.assertRegex(out.stdout, re.compile(r"^MOC-CORE-1\s+:.*failed=1", re.MULTILINE))
+
+
+if __name__ == "__main__":
+    unittest.main()